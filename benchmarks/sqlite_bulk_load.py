@@ -0,0 +1,100 @@
+"""
+Compares ETL runs on a file-backed SQLite database with and without the bulk load
+profile (see :mod:`capmetrics_etl.engines`).
+
+The synthetic test workbooks are parsed once, then their extractions are loaded
+alternately into a fresh database per configuration, so the timings cover the
+database work only. A scale above one copies every route under new route numbers
+to grow the workload. A positive ``routes`` count keeps only that many routes of
+each workbook, like the small incremental files the ETL service loads one job at a
+time. Run it from the repository root::
+
+    PYTHONPATH=. python benchmarks/sqlite_bulk_load.py [runs] [scale] [routes]
+
+Full workbook runs are dominated by transform and document work, and the profile
+makes no measurable difference there. Small incremental runs do little work per
+commit, so the syncs the profile avoids are a large part of them, for example::
+
+    PYTHONPATH=. python benchmarks/sqlite_bulk_load.py 200 1 1
+"""
+import contextlib
+import configparser
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import cli, engines, etl, sources
+
+WORKBOOKS = ['tests/data/test_cmta_data.xls', 'tests/data/test_cmta_updated_data.xls']
+
+
+def get_configuration():
+    config_parser = configparser.ConfigParser()
+    config_parser.optionxform = str
+    config_parser.read('tests/capmetrics.ini')
+    return cli.parse_capmetrics_configuration(config_parser)
+
+
+def scale_extraction(extraction, scale):
+    scaled = {'routes': []}
+    for worksheet_routes in extraction['routes']:
+        routes = [dict(route_info, route_number=str(int(route_info['route_number']) + copy * 10000))
+                  for copy in range(scale) for route_info in worksheet_routes['routes']]
+        scaled['routes'].append(dict(worksheet_routes, routes=routes))
+    for metric in sources.RIDERSHIP_MODELS:
+        scaled[metric] = [dict(fact, route_number=fact['route_number'] + copy * 10000)
+                          for copy in range(scale) for fact in extraction[metric]]
+    return scaled
+
+
+def limit_extraction(extraction, routes):
+    kept = {'routes': []}
+    route_numbers = set()
+    for worksheet_routes in extraction['routes']:
+        worksheet_routes = dict(worksheet_routes, routes=worksheet_routes['routes'][:routes])
+        route_numbers.update(int(route_info['route_number']) for route_info in worksheet_routes['routes'])
+        kept['routes'].append(worksheet_routes)
+    for metric in sources.RIDERSHIP_MODELS:
+        kept[metric] = [fact for fact in extraction[metric] if int(fact['route_number']) in route_numbers]
+    return kept
+
+
+def time_loads(configuration, extractions, runs, sqlite_bulk_load):
+    directory = tempfile.mkdtemp(dir='.')
+    try:
+        configuration = dict(configuration,
+                             engine_url='sqlite:///{0}'.format(os.path.join(directory, 'capmetrics.db')),
+                             sqlite_bulk_load=sqlite_bulk_load)
+        engine = engines.create_configured_engine(configuration)
+        etl.create_tables(engine)
+        Session = sessionmaker(bind=engine)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run in range(runs):
+                session = Session()
+                etl.run_etl_stages(extractions[run % len(extractions)], session, configuration)
+                session.close()
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+        return elapsed
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(runs=20, scale=1, routes=0):
+    configuration = get_configuration()
+    extractions = [etl.extract_workbook(os.path.abspath(workbook), configuration) for workbook in WORKBOOKS]
+    if routes > 0:
+        extractions = [limit_extraction(extraction, routes) for extraction in extractions]
+    extractions = [scale_extraction(extraction, scale) for extraction in extractions]
+    for sqlite_bulk_load in (False, True):
+        elapsed = time_loads(configuration, extractions, runs, sqlite_bulk_load)
+        print('{0:<8} {1} runs at scale {2}: {3:.3f}s ({4:.1f} ms/run)'.format(
+            'bulk' if sqlite_bulk_load else 'default', runs, scale, elapsed, 1000 * elapsed / runs))
+
+
+if __name__ == '__main__':
+    main(*[int(argument) for argument in sys.argv[1:]])
@@ -1,10 +1,17 @@
+"""
+Command line entry points.
+
+Scheduled health checks call the commands with ``--test`` often, so this module only
+imports ``click`` and the standard library at load time. SQLAlchemy, xlrd, NumPy and
+the ETL modules are imported inside the commands that use them.
+"""
 import click
 import configparser
+import contextlib
 import json
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from capmetrics_etl.etl import create_tables, run_excel_etl, update_perfdocs
-from capmetrics_etl.quality import check_quality
+import logging
+
+DEFAULT_PROFILE_DIRECTORY = 'capmetrics-profile'
 
 
 def parse_capmetrics_configuration(config_parser):
@@ -13,69 +20,146 @@ def parse_capmetrics_configuration(config_parser):
     capmetrics_configuration = {
         'engine_url': config_parser['capmetrics']['engine_url'],
         'daily_ridership_worksheets': daily_worksheets,
-        'hour_productivity_worksheets': hourly_worksheets
+        'hour_productivity_worksheets': hourly_worksheets,
+        'layout_cache': config_parser['capmetrics'].get('layout_cache'),
+        'low_memory': config_parser['capmetrics'].getboolean('low_memory', False),
+        'load_strategy': config_parser['capmetrics'].get('load_strategy', 'replace'),
+        'sqlite_bulk_load': config_parser['capmetrics'].getboolean('sqlite_bulk_load', False),
+        'pool_size': config_parser['capmetrics'].getint('pool_size'),
+        'pool_recycle': config_parser['capmetrics'].getint('pool_recycle')
     }
     return capmetrics_configuration
 
 
+def create_session(capmetrics_configuration):
+    """
+    Creates a session bound to the configured database and creates any missing tables.
+
+    Args:
+        capmetrics_configuration (dict): Parsed configuration.
+
+    Returns:
+        A SQLAlchemy session.
+    """
+    from sqlalchemy.orm import sessionmaker
+    from capmetrics_etl.engines import create_configured_engine
+    from capmetrics_etl.etl import create_tables
+    engine = create_configured_engine(capmetrics_configuration)
+    # only creates the tables that are missing
+    create_tables(engine)
+    Session = sessionmaker()
+    Session.configure(bind=engine)
+    return Session()
+
+
+def serve(inbox, config, interval, once):
+    from capmetrics_etl.service import ETLService
+    # job progress goes to the service's logger
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    config_parser = configparser.ConfigParser()
+    # make parsing of config file names case-sensitive
+    config_parser.optionxform = str
+    config_parser.read(config)
+    capmetrics_configuration = parse_capmetrics_configuration(config_parser)
+    service = ETLService(capmetrics_configuration, inbox)
+    click.echo('Capmetrics ETL service watching {0}...'.format(service.inbox))
+    try:
+        service.serve(interval=interval, once=once)
+    except KeyboardInterrupt:
+        pass
+    click.echo('Capmetrics ETL service stopped.')
+
+
 @click.command()
 @click.argument('file')
-@click.argument('config')
-@click.option('--perfdocs', is_flag=True)
+@click.argument('config', required=False)
+@click.option('--batch', is_flag=True,
+              help='Treat FILE as a directory or glob pattern of data files.')
+@click.option('--low-memory', is_flag=True,
+              help='Load only the configured worksheets, one at a time.')
+@click.option('--perfdocs', is_flag=True,
+              help='Only refresh performance documents. The data FILE may be omitted.')
+@click.option('--watch', is_flag=True,
+              help='Treat FILE as an inbox directory and load data files as they are dropped into it.')
+@click.option('--profile', is_flag=True,
+              help='Profile the run stages and write the results to the --profile-out directory.')
+@click.option('--profile-out', type=click.Path(file_okay=False),
+              help='The profile output directory. Implies --profile. '
+                   'Defaults to "{0}".'.format(DEFAULT_PROFILE_DIRECTORY))
 @click.option('--test', is_flag=True)
-def etl(file, config, perfdocs, test):
-    if not test:
+def etl(file, config, batch, low_memory, perfdocs, watch, profile, profile_out, test):
+    if config is None:
         if not perfdocs:
-            click.echo('Capmetrics Excel ETL starting...')
-            config_parser = configparser.ConfigParser()
-            # make parsing of config file names case-sensitive
-            config_parser.optionxform = str
-            config_parser.read(config)
-            capmetrics_configuration = parse_capmetrics_configuration(config_parser)
-            # run data quality 'sanity check' before getting all dressed up to talk to db
-            daily_worksheets = capmetrics_configuration['daily_ridership_worksheets']
-            hour_worksheets = capmetrics_configuration['hour_productivity_worksheets']
-            worksheet_names = daily_worksheets + hour_worksheets
-            if check_quality(file, worksheet_names):
-                connection_configuration = {"options": "-c timezone=utc"}
-                engine = create_engine(capmetrics_configuration['engine_url'],
-                                       connect_args=connection_configuration)
-                has_table = engine.dialect.has_table(engine.connect(), 'route')
-                if not has_table:
-                    create_tables(engine)
-                Session = sessionmaker()
-                Session.configure(bind=engine)
-                session = Session()
-                run_excel_etl(file, session, capmetrics_configuration)
-                click.echo('Capmetrics Excel ETL completed.')
+            raise click.UsageError('Missing argument "CONFIG".')
+        # the performance document refresh does not read a data file
+        file, config = None, file
+    if not test:
+        from capmetrics_etl.profiling import profile as profile_run, stage
+        profile_directory = profile_out or DEFAULT_PROFILE_DIRECTORY
+        profile_context = profile_run(profile_directory) if profile or profile_out else contextlib.nullcontext()
+        with profile_context as profiler:
+            if watch:
+                serve(file, config, interval=5.0, once=False)
+            elif not perfdocs:
+                from capmetrics_etl.etl import find_batch_files, run_batch_etl, run_excel_etl, run_source_etl
+                from capmetrics_etl.quality import validate_workbook_cached
+                from capmetrics_etl.sources import is_source_file
+                click.echo('Capmetrics Excel ETL starting...')
+                config_parser = configparser.ConfigParser()
+                # make parsing of config file names case-sensitive
+                config_parser.optionxform = str
+                config_parser.read(config)
+                capmetrics_configuration = parse_capmetrics_configuration(config_parser)
+                if low_memory:
+                    capmetrics_configuration['low_memory'] = True
+                session = create_session(capmetrics_configuration)
+                if batch:
+                    batch_files = find_batch_files(file)
+                    data_files = [f for f in batch_files if not is_source_file(f)]
+                else:
+                    batch_files = [file]
+                    data_files = [] if is_source_file(file) else [file]
+                # run data quality 'sanity check' before loading data; verdicts are cached
+                # by file content, and flat file sources have no worksheets to check
+                parsed_workbooks = dict()
+                passed = bool(batch_files)
+                for data_file in data_files:
+                    with stage('quality'):
+                        quality_report, parsed_worksheets = \
+                            validate_workbook_cached(data_file, capmetrics_configuration, session)
+                    if parsed_worksheets is not None:
+                        parsed_workbooks[data_file] = parsed_worksheets
+                    for failure in quality_report['failures']:
+                        click.echo('{0}: {1}'.format(data_file, failure))
+                    passed = passed and quality_report['passed']
+                if passed:
+                    if batch:
+                        run_batch_etl(batch_files, session, capmetrics_configuration, parsed_workbooks)
+                    elif not data_files:
+                        run_source_etl(file, session, capmetrics_configuration)
+                    else:
+                        run_excel_etl(file, session, capmetrics_configuration,
+                                      parsed_workbooks.get(file))
+                    click.echo('Capmetrics Excel ETL completed.')
+                else:
+                    session.close()
+                    click.echo('Capmetrics stopped ETL. Source file data is incorrectly formatted.')
             else:
-                click.echo('Capmetrics stopped ETL. Source file data is incorrectly formatted.')
-        else:
-            click.echo('Capmetrics performance document update starting...')
-            config_parser = configparser.ConfigParser()
-            # make parsing of config file names case-sensitive
-            config_parser.optionxform = str
-            config_parser.read(config)
-            capmetrics_configuration = parse_capmetrics_configuration(config_parser)
-            # run data quality 'sanity check' before getting all dressed up to talk to db
-            daily_worksheets = capmetrics_configuration['daily_ridership_worksheets']
-            hour_worksheets = capmetrics_configuration['hour_productivity_worksheets']
-            worksheet_names = daily_worksheets + hour_worksheets
-            if check_quality(file, worksheet_names):
-                connection_configuration = {"options": "-c timezone=utc"}
-                engine = create_engine(capmetrics_configuration['engine_url'],
-                                       connect_args=connection_configuration)
-                has_table = engine.dialect.has_table(engine.connect(), 'route')
-                if not has_table:
-                    create_tables(engine)
-                Session = sessionmaker()
-                Session.configure(bind=engine)
-                session = Session()
-                update_perfdocs(session)
+                from capmetrics_etl.etl import stage_transaction, update_perfdocs
+                click.echo('Capmetrics performance document update starting...')
+                config_parser = configparser.ConfigParser()
+                # make parsing of config file names case-sensitive
+                config_parser.optionxform = str
+                config_parser.read(config)
+                capmetrics_configuration = parse_capmetrics_configuration(config_parser)
+                session = create_session(capmetrics_configuration)
+                with stage_transaction(session):
+                    update_perfdocs(session)
+                session.close()
                 click.echo('Capmetrics performance document update completed.')
-            else:
-                click.echo('Capmetrics stopped ETL. Source file data is incorrectly formatted.')
-
+        if profiler is not None:
+            click.echo(profiler.get_summary())
+            click.echo('Capmetrics profile written to {0}.'.format(profile_directory))
     else:
         click.echo('Capmetrics Excel ETL test.')
 
@@ -85,14 +169,30 @@ def etl(file, config, perfdocs, test):
 @click.option('--test', is_flag=True)
 def tables(config, test):
     if not test:
+        from capmetrics_etl.engines import create_configured_engine
+        from capmetrics_etl.etl import create_tables
         config_parser = configparser.ConfigParser()
         # make parsing of config file names case-sensitive
         config_parser.optionxform = str
         config_parser.read(config)
         capmetrics_configuration = parse_capmetrics_configuration(config_parser)
-        engine = create_engine(capmetrics_configuration['engine_url'])
+        engine = create_configured_engine(capmetrics_configuration)
         create_tables(engine)
         click.echo('Capmetrics database tables created.')
     else:
         click.echo('Capmetrics table creation test.')
 
+
+@click.command()
+@click.argument('inbox')
+@click.argument('config')
+@click.option('--interval', default=5.0, show_default=True,
+              help='Seconds between checks of the INBOX directory.')
+@click.option('--once', is_flag=True,
+              help='Run the jobs currently in the INBOX directory and exit.')
+@click.option('--test', is_flag=True)
+def serve_etl(inbox, config, interval, once, test):
+    if not test:
+        serve(inbox, config, interval, once)
+    else:
+        click.echo('Capmetrics ETL service test.')
@@ -0,0 +1,108 @@
+"""
+Maintained row counts of the tables that ETL reports count.
+
+Counting a table with ``COUNT(*)`` scans it, and the fact tables keep growing with
+every release because superseded facts are retired rather than deleted. Instead,
+a :class:`~.models.TableCount` row per counted table is adjusted in the same
+transaction as the rows it counts:
+
+* The bulk loaders (see :mod:`~.loaders`) and the merge load strategy call
+  :func:`add_row_count` with the number of inserted rows.
+* Models saved or deleted through a session are counted by mapper events.
+
+A counter is seeded with an exact count the first time it is read, and adjustments
+of a table without a counter are skipped. Rows deleted with bulk ``DELETE``
+statements are not counted. :func:`get_row_count` can also return the database's
+catalog estimate, which needs no counter at all.
+"""
+from sqlalchemy import event, func, insert, select, text, update
+from . import models
+
+COUNTED_MODELS = (models.Route, models.DailyRidership, models.ServiceHourRidership)
+COUNTED_TABLES = tuple(model.__tablename__ for model in COUNTED_MODELS)
+
+
+def count_rows(connection, table):
+    return connection.execute(select(func.count()).select_from(table)).scalar()
+
+
+def add_row_count(connection, table, delta):
+    """
+    Adjusts a table's counter, if it has one.
+
+    Args:
+        connection: A SQLAlchemy connection, in the transaction that changed the rows.
+        table: The counted SQLAlchemy table.
+        delta (int): The number of inserted (positive) or deleted (negative) rows.
+    """
+    counts = models.TableCount.__table__
+    connection.execute(update(counts)
+                       .where(counts.c.table_name == table.name)
+                       .values(row_count=counts.c.row_count + delta))
+
+
+def get_catalog_estimate(connection, table):
+    """
+    Reads the row count estimate that the database keeps for its query planner.
+
+    Args:
+        connection: A SQLAlchemy connection.
+        table: A SQLAlchemy table.
+
+    Returns:
+        int: The estimate, or ``None`` if the database has none, for example before
+        the table was first analyzed.
+    """
+    if connection.dialect.name == 'postgresql':
+        estimate = connection.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)'),
+                                      {'name': table.name}).scalar()
+        return int(estimate) if estimate is not None and estimate >= 0 else None
+    if connection.dialect.name == 'sqlite':
+        analyzed = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).scalar()
+        if analyzed:
+            # the first number of a statistics row is the table's row count
+            stat = connection.execute(text('SELECT stat FROM sqlite_stat1 WHERE tbl = :name LIMIT 1'),
+                                      {'name': table.name}).scalar()
+            if stat:
+                return int(stat.split()[0])
+    return None
+
+
+def get_row_count(session, model, exact=True):
+    """
+    Reads a table's row count without counting its rows.
+
+    Args:
+        session: A SQLAlchemy session.
+        model: A counted SQLAlchemy model *class* or table, see :data:`COUNTED_MODELS`.
+        exact (bool): If ``False``, the catalog estimate is preferred when one exists.
+
+    Returns:
+        int: The number of rows.
+    """
+    table = getattr(model, '__table__', model)
+    connection = session.connection()
+    if not exact:
+        estimate = get_catalog_estimate(connection, table)
+        if estimate is not None:
+            return estimate
+    counts = models.TableCount.__table__
+    statement = select(counts.c.row_count).where(counts.c.table_name == table.name)
+    row_count = connection.execute(statement).scalar()
+    if row_count is None:
+        row_count = count_rows(connection, table)
+        connection.execute(insert(counts).values(table_name=table.name, row_count=row_count))
+    return row_count
+
+
+def count_inserted_model(mapper, connection, target):
+    add_row_count(connection, mapper.local_table, 1)
+
+
+def count_deleted_model(mapper, connection, target):
+    add_row_count(connection, mapper.local_table, -1)
+
+
+for counted_model in COUNTED_MODELS:
+    event.listen(counted_model, 'after_insert', count_inserted_model)
+    event.listen(counted_model, 'after_delete', count_deleted_model)
@@ -0,0 +1,285 @@
+"""
+An in-memory cube of the current route ridership facts.
+
+The derived tables (system ridership, weekly performance, and high ridership
+routes) are all reductions of the current
+:class:`~.models.DailyRidership` and :class:`~.models.ServiceHourRidership` facts.
+A :class:`FactCube` loads those facts once, with one ``SELECT`` for the route
+dimension and one ``SELECT`` for the facts of both tables, into a dense NumPy array
+indexed by ``(route, period, day of week, metric)``. The derived stages are then
+computed as array reductions instead of re-querying the facts.
+
+Days of week and metrics are fixed dimensions ordered like :data:`~.utils.DAYS_OF_WEEK`
+and :data:`METRICS`. The period dimension holds the ``(calendar year, season)`` pairs
+present in the facts in chronological order.
+"""
+from collections import OrderedDict
+import numpy as np
+import pytz
+from sqlalchemy import literal, select, SmallInteger, type_coerce, union_all
+from . import models
+from . import records
+from . import utils
+
+DAILY = 0
+SERVICE_HOUR = 1
+METRICS = ('daily_ridership', 'service_hour_ridership')
+# weekday figures count five times towards a week's ridership
+WEEKLY_WEIGHTS = np.array([5, 1, 1])
+
+
+def select_routes():
+    return select(models.Route.id,
+                  models.Route.route_number,
+                  models.Route.route_name,
+                  models.Route.service_type,
+                  models.Route.is_high_ridership).order_by(models.Route.id)
+
+
+def select_current_facts():
+    """
+    Builds a ``UNION ALL`` of the current facts of both ridership tables, with a
+    ``metric`` column holding the fact's position in :data:`METRICS`. Days of week
+    and seasons are selected as their stored integer codes.
+    """
+    selects = list()
+    for metric, ridership_model in ((DAILY, models.DailyRidership),
+                                    (SERVICE_HOUR, models.ServiceHourRidership)):
+        selects.append(select(literal(metric).label('metric'),
+                              ridership_model.id,
+                              ridership_model.route_id,
+                              # the stored codes skip the label mapping
+                              type_coerce(ridership_model.day_of_week, SmallInteger).label('day_of_week'),
+                              type_coerce(ridership_model.season, SmallInteger).label('season'),
+                              ridership_model.calendar_year,
+                              ridership_model.ridership,
+                              ridership_model.created_on,
+                              ridership_model.measurement_timestamp)
+                       .where(ridership_model.is_current.is_(True)))
+    facts = union_all(*selects).subquery()
+    return select(facts).order_by(facts.c.id)
+
+
+class FactCube:
+    """
+    Current ridership facts in a dense ``(route, period, day of week, metric)`` array.
+
+    Attributes:
+        route_ids: A NumPy array of ``Route`` primary keys, one per route index.
+        route_numbers: A NumPy array of route numbers.
+        route_names (list): Route names.
+        service_type_index: A NumPy array mapping each route to its service type index.
+        service_types (list): The service type dimension.
+        is_high_ridership: A NumPy boolean array.
+        period_years: A NumPy array with the calendar year of each period.
+        period_seasons (list): The season of each period.
+        period_timestamps (list): The UTC timestamp of each period and day of week, as
+            returned by :func:`~.utils.get_period_timestamp`. The timestamps are naive
+            if the facts' stored measurement timestamps are, as on SQLite, so they
+            match the values read back from the database.
+        values: A NumPy float array of ridership with ``NaN`` where no fact exists.
+        fact_ids: A NumPy integer array of fact primary keys (``0`` where no fact exists).
+        created_on: A NumPy object array of fact creation datetimes.
+        measurement_timestamps: A NumPy object array of fact measurement timestamps.
+    """
+
+    def __init__(self, routes, facts):
+        """
+        Args:
+            routes (list): ``(id, route_number, route_name, service_type, is_high_ridership)`` rows.
+            facts: An iterable of rows shaped like :func:`select_current_facts` output, in ascending
+                id order. The last fact for a cube cell wins.
+        """
+        self.route_ids = np.array([route[0] for route in routes], dtype=np.int64)
+        self.route_numbers = np.array([route[1] for route in routes], dtype=np.int64)
+        self.route_names = [route[2] for route in routes]
+        self.service_types = list(OrderedDict.fromkeys(route[3] for route in routes))
+        service_type_codes = {service_type: code for code, service_type in enumerate(self.service_types)}
+        self.service_type_index = np.array([service_type_codes[route[3]] for route in routes], dtype=np.intp)
+        self.is_high_ridership = np.array([bool(route[4]) for route in routes], dtype=bool)
+        route_index = {route_id: index for index, route_id in enumerate(self.route_ids.tolist())}
+        facts = [fact for fact in facts
+                 if fact[2] in route_index and fact[5] is not None and fact[6] is not None]
+        if facts:
+            day_codes = utils.encode_labels([fact[3] for fact in facts], utils.DAYS_OF_WEEK)
+            season_codes = utils.encode_labels([fact[4] for fact in facts], utils.SEASONS)
+            years = np.array([fact[5] for fact in facts], dtype=np.int64)
+        else:
+            day_codes = season_codes = years = np.array([], dtype=np.int64)
+        period_keys = years * len(utils.SEASONS) + season_codes
+        unique_keys, period_index = np.unique(period_keys, return_inverse=True)
+        self.period_years = unique_keys // len(utils.SEASONS)
+        self.period_seasons = [utils.SEASONS[key % len(utils.SEASONS)] for key in unique_keys.tolist()]
+        # every (period, day of week) timestamp, mapped from the calendar in one batch
+        period_shape = (len(unique_keys), len(utils.DAYS_OF_WEEK))
+        period_timestamps = utils.get_period_timestamps(
+            np.broadcast_to(np.arange(len(utils.DAYS_OF_WEEK)), period_shape),
+            np.broadcast_to((unique_keys % len(utils.SEASONS))[:, np.newaxis], period_shape),
+            np.broadcast_to(self.period_years[:, np.newaxis], period_shape))
+        # like the stored timestamps the database returns: aware on PostgreSQL, naive on SQLite
+        stored_timestamp = next((fact[8] for fact in facts if fact[8] is not None), None)
+        tzinfo = None if stored_timestamp is not None and stored_timestamp.tzinfo is None else pytz.utc
+        self.period_timestamps = [[timestamp.replace(tzinfo=tzinfo) for timestamp in row]
+                                  for row in period_timestamps.reshape(period_shape).tolist()]
+        shape = (len(routes), len(unique_keys), len(utils.DAYS_OF_WEEK), len(METRICS))
+        self.values = np.full(shape, np.nan)
+        self.fact_ids = np.zeros(shape, dtype=np.int64)
+        self.created_on = np.empty(shape, dtype=object)
+        self.measurement_timestamps = np.empty(shape, dtype=object)
+        if not facts:
+            return
+        cells = (np.array([route_index[fact[2]] for fact in facts], dtype=np.intp),
+                 period_index.reshape(-1),
+                 day_codes,
+                 np.array([fact[0] for fact in facts], dtype=np.intp))
+        # keep the last (highest id) fact of each cell
+        flat_cells = np.ravel_multi_index(cells, shape)
+        _, reversed_positions = np.unique(flat_cells[::-1], return_index=True)
+        keep = len(facts) - 1 - reversed_positions
+        cells = tuple(axis[keep] for axis in cells)
+        self.values[cells] = np.array([facts[position][6] for position in keep], dtype=float)
+        self.fact_ids[cells] = np.array([facts[position][1] for position in keep], dtype=np.int64)
+        self.created_on[cells] = [facts[position][7] for position in keep]
+        self.measurement_timestamps[cells] = [facts[position][8] for position in keep]
+
+    @classmethod
+    def load(cls, session, chunk_size=1000):
+        """
+        Loads the routes and the current ridership facts with two ``SELECT`` statements.
+        The facts are streamed ``chunk_size`` rows at a time (with a server-side cursor
+        where the driver supports one), so the driver never buffers the full result.
+
+        Args:
+            session: SQLAlchemy session.
+            chunk_size (int): The number of fact rows fetched at a time.
+
+        Returns:
+            FactCube
+        """
+        routes = session.execute(select_routes()).all()
+        facts = session.execute(select_current_facts().execution_options(yield_per=chunk_size))
+        return cls(routes, facts)
+
+    @property
+    def present(self):
+        """A NumPy boolean array marking the cube cells that hold a fact."""
+        return ~np.isnan(self.values)
+
+    def route_records(self):
+        """
+        Returns:
+            list: A :class:`~.records.RouteRecord` per route index.
+        """
+        return [records.RouteRecord(int(self.route_ids[route]),
+                                    int(self.route_numbers[route]),
+                                    self.route_names[route],
+                                    self.service_types[self.service_type_index[route]],
+                                    bool(self.is_high_ridership[route]))
+                for route in range(len(self.route_ids))]
+
+    def route_facts(self, route, metric):
+        """
+        Args:
+            route (int): A route index.
+            metric (int): A metric index, :data:`DAILY` or :data:`SERVICE_HOUR`.
+
+        Returns:
+            list: The route's :class:`~.records.FactRecord` objects for the metric in id order.
+        """
+        periods, days = np.nonzero(self.present[route, :, :, metric])
+        order = np.argsort(self.fact_ids[route, periods, days, metric])
+        route_id = int(self.route_ids[route])
+        return [records.FactRecord(int(self.fact_ids[route, period, day, metric]),
+                                   self.created_on[route, period, day, metric],
+                                   utils.DAYS_OF_WEEK[day],
+                                   self.period_seasons[period],
+                                   int(self.period_years[period]),
+                                   float(self.values[route, period, day, metric]),
+                                   route_id,
+                                   self.measurement_timestamps[route, period, day, metric])
+                for period, day in zip(periods[order].tolist(), days[order].tolist())]
+
+    def period_timestamp(self, period, day_of_week='weekday'):
+        return self.period_timestamps[period][utils.DAYS_OF_WEEK.index(day_of_week)]
+
+    def period_isoformat(self, period, day_of_week='weekday'):
+        return utils.get_period_isoformat(day_of_week, self.period_seasons[period],
+                                          int(self.period_years[period]))
+
+    def system_ridership(self):
+        """
+        Sums daily ridership over the routes of each service type.
+
+        Returns:
+            tuple: A ``(service type, period, day of week)`` float array of ridership
+            and a boolean array marking the sums with at least one route fact.
+        """
+        daily = self.values[..., DAILY]
+        shape = (len(self.service_types),) + daily.shape[1:]
+        ridership = np.zeros(shape)
+        fact_counts = np.zeros(shape, dtype=np.int64)
+        np.add.at(ridership, self.service_type_index, np.nan_to_num(daily))
+        np.add.at(fact_counts, self.service_type_index, ~np.isnan(daily))
+        return ridership, fact_counts > 0
+
+    def weekly_ridership(self):
+        """
+        Returns:
+            tuple: A ``(route, period)`` integer array of weekly ridership and a boolean
+            array marking the route periods with at least one daily ridership fact.
+        """
+        daily = self.values[..., DAILY]
+        # each day's weighted figure is truncated before summing, like int(count)
+        weighted = np.trunc(np.nan_to_num(daily) * WEEKLY_WEIGHTS)
+        return weighted.sum(axis=-1).astype(np.int64), ~np.isnan(daily).all(axis=-1)
+
+    def weekly_performance(self):
+        """
+        Computes the weekly ridership and weekday productivity of each route period
+        that has daily ridership.
+
+        Returns:
+            list: Dicts with ``route_id``, ``season``, ``calendar_year``,
+            ``measurement_timestamp``, ``ridership``, and ``productivity`` keys.
+        """
+        ridership, has_ridership = self.weekly_ridership()
+        productivity = self.values[:, :, utils.DAYS_OF_WEEK.index('weekday'), SERVICE_HOUR]
+        performances = list()
+        for route, period in zip(*np.nonzero(has_ridership)):
+            route_productivity = productivity[route, period]
+            performances.append({
+                'route_id': int(self.route_ids[route]),
+                'season': self.period_seasons[period],
+                'calendar_year': int(self.period_years[period]),
+                'measurement_timestamp': self.period_timestamp(period),
+                'ridership': int(ridership[route, period]),
+                'productivity': None if np.isnan(route_productivity) else int(route_productivity)
+            })
+        return performances
+
+    def latest_period(self):
+        """
+        Returns:
+            int: The index of the latest period with weekday daily ridership, or ``None``.
+        """
+        weekday = self.present[:, :, utils.DAYS_OF_WEEK.index('weekday'), DAILY]
+        periods = np.flatnonzero(weekday.any(axis=0))
+        return int(periods[-1]) if len(periods) else None
+
+    def high_ridership_routes(self, size=10):
+        """
+        Ranks routes by weekly ridership in the latest period.
+
+        Args:
+            size (int): The number of routes to return.
+
+        Returns:
+            list: The route numbers of the ``size`` highest ridership routes.
+        """
+        period = self.latest_period()
+        if period is None:
+            return []
+        ridership, has_ridership = self.weekly_ridership()
+        routes = np.flatnonzero(has_ridership[:, period])
+        ranking = routes[np.argsort(-ridership[routes, period], kind='stable')]
+        return self.route_numbers[ranking[:size]].tolist()
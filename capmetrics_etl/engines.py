@@ -0,0 +1,90 @@
+"""
+Creates the SQLAlchemy engine of a configuration.
+
+SQLite databases can be opened with a bulk load profile (the ``sqlite_bulk_load``
+configuration setting). Every new connection then gets the :data:`SQLITE_LOAD_PRAGMAS`:
+
+* ``journal_mode=WAL`` appends changes to a write-ahead log instead of copying pages to
+  a rollback journal, and readers do not block the writer.
+* ``synchronous=NORMAL`` only syncs the log at checkpoints instead of on every commit.
+  A power loss can lose the last commits but cannot corrupt the database.
+* ``cache_size``, ``temp_store=MEMORY``, and ``mmap_size`` keep more pages, temporary
+  tables and sort data in memory.
+
+Long-running processes such as the ETL service (see :mod:`~.service`) use a tuned
+connection pool, see :func:`create_service_engine`.
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# jobs run serially, so one connection does the work and one is spare
+DEFAULT_POOL_SIZE = 2
+DEFAULT_POOL_RECYCLE = 1800
+SQLITE_LOAD_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    # a negative size is in KiB: 64 MiB
+    ('cache_size', -65536),
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 268435456)
+)
+
+
+def set_sqlite_load_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_LOAD_PRAGMAS:
+        cursor.execute('PRAGMA {0}={1}'.format(name, value))
+    cursor.close()
+
+
+def create_configured_engine(capmetrics_configuration, **engine_options):
+    """
+    Creates an engine for the configured database. PostgreSQL sessions use UTC, and
+    SQLite uses the bulk load profile when ``sqlite_bulk_load`` is set.
+
+    Args:
+        capmetrics_configuration (dict): Parsed configuration.
+        engine_options: Additional :func:`~sqlalchemy.create_engine` arguments.
+
+    Returns:
+        A SQLAlchemy engine.
+    """
+    engine_url = capmetrics_configuration['engine_url']
+    connection_configuration = dict()
+    if engine_url.startswith('postgresql'):
+        connection_configuration = {"options": "-c timezone=utc"}
+    engine = create_engine(engine_url, connect_args=connection_configuration, **engine_options)
+    if engine.dialect.name == 'sqlite' and capmetrics_configuration.get('sqlite_bulk_load'):
+        event.listen(engine, 'connect', set_sqlite_load_pragmas)
+    return engine
+
+
+def is_memory_database(engine_url):
+    url = make_url(engine_url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def create_service_engine(capmetrics_configuration):
+    """
+    Creates an engine for a long-running process. Pooled connections are checked
+    with a ping before use and replaced after ``pool_recycle`` seconds, so database
+    restarts and server-side idle timeouts do not fail jobs. The pool keeps
+    ``pool_size`` connections. In-memory SQLite databases live in their one
+    connection, so they keep the default pool.
+
+    Args:
+        capmetrics_configuration (dict): Parsed configuration, with optional
+            ``pool_size`` and ``pool_recycle`` settings.
+
+    Returns:
+        A SQLAlchemy engine.
+    """
+    if is_memory_database(capmetrics_configuration['engine_url']):
+        return create_configured_engine(capmetrics_configuration)
+    pool_size = capmetrics_configuration.get('pool_size') or DEFAULT_POOL_SIZE
+    pool_recycle = capmetrics_configuration.get('pool_recycle') or DEFAULT_POOL_RECYCLE
+    return create_configured_engine(capmetrics_configuration,
+                                    pool_size=pool_size,
+                                    max_overflow=0,
+                                    pool_pre_ping=True,
+                                    pool_recycle=pool_recycle)
@@ -2,20 +2,39 @@
 Extract-Transform-Load functions.
 """
 from collections import OrderedDict
+import contextlib
 import datetime
+import glob
 import json
+import mmap
+import numpy as np
 import os
 import pytz
 import re
-from dateutil.parser import parse
-from sqlalchemy import asc, desc, func
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import and_, Boolean, case, Column, delete, desc, exists, func, insert, literal, MetaData, \
+    select, Table, text, update
 import xlrd
-from xlrd.biffh import XLRDError
+from . import counters
+from . import cube
+from . import layout
+from . import loaders
+from . import migrations
 from . import models
 from . import performance_documents as perfdocs
+from . import profiling
+from . import records
+from . import sources
 from . import utils
 
+# xlrd 2 only reads the legacy .xls format, so .xlsx files are not picked up
+BATCH_EXTENSIONS = ('.xls',) + tuple(sources.SOURCE_READERS)
+# xlrd's XL_CELL_EMPTY and XL_CELL_BLANK
+BLANK_CELL_TYPES = (0, 6)
+DAY_OF_WEEK_PATTERN = re.compile(r'(weekday|saturday|sunday)')
+SEASON_YEAR_PATTERN = re.compile(r'(summer|fall|winter|spring) +(\d\d\d\d)')
+# the fact columns bulk loaded by the merge load strategy
+STAGING_COLUMNS = ('route_id', 'day_of_week', 'season', 'calendar_year', 'measurement_timestamp', 'ridership')
+
 
 def check_for_headers(cell, worksheet, row_counter, worksheet_routes):
     if cell.value == 'Route':
@@ -33,7 +52,16 @@ def check_for_headers(cell, worksheet, row_counter, worksheet_routes):
 
 
 def create_tables(engine):
+    """
+    Creates the missing tables and migrates legacy columns and indexes of existing tables.
+
+    Args:
+        engine: A SQLAlchemy engine.
+    """
     models.Base.metadata.create_all(engine)
+    migrations.migrate_label_columns(engine)
+    migrations.migrate_unique_indexes(engine)
+    migrations.migrate_indexes(engine)
 
 
 def extract_day_of_week(period_row, period_column, worksheet):
@@ -49,22 +77,32 @@ def extract_day_of_week(period_row, period_column, worksheet):
     Returns:
         A string with the day of week if one present; ``None`` otherwise.
     """
-    day_of_week = None
-    day_cell = worksheet.cell((period_row + 1), period_column)
-    if day_cell.ctype == 1:
-        day = day_cell.value.lower()
-        regex_pattern = re.compile(r'(weekday|saturday|sunday)')
-        result = regex_pattern.match(day)
+    day_row = period_row + 1
+    if day_row >= worksheet.nrows or period_column >= worksheet.row_len(day_row):
+        return None
+    return match_day_of_week(worksheet.cell_value(day_row, period_column))
+
+
+def match_day_of_week(value):
+    """
+    Matches a 'weekday', 'saturday', or 'sunday' label.
+
+    Args:
+        value: A cell value.
+
+    Returns:
+        A lower case string with the day of week if one present; ``None`` otherwise.
+    """
+    if isinstance(value, str):
+        result = DAY_OF_WEEK_PATTERN.match(value.lower())
         if result:
             return result.group(1)
-    return day_of_week
+    return None
 
 
 def get_season_and_year(period):
     if isinstance(period, str):
-        period = period.lower()
-        regex_pattern = re.compile(r'(summer|fall|winter|spring) +(\d\d\d\d)')
-        result = regex_pattern.match(period)
+        result = SEASON_YEAR_PATTERN.match(period.lower())
         if result:
             return result.group(1), result.group(2)
     return None, None
@@ -81,11 +119,11 @@ def get_latest_measurement_timestamp(session):
     Returns:
         datetime.datetime
     """
-    latest = session.query(models.DailyRidership)\
-                    .filter_by(day_of_week='weekday')\
-                    .order_by(desc(models.DailyRidership.measurement_timestamp))\
-                    .first()
-    return latest.measurement_timestamp
+    statement = select(models.DailyRidership.measurement_timestamp)\
+        .where(models.DailyRidership.day_of_week == 'weekday')\
+        .order_by(desc(models.DailyRidership.measurement_timestamp))\
+        .limit(1)
+    return session.execute(statement).scalar()
 
 
 def get_high_ridership_routes(session, timestamp, size=10):
@@ -101,14 +139,63 @@ def get_high_ridership_routes(session, timestamp, size=10):
     Returns:
         list
     """
-    top_riderships = session.query(models.WeeklyPerformance)\
-                            .filter_by(measurement_timestamp=timestamp,
-                                       is_current=True)\
-                            .order_by(desc(models.WeeklyPerformance.ridership))[0:size]
-    return [top.route.route_number for top in top_riderships]
+    statement = select(models.Route.route_number)\
+        .join_from(models.WeeklyPerformance, models.Route,
+                   models.WeeklyPerformance.route_id == models.Route.id)\
+        .where(models.WeeklyPerformance.measurement_timestamp == timestamp,
+               models.WeeklyPerformance.is_current.is_(True))\
+        .order_by(desc(models.WeeklyPerformance.ridership))\
+        .limit(size)
+    return list(session.execute(statement).scalars())
+
+
+def build_period(column_index, season, year, day_of_week):
+    # The timestamp is in UTC timezone
+    return {
+        'column': column_index,
+        'season': season,
+        'year': int(year),
+        'timestamp': utils.get_period_timestamp(day_of_week, season, int(year)),
+        'day_of_week': day_of_week
+    }
 
 
-def find_period(worksheet, periods, column_index, minimum_search=10):
+def match_period(header_values, column_index):
+    """
+    Searches the header rows of a column for a period header with a day of week
+    label under it.
+
+    Args:
+        header_values (list): Lists of cell values for the leading rows of a worksheet.
+        column_index (int): The column searched.
+
+    Returns:
+        dict: Period info if found; ``None`` otherwise.
+    """
+    # the last header row can only hold a day of week label
+    for row_index in range(len(header_values) - 1):
+        row_values = header_values[row_index]
+        day_row_values = header_values[row_index + 1]
+        if column_index >= len(row_values) or column_index >= len(day_row_values):
+            break
+        season, year = get_season_and_year(row_values[column_index])
+        if season and year:
+            day_of_week = match_day_of_week(day_row_values[column_index])
+            if day_of_week:
+                return build_period(column_index, season, year, day_of_week)
+    return None
+
+
+def get_header_values(worksheet, minimum_search=layout.HEADER_SEARCH_ROWS):
+    """
+    Reads the cell values of the rows searched for period headers, plus the row below
+    them that can hold day of week labels.
+    """
+    return [worksheet.row_values(row_index)
+            for row_index in range(min(minimum_search + 1, worksheet.nrows))]
+
+
+def find_period(worksheet, periods, column_index, minimum_search=layout.HEADER_SEARCH_ROWS):
     """
     Searches for a performance period in a column and places
     the period information into a passed-in dictionary.
@@ -122,28 +209,82 @@ def find_period(worksheet, periods, column_index, minimum_search=10):
     Returns:
         boolean: ``True`` if a period is found.
     """
-    try:
-        for row_index in range(minimum_search):
-            cell = worksheet.cell(row_index, column_index)
-            season, year = get_season_and_year(cell.value)
-            day_of_week = extract_day_of_week(row_index, column_index, worksheet)
-            if season and year and day_of_week:
-                # The timestamp is in UTC timezone
-                period_timestamp = utils.get_period_timestamp(day_of_week, season.lower(), int(year))
-                periods[str(column_index)] = {
-                    'column': column_index,
-                    'season': season.lower(),
-                    'year': int(year),
-                    'timestamp': period_timestamp,
-                    'day_of_week': day_of_week.lower()
-                }
-                return True
-    except IndexError:
-        pass
+    period = match_period(get_header_values(worksheet, minimum_search), column_index)
+    if period:
+        periods[str(column_index)] = period
+        return True
     return False
 
 
-def get_periods(worksheet, minimum_search=10):
+def find_route_header_row(worksheet):
+    """
+    Finds the row where a worksheet's route table starts: the first row with
+    a ``Route`` header or a route number in the first column.
+
+    Args:
+        worksheet: Excel worksheet searched.
+
+    Returns:
+        int: The row index, or ``None`` if the worksheet has no route rows.
+    """
+    if worksheet.ncols == 0:
+        return None
+    first_column_types = worksheet.col_types(0)
+    row_index = 0
+    for value in worksheet.col_values(0):
+        if value == 'Route' or first_column_types[row_index] == 2:
+            return row_index
+        row_index += 1
+    return None
+
+
+def scan_worksheet_headers(worksheet, minimum_search=layout.HEADER_SEARCH_ROWS):
+    """
+    Discovers the period columns and the route table of a worksheet in one bounded scan.
+
+    The scan reads the leading rows once and stops at the worksheet's last column or
+    after ``minimum_search`` columns without a period header, whichever comes first.
+
+    Args:
+        worksheet: Excel worksheet searched.
+        minimum_search (int): The number of rows searched for a period header in each
+            column, and the number of columns without a period that are searched
+            before quitting.
+
+    Returns:
+        dict: ``periods`` (period info dicts keyed to column), ``route_header_row``
+            (see :func:`find_route_header_row`), ``names_available`` and
+            ``types_available`` (booleans for the route table's name and type headers),
+            and ``columns_scanned`` (int).
+    """
+    header_values = get_header_values(worksheet, minimum_search)
+    periods = dict()
+    not_periods = 0
+    column_index = 0
+    while not_periods < minimum_search and column_index < worksheet.ncols:
+        period = match_period(header_values, column_index)
+        if period:
+            periods[str(column_index)] = period
+        else:
+            not_periods += 1
+        column_index += 1
+    route_header_row = find_route_header_row(worksheet)
+    names_available = False
+    types_available = False
+    if route_header_row is not None and worksheet.cell_value(route_header_row, 0) == 'Route':
+        route_headers = worksheet.row_values(route_header_row, 0, min(3, worksheet.ncols))
+        names_available = len(route_headers) > 1 and route_headers[1] == 'Route Name'
+        types_available = len(route_headers) > 2 and route_headers[2] == 'Route Type'
+    return {
+        'periods': periods,
+        'route_header_row': route_header_row,
+        'names_available': names_available,
+        'types_available': types_available,
+        'columns_scanned': column_index
+    }
+
+
+def get_periods(worksheet, minimum_search=layout.HEADER_SEARCH_ROWS):
     """
     Scans columns for period headers to create a helpful dict that matches season and year
     info to a worksheet column.
@@ -159,130 +300,240 @@ def get_periods(worksheet, minimum_search=10):
     Returns:
         dict: Period info dicts keyed to column.
     """
-    periods = {}
-    not_periods = 0
-    column_index = 0
-    while not_periods < minimum_search:
-        found = find_period(worksheet, periods, column_index, minimum_search)
-        if not found:
-            not_periods += 1
-        column_index += 1
-    return periods
+    return scan_worksheet_headers(worksheet, minimum_search)['periods']
 
 
-def deactivate_current_period(route_number, period, ridership_model, session):
+def discover_worksheet_layout(worksheet):
     """
-    "Deactivates" a ridership metric model by setting its ``is_current`` property
-    to ``False``.
+    Runs header discovery on a worksheet.
 
     Args:
-        route_number (int): A service route's identifying number.
-        period (dict): The covered season and year.
-        ridership_model: SQLAlchemy model *class* that persists a period's ridership metric.
-        session: SQLAlcemeny session instance.
+        worksheet: Excel worksheet searched.
 
     Returns:
-        bool: ``True`` if an existing instance had
-            its ``is_current`` property changed. ``False`` otherwise.
+        dict: A JSON serializable layout with ``periods`` (period info dicts without
+            timestamps, keyed to column) and ``route_header_row``
+            (see :func:`find_route_header_row`).
     """
-    route = session.query(models.Route).filter_by(route_number=route_number).one()
-    try:
-        current_instance = session.query(ridership_model).\
-                            filter_by(route_id=route.id,
-                                      season=period['season'],
-                                      calendar_year=period['year'],
-                                      day_of_week=period['day_of_week'],
-                                      is_current=True).one()
-        current_instance.is_current = False
-        return True
-    except NoResultFound:
-        return False
+    header_scan = scan_worksheet_headers(worksheet)
+    periods = dict()
+    for column, period in header_scan['periods'].items():
+        periods[column] = {key: value for key, value in period.items() if key != 'timestamp'}
+    return {
+        'periods': periods,
+        'route_header_row': header_scan['route_header_row']
+    }
 
 
-def handle_ridership_cell(route_number, period, ridership_cell,
-                          ridership_model, session, report=None):
+def restore_periods(layout):
     """
-    Extracts ridership metric and deactivates previous versions
-    of a performance metric for a specific period.
+    Rebuilds the period info dicts of a cached worksheet layout.
 
     Args:
-        route_number (int): A transit service route number.
-        period (dict): Includes ``day_of_week``, ``season``, ``year``, ``timestamp`` keys.
-        ridership_cell: The spreadsheet cell being handled.
-        ridership_model: The SQLAlchemy model *class* that will be persisted.
-        session: The SQLAlchemy session.
-        report: An optional :class:`~.models.ETLReport` instance. Default value is ``None``
+        layout (dict): A worksheet layout from :func:`discover_worksheet_layout`.
 
     Returns:
-        The ETLReport instance if passed into function; ``None`` otherwise.
+        dict: Period info dicts keyed to column, as returned by :func:`get_periods`.
+    """
+    periods = dict()
+    for column, period in layout['periods'].items():
+        period = dict(period)
+        period['timestamp'] = utils.get_period_timestamp(period['day_of_week'],
+                                                         period['season'],
+                                                         period['year'])
+        periods[column] = period
+    return periods
+
+
+def get_worksheet_layout(worksheet, layout_cache=None):
     """
-    # check for a number cell
-    if ridership_cell.ctype == 2:
-        deactivation = deactivate_current_period(route_number, period,
-                                                 ridership_model, session)
-        if report and deactivation:
-            report.updates += 1
-        route = session.query(models.Route).filter_by(route_number=route_number).one()
-        # This is now the current ridership data for the period
-        new_ridership = ridership_model(route_id=route.id,
-                                        is_current=True,
-                                        day_of_week=period['day_of_week'],
-                                        season=period['season'],
-                                        calendar_year=period['year'],
-                                        measurement_timestamp=period['timestamp'],
-                                        ridership=ridership_cell.value,
-                                        created_on=datetime.datetime.now(tz=pytz.utc))
-        session.add(new_ridership)
-        if report:
-            report.creates += 1
-    return report
+    Discovers the header layout of a worksheet. With a layout cache, a worksheet
+    whose layout fingerprint is cached skips discovery entirely; otherwise the full
+    scan runs and its result refreshes the cache.
 
+    Args:
+        worksheet: An Excel worksheet.
+        layout_cache: An optional :class:`~.layout.LayoutCache`.
 
-def parse_worksheet_ridership(worksheet, periods, ridership_model,
-                              session, report=None):
+    Returns:
+        tuple: The worksheet layout (see :func:`discover_worksheet_layout`) and a boolean
+            that is ``True`` if the layout came from the cache.
+    """
+    fingerprint = None
+    if layout_cache is not None:
+        fingerprint = layout.get_worksheet_fingerprint(worksheet)
+        cached_layout = layout_cache.get(fingerprint)
+        if cached_layout is not None:
+            return cached_layout, True
+    worksheet_layout = discover_worksheet_layout(worksheet)
+    if layout_cache is not None:
+        layout_cache.put(fingerprint, worksheet_layout)
+    return worksheet_layout, False
+
+
+@contextlib.contextmanager
+def open_workbook(file_location, low_memory=False):
     """
+    Opens an Excel workbook.
 
-    Parses an Excel worksheet by iterating down rows (routes) and
-    columns (ridership by period) to create/update ridership data.
+    In low memory mode the file is read through a memory-mapped buffer and worksheets
+    are only parsed when first accessed, so callers should release each worksheet with
+    ``unload_sheet`` once its data is extracted. Otherwise every worksheet is parsed up
+    front.
 
-    For each row, the function examines the metrics in each
-    column by iterating the ``periods`` dictionary passed into the
-    function through the columns that make up the keys, with
-    additional handling logic finding the data for the row's route within
-    each column.
+    Args:
+        file_location (str): Location of the Excel file.
+        low_memory (bool): Enables on-demand worksheet loading.
+
+    Yields:
+        An xlrd workbook.
+    """
+    if not low_memory:
+        yield xlrd.open_workbook(filename=file_location)
+        return
+    with open(file_location, 'rb') as workbook_file:
+        with mmap.mmap(workbook_file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            excel_book = xlrd.open_workbook(file_contents=contents, on_demand=True)
+            try:
+                yield excel_book
+            finally:
+                excel_book.release_resources()
+
+
+def extract_worksheet_ridership(worksheet, periods, non_numeric_cells=None):
+    """
+    Extracts the ridership facts of an Excel worksheet without touching the database.
 
     Args:
         worksheet: The Excel worksheet to be parsed.
         periods (dict): Keyed to the column, with period data as the value.
-        ridership_model: A ridership metric model such as ``DailyRidership``.
-        session: SQLAlchemy database session.
-        report: An optional :class:`~.models.ETLReport`.
-    """
-    route_number_cells = worksheet.col(0)
-    row_counter = 0
-    # let's iterate down the rows
-    for cell in route_number_cells:
-        if cell.ctype == 2:
-            route_number = int(cell.value)
-            # now let's process each column with that has a ridership period header
-            for column, period_data in periods.items():
-                try:
-                    ridership_cell = worksheet.cell(row_counter, int(column))
-                    handle_ridership_cell(route_number, period_data, ridership_cell,
-                                          ridership_model, session, report)
-                except XLRDError:
-                    pass
-        row_counter += 1
+        non_numeric_cells (list): Optional list that collects ``[row, column]`` pairs
+            of route row cells in period columns that hold something other than a
+            number or a blank.
+
+    Returns:
+        list: Ridership fact dicts with ``route_number``, ``day_of_week``, ``season``,
+            ``year``, ``timestamp``, and ``ridership`` keys.
+    """
+    ridership_facts = list()
+    if worksheet.ncols == 0:
+        return ridership_facts
+    period_columns = [(int(column), period_data) for column, period_data in periods.items()]
+    route_number_types = worksheet.col_types(0)
+    for row_index in range(worksheet.nrows):
+        if route_number_types[row_index] != 2:
+            continue
+        row_types = worksheet.row_types(row_index)
+        row_values = worksheet.row_values(row_index)
+        route_number = int(row_values[0])
+        for column, period_data in period_columns:
+            if column >= len(row_types):
+                continue
+            # check for a number cell
+            if row_types[column] == 2:
+                ridership_facts.append({
+                    'route_number': route_number,
+                    'day_of_week': period_data['day_of_week'],
+                    'season': period_data['season'],
+                    'year': period_data['year'],
+                    'timestamp': period_data['timestamp'],
+                    'ridership': row_values[column]
+                })
+            elif non_numeric_cells is not None and row_types[column] not in BLANK_CELL_TYPES:
+                non_numeric_cells.append([row_index, column])
+    return ridership_facts
+
+
+def load_ridership(ridership_facts, ridership_model, session, batch_size=500):
+    """
+    Bulk loads ridership facts. Current models for the facts' periods are retired
+    with set-based updates and the facts are inserted as the new current models.
+
+    When several facts share a route and period, the last one wins.
+
+    Args:
+        ridership_facts (list): Ridership fact dicts, as returned by
+            :func:`extract_worksheet_ridership`.
+        ridership_model: A ridership model, such as :class:`~.models.DailyRidership` model.
+        session: A SQLAlchemy session.
+        batch_size (int): The maximum number of ids per retirement statement.
+
+    Returns:
+        An :class:`~.models.ETLReport`.
+    """
+    etl_report = models.ETLReport(
+        created_on=datetime.datetime.now(tz=pytz.utc),
+        updates=0,
+        creates=0,
+        total_models=None
+    )
+    route_ids = dict(session.query(models.Route.route_number, models.Route.id).all())
+    latest_facts = OrderedDict()
+    for fact in ridership_facts:
+        key = (route_ids[fact['route_number']], fact['season'], fact['year'], fact['day_of_week'])
+        latest_facts[key] = fact
+    current_instances = session.query(ridership_model.id,
+                                      ridership_model.route_id,
+                                      ridership_model.season,
+                                      ridership_model.calendar_year,
+                                      ridership_model.day_of_week)\
+                               .filter_by(is_current=True)\
+                               .yield_per(batch_size)
+    retired_ids = [row[0] for row in current_instances if tuple(row[1:]) in latest_facts]
+    for start in range(0, len(retired_ids), batch_size):
+        session.query(ridership_model)\
+               .filter(ridership_model.id.in_(retired_ids[start:start + batch_size]))\
+               .update({'is_current': False}, synchronize_session=False)
+    created_on = datetime.datetime.now(tz=pytz.utc)
+    mappings = ({
+        'route_id': key[0],
+        'is_current': True,
+        'day_of_week': fact['day_of_week'],
+        'season': fact['season'],
+        'calendar_year': fact['year'],
+        'measurement_timestamp': fact['timestamp'],
+        'ridership': fact['ridership'],
+        'created_on': created_on
+    } for key, fact in latest_facts.items())
+    etl_report.updates = len(retired_ids)
+    etl_report.creates = loaders.insert_rows(session, ridership_model, mappings, batch_size)
+    etl_report.total_models = counters.get_row_count(session, ridership_model)
+    return etl_report
 
 
-def update_ridership(file_location, worksheet_names, ridership_model, session):
+def get_staging_table(ridership_model):
     """
+    Defines a temporary staging table for a ridership model's facts.
 
     Args:
-        file_location (str): The location of a data store Excel file.
-        worksheet_names (list): A list of strings with Excel file worksheet names.
+        ridership_model: A ridership model, such as :class:`~.models.DailyRidership` model.
+
+    Returns:
+        A SQLAlchemy ``Table`` in its own metadata.
+    """
+    fact_table = ridership_model.__table__
+    columns = [Column(name, fact_table.c[name].type) for name in STAGING_COLUMNS]
+    return Table('staging_{0}'.format(fact_table.name), MetaData(), *columns, prefixes=['TEMPORARY'])
+
+
+def merge_ridership(ridership_facts, ridership_model, session, batch_size=500):
+    """
+    Loads ridership facts with a set-based merge. The facts are bulk loaded into a
+    temporary staging table (see :func:`get_staging_table`), then one ``UPDATE`` retires
+    the current models whose ridership differs from a staged fact and one
+    ``INSERT ... SELECT`` adds the staged facts without a current model. Unchanged
+    facts are left alone. Everything runs in one transaction, and the number of
+    statements does not depend on the number of facts beyond the staging load.
+
+    When several facts share a route and period, the last one wins.
+
+    Args:
+        ridership_facts (list): Ridership fact dicts, as returned by
+            :func:`extract_worksheet_ridership`.
         ridership_model: A ridership model, such as :class:`~.models.DailyRidership` model.
         session: A SQLAlchemy session.
+        batch_size (int): The maximum number of facts per staging load statement.
+
     Returns:
         An :class:`~.models.ETLReport`.
     """
@@ -292,17 +543,88 @@ def update_ridership(file_location, worksheet_names, ridership_model, session):
         creates=0,
         total_models=None
     )
+    route_ids = dict(session.query(models.Route.route_number, models.Route.id).all())
+    latest_facts = OrderedDict()
+    for fact in ridership_facts:
+        key = (route_ids[fact['route_number']], fact['season'], fact['year'], fact['day_of_week'])
+        latest_facts[key] = fact
+    staged_facts = ({
+        'route_id': key[0],
+        'day_of_week': fact['day_of_week'],
+        'season': fact['season'],
+        'calendar_year': fact['year'],
+        'measurement_timestamp': fact['timestamp'],
+        'ridership': fact['ridership']
+    } for key, fact in latest_facts.items())
+    connection = session.connection()
+    staging = get_staging_table(ridership_model)
+    staging.drop(connection, checkfirst=True)
+    staging.create(connection)
+    loaders.insert_rows(session, staging, staged_facts, batch_size)
+    facts = ridership_model.__table__
+    same_period = and_(staging.c.route_id == facts.c.route_id,
+                       staging.c.season == facts.c.season,
+                       staging.c.calendar_year == facts.c.calendar_year,
+                       staging.c.day_of_week == facts.c.day_of_week)
+    retirement = update(facts)\
+        .where(facts.c.is_current.is_(True),
+               exists().where(same_period, staging.c.ridership.is_distinct_from(facts.c.ridership)))\
+        .values(is_current=False)
+    etl_report.updates = connection.execute(retirement).rowcount
+    created_on = datetime.datetime.now(tz=pytz.utc)
+    new_facts = select(staging.c.route_id,
+                       literal(True, Boolean),
+                       staging.c.day_of_week,
+                       staging.c.season,
+                       staging.c.calendar_year,
+                       staging.c.measurement_timestamp,
+                       staging.c.ridership,
+                       literal(created_on, facts.c.created_on.type))\
+        .where(~exists().where(same_period, facts.c.is_current.is_(True)))
+    insertion = insert(facts).from_select(['route_id', 'is_current', 'day_of_week', 'season', 'calendar_year',
+                                           'measurement_timestamp', 'ridership', 'created_on'], new_facts)
+    etl_report.creates = connection.execute(insertion).rowcount
+    counters.add_row_count(connection, facts, etl_report.creates)
+    staging.drop(connection)
+    etl_report.total_models = counters.get_row_count(session, ridership_model)
+    return etl_report
+
+
+def get_ridership_loader(load_strategy=None):
+    """
+    Args:
+        load_strategy (str): ``replace`` (the default) or ``merge``.
+
+    Returns:
+        The ridership fact load function of the strategy, :func:`load_ridership` or
+        :func:`merge_ridership`.
+    """
+    if load_strategy in (None, 'replace'):
+        return load_ridership
+    if load_strategy == 'merge':
+        return merge_ridership
+    raise ValueError('Unknown load strategy: {0}'.format(load_strategy))
+
+
+def update_ridership(file_location, worksheet_names, ridership_model, session, load_strategy=None):
+    """
+
+    Args:
+        file_location (str): The location of a data store Excel file.
+        worksheet_names (list): A list of strings with Excel file worksheet names.
+        ridership_model: A ridership model, such as :class:`~.models.DailyRidership` model.
+        session: A SQLAlchemy session.
+        load_strategy (str): See :func:`get_ridership_loader`.
+    Returns:
+        An :class:`~.models.ETLReport`.
+    """
+    ridership_facts = list()
+    excel_book = xlrd.open_workbook(filename=file_location)
     for worksheet_name in worksheet_names:
-        excel_book = xlrd.open_workbook(filename=file_location)
         worksheet = excel_book.sheet_by_name(worksheet_name)
         periods = get_periods(worksheet)
-        parse_worksheet_ridership(worksheet, periods, ridership_model,
-                                  session, etl_report)
-    session.commit()
-    # avoids sub-querying performance hit on MySQL
-    query = session.query(func.count(ridership_model.id)).group_by(ridership_model.id)
-    etl_report.total_models = query.count()
-    return etl_report
+        ridership_facts.extend(extract_worksheet_ridership(worksheet, periods))
+    return get_ridership_loader(load_strategy)(ridership_facts, ridership_model, session)
 
 
 def get_route_info(file_location, worksheet_name):
@@ -319,6 +641,24 @@ def get_route_info(file_location, worksheet_name):
         worksheet_name (str): String name of the individual worksheet with cells
             that will be searched and processed.
 
+    Returns:
+        dict: The function returns a dict with ``numbers_available`` (boolean),
+            ``names_available`` (boolean), ``routes`` (list)
+    """
+    excel_book = xlrd.open_workbook(filename=file_location)
+    worksheet = excel_book.sheet_by_name(worksheet_name)
+    return get_worksheet_route_info(worksheet)
+
+
+def get_worksheet_route_info(worksheet, route_header_row=0):
+    """
+    Searches an opened worksheet for route data. See :func:`get_route_info`.
+
+    Args:
+        worksheet: The Excel worksheet searched.
+        route_header_row (int): The row where the route table starts. Rows above
+            it are not searched.
+
     Returns:
         dict: The function returns a dict with ``numbers_available`` (boolean),
             ``names_available`` (boolean), ``routes`` (list)
@@ -329,10 +669,8 @@ def get_route_info(file_location, worksheet_name):
         'types_available': False,
         'routes': [],
     }
-    excel_book = xlrd.open_workbook(filename=file_location)
-    worksheet = excel_book.sheet_by_name(worksheet_name)
-    first_column_cells = worksheet.col(0)
-    row_counter = 0
+    first_column_cells = worksheet.col(0)[route_header_row:]
+    row_counter = route_header_row
     for cell in first_column_cells:
         # if its not a header but is a number...
         if not check_for_headers(cell, worksheet, row_counter, worksheet_routes) \
@@ -380,6 +718,35 @@ def merge_route_data(results):
     return merged_data
 
 
+def store_routes(session, route_infos, report=None):
+    """
+    Creates or updates routes from passed information with one upsert (see
+    :func:`~.loaders.upsert_rows`).
+
+    The route names and service types are converted to all-caps strings.
+
+    Args:
+        session: An SQLAlchemy session.
+        route_infos (dict): Route info dicts with route name and service type data,
+            keyed to digit-only route number labels.
+        report: Optional :class:`~.models.ETLReport` model for capturing ETL operations data.
+    """
+    rows = [{'route_number': int(route_number),
+             'route_name': route_info['route_name'].upper(),
+             'service_type': route_info['service_type'].upper()}
+            for route_number, route_info in route_infos.items()]
+    if not rows:
+        return
+    route_numbers = [row['route_number'] for row in rows]
+    existing = session.execute(select(func.count(models.Route.id))
+                               .where(models.Route.route_number.in_(route_numbers))).scalar()
+    if report:
+        report.updates += existing
+        report.creates += len(rows) - existing
+    loaders.upsert_rows(session, models.Route, rows, ['route_number'])
+    counters.add_row_count(session.connection(), models.Route.__table__, len(rows) - existing)
+
+
 def store_route(session, route_number, route_info, report=None):
     """
     Creates or updates a route from passed information.
@@ -392,19 +759,7 @@ def store_route(session, route_number, route_info, report=None):
         route_info (dict): Contains route name and service type data.
         report: Optional :class:`~.models.ETLReport` model for capturing ETL operations data.
     """
-    try:
-        route = session.query(models.Route).filter_by(route_number=int(route_number)).one()
-        route.route_name = route_info['route_name'].upper()
-        route.service_type = route_info['service_type'].upper()
-        if report:
-            report.updates += 1
-    except NoResultFound:
-        new_route = models.Route(route_number=int(route_number),
-                                 route_name=route_info['route_name'].upper(),
-                                 service_type=route_info['service_type'].upper())
-        session.add(new_route)
-        if report:
-            report.creates += 1
+    store_routes(session, {route_number: route_info}, report)
 
 
 def update_route_info(file_location, session, worksheets):
@@ -417,6 +772,24 @@ def update_route_info(file_location, session, worksheets):
         worksheets (list): The string names of the worksheets to be searched for route info.
         timezone: A pytz-generated timezone info object.
 
+    Returns:
+        :class:`~.models.ETLReport`: A report with basic ETL job metrics
+    """
+    results = list()
+    for worksheet in worksheets:
+        worksheet_routes = get_route_info(file_location, worksheet)
+        results.append(worksheet_routes)
+    return load_route_info(results, session)
+
+
+def load_route_info(results, session):
+    """
+    Merges route info dicts and saves them as route models.
+
+    Args:
+        results (list): A list of dictionaries with route info keyed to ``routes``.
+        session: SQLAlchemy database session.
+
     Returns:
         :class:`~.models.ETLReport`: A report with basic ETL job metrics
     """
@@ -426,17 +799,8 @@ def update_route_info(file_location, session, worksheets):
         creates=0,
         total_models=None
     )
-    results = list()
-    for worksheet in worksheets:
-        worksheet_routes = get_route_info(file_location, worksheet)
-        results.append(worksheet_routes)
-    merged_data = merge_route_data(results)
-    for route_number, route_info in merged_data.items():
-        store_route(session, route_number, route_info, etl_report)
-    session.commit()
-    # avoids sub-querying performance hit on MySQL
-    query = session.query(func.count(models.Route.id)).group_by(models.Route.id)
-    etl_report.total_models = query.count()
+    store_routes(session, merge_route_data(results), etl_report)
+    etl_report.total_models = counters.get_row_count(session, models.Route)
     return etl_report
 
 
@@ -444,347 +808,616 @@ def deactivate_previous_system_ridership_facts(session):
     """
 
     Selects all persisted ``SystemRidership`` models that are currently
-    active and commits their ``is_active`` property to ``False``.
+    active and sets their ``is_active`` property to ``False``.
 
     Args:
         session: SQLAlchemy session.
     """
-    facts = session.query(models.SystemRidership).filter_by(is_active=True).all()
-    for fact in facts:
-        fact.is_active = False
-    session.commit()
+    session.query(models.SystemRidership)\
+           .filter_by(is_active=True)\
+           .update({'is_active': False}, synchronize_session=False)
 
 def deactivate_previous_weekly_performance(session):
     """
 
     Selects all persisted ``WeeklyRidership`` models that are currently
-    active and commits their ``is_current`` property to ``False``.
+    active and sets their ``is_current`` property to ``False``.
 
     Args:
         session: SQLAlchemy session.
     """
-    facts = session.query(models.WeeklyPerformance).filter_by(is_current=True).all()
-    for fact in facts:
-        fact.is_current = False
-    session.commit()
-
-def add_ridership_fact(system_facts, fact):
-    """
-    Fills the passed dict with a mapping of ISO 8601 timestamp keys
-    to a ridership data dict. The ridership dict pairs service types
-    with ridership facts, as well as a ``temporal`` key associated with a dict
-    containing ``day_of_week``, ``season``, and ``calendar_year`` data. Example::
-
-        {
-            '2015-01-02T03:04:56-00:00': {
-                'BUS': 10100,
-                'RAIL': 220,
-                'temporal': {
-                    'day_of_week': 'weekday',
-                    'season': 'winter',
-                    'calendar_year': 2015
-                }
-            }
-        }
+    session.query(models.WeeklyPerformance)\
+           .filter_by(is_current=True)\
+           .update({'is_current': False}, synchronize_session=False)
+
+def update_system_ridership(session, fact_cube=None, batch_size=500):
+    """
+    Maintains the ``SystemRidership`` rollup of route daily ridership by service type,
+    season, calendar year, and day of week. Only rollup cells whose ridership changed
+    are 'deactivated' and saved as new active models; cells without any current
+    route ridership are deactivated.
 
     Args:
-        system_facts (dict):
-        fact (~`.models.DailyRidership`): A :class:`~.models.DailyRidership` instance.
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. Loaded from the session if not passed.
+        batch_size (int): The maximum number of ids per deactivation statement.
     """
-    timestamp = fact.measurement_timestamp.isoformat()
-    if timestamp in system_facts:
-        ridership_by_service = system_facts[timestamp]
-        if fact.route.service_type in ridership_by_service:
-            ridership_by_service[fact.route.service_type] = \
-                ridership_by_service[fact.route.service_type] + fact.ridership
-        else:
-            ridership_by_service[fact.route.service_type] = fact.ridership
-    else:
-        system_facts[timestamp] = {
-            fact.route.service_type: fact.ridership,
-            'temporal': {
-                'day_of_week': fact.day_of_week,
-                'season': fact.season,
-                'calendar_year': fact.calendar_year
-            }
+    if fact_cube is None:
+        fact_cube = cube.FactCube.load(session)
+    active_facts = session.query(models.SystemRidership.id,
+                                 models.SystemRidership.service_type,
+                                 models.SystemRidership.calendar_year,
+                                 models.SystemRidership.season,
+                                 models.SystemRidership.day_of_week,
+                                 models.SystemRidership.ridership)\
+                          .filter_by(is_active=True)\
+                          .yield_per(batch_size)
+    active = {tuple(row[1:5]): row for row in active_facts}
+    ridership, present = fact_cube.system_ridership()
+    created_on = datetime.datetime.now(pytz.utc)
+    system_facts = list()
+    deactivated_ids = list()
+    for service_type, period, day in zip(*np.nonzero(present)):
+        day_of_week = utils.DAYS_OF_WEEK[day]
+        data = {
+            'calendar_year': int(fact_cube.period_years[period]),
+            'created_on': created_on,
+            'day_of_week': day_of_week,
+            'is_active': True,
+            'ridership': float(ridership[service_type, period, day]),
+            'season': fact_cube.period_seasons[period],
+            'measurement_timestamp': fact_cube.period_timestamp(period, day_of_week),
+            'service_type': fact_cube.service_types[service_type]
         }
+        previous = active.pop((data['service_type'], data['calendar_year'], data['season'], day_of_week), None)
+        if previous is not None:
+            if previous.ridership == data['ridership']:
+                continue
+            deactivated_ids.append(previous.id)
+        system_facts.append(data)
+    deactivated_ids.extend(row.id for row in active.values())
+    for start in range(0, len(deactivated_ids), batch_size):
+        session.query(models.SystemRidership)\
+               .filter(models.SystemRidership.id.in_(deactivated_ids[start:start + batch_size]))\
+               .update({'is_active': False}, synchronize_session=False)
+    loaders.insert_rows(session, models.SystemRidership, system_facts, batch_size)
+
+
+def update_weekly_system_ridership(session):
+    """
+    Maintains the :class:`~.models.WeeklySystemRidership` rollup from the active
+    :class:`~.models.SystemRidership` models. Weekly totals count weekday ridership five
+    times. Changed totals are updated in place, new ones inserted, and totals without
+    active system ridership deleted.
 
+    Args:
+        session: An SQLAlchemy session.
 
-def store_system_ridership(system_facts, session):
+    Returns:
+        set: The service types with an inserted, updated, or deleted total.
     """
-    Creates and saves :class:`~.models.SystemRidership` models from
-    passed data.
+    weekly_ridership = case((models.SystemRidership.day_of_week == 'weekday',
+                             5 * models.SystemRidership.ridership),
+                            else_=models.SystemRidership.ridership)
+    service_type = func.upper(models.SystemRidership.service_type)
+    totals = session.query(service_type,
+                           models.SystemRidership.calendar_year,
+                           models.SystemRidership.season,
+                           func.sum(weekly_ridership))\
+                    .filter(models.SystemRidership.is_active.is_(True))\
+                    .group_by(service_type,
+                              models.SystemRidership.calendar_year,
+                              models.SystemRidership.season)\
+                    .all()
+    existing = {(weekly.service_type, weekly.calendar_year, weekly.season): weekly
+                for weekly in session.query(models.WeeklySystemRidership)}
+    update_timestamp = datetime.datetime.now(tz=pytz.utc)
+    changed_service_types = set()
+    new_totals = list()
+    for service_type, calendar_year, season, total in totals:
+        weekly = existing.pop((service_type, calendar_year, season), None)
+        if weekly is None:
+            new_totals.append({
+                'service_type': service_type,
+                'season': season,
+                'calendar_year': calendar_year,
+                'measurement_timestamp': utils.get_period_timestamp('weekday', season, calendar_year),
+                'ridership': total,
+                'updated_on': update_timestamp
+            })
+        elif weekly.ridership != total:
+            weekly.ridership = total
+            weekly.updated_on = update_timestamp
+        else:
+            continue
+        changed_service_types.add(service_type)
+    if existing:
+        changed_service_types.update(weekly.service_type for weekly in existing.values())
+        session.execute(delete(models.WeeklySystemRidership)
+                        .where(models.WeeklySystemRidership.id.in_([weekly.id for weekly in existing.values()])))
+    # new totals are inserted in batches rather than one flushed model at a time
+    loaders.insert_rows(session, models.WeeklySystemRidership, new_totals)
+    return changed_service_types
+
+
+def get_system_trends(session):
+    """
+    Reads the trend points as weekly totals per service type.
 
     Args:
-        system_facts (dict): System ridership data.
-        session: A SQLAlchemy session.
+        session: SQL Alchemy session.
+
+    Returns:
+        OrderedDict: Service types mapped to ``[period ISO 8601 timestamp, total]`` lists
+        in chronological order.
     """
-    for measurement_timestamp, ridership_by_service in system_facts.items():
-        for service_type, ridership in ridership_by_service.items():
-            if service_type is not 'temporal':
-                data = {
-                    'calendar_year': ridership_by_service['temporal']['calendar_year'],
-                    'created_on': datetime.datetime.now(pytz.utc),
-                    'day_of_week': ridership_by_service['temporal']['day_of_week'],
-                    'is_active': True,
-                    'ridership': ridership,
-                    'season': ridership_by_service['temporal']['season'],
-                    'measurement_timestamp': parse(measurement_timestamp),
-                    'service_type': service_type
-                }
-                system_ridership = models.SystemRidership(**data)
-                session.add(system_ridership)
-    session.commit()
+    return records.read_service_trends(session)
 
 
-def update_system_ridership(session):
+def update_system_trends(session):
     """
-    Updates the persisted ``SystemRidership`` models; it 'deactivates' the
-    existing models and then saves new models.
+    Refreshes the trend points from the system ridership rollup and updates the
+    :class:`~.models.SystemTrend` models of service types. Only the changed points
+    are written, and a trend's ``updated_on`` only moves when its points changed.
 
     Args:
-        session: An SQLAlchemy session.
+        session: SQL Alchemy session.
+
+    Returns:
+        list: A :class:`~.records.SystemTrendRecord` for every persisted system trend, with
+        its trend points.
     """
-    deactivate_previous_system_ridership_facts(session)
-    ridership_facts = session.query(models.DailyRidership).filter_by(is_current=True).all()
-    system_facts = dict()
-    for fact in ridership_facts:
-        add_ridership_fact(system_facts, fact)
-    store_system_ridership(system_facts, session)
+    changed_service_types = update_weekly_system_ridership(session)
+    service_trends = get_system_trends(session)
+    update_timestamp = datetime.datetime.now(tz=pytz.utc)
+    # new service types get a trend, and changed ones move their updated_on
+    loaders.upsert_rows(session, models.SystemTrend,
+                        [{'service_type': service_type, 'updated_on': update_timestamp}
+                         for service_type in service_trends if service_type not in changed_service_types],
+                        ['service_type'], update_columns=[])
+    loaders.upsert_rows(session, models.SystemTrend,
+                        [{'service_type': service_type, 'updated_on': update_timestamp}
+                         for service_type in service_trends if service_type in changed_service_types],
+                        ['service_type'])
+    statement = select(models.SystemTrend.id,
+                       models.SystemTrend.service_type,
+                       models.SystemTrend.updated_on)\
+        .order_by(models.SystemTrend.id)
+    trend_records = [records.SystemTrendRecord(trend_id, service_type, service_trends.get(service_type, []),
+                                               updated_on)
+                     for trend_id, service_type, updated_on in session.execute(statement)]
+    return trend_records
+
+
+def update_high_ridership_routes(session, size=10, fact_cube=None):
+    """
+    Flags the ``size`` routes with the highest weekly ridership in the latest period.
+
+    Args:
+        session: SQLAlchemy session.
+        size (int): The number of high ridership routes.
+        fact_cube (~.cube.FactCube): The current facts. When passed, the ranking is
+            computed from the cube and its ``is_high_ridership`` flags are refreshed.
+    """
+    session.query(models.Route).update({'is_high_ridership': False},
+                                       synchronize_session=False)
+    if fact_cube is None:
+        latest = get_latest_measurement_timestamp(session)
+        route_numbers = get_high_ridership_routes(session, latest, size)
+    else:
+        route_numbers = fact_cube.high_ridership_routes(size)
+        fact_cube.is_high_ridership = np.isin(fact_cube.route_numbers, route_numbers)
+    session.query(models.Route)\
+           .filter(models.Route.route_number.in_(route_numbers))\
+           .update({'is_high_ridership': True},
+                   synchronize_session=False)
+
+
+def update_perfdocs(session, fact_cube=None, system_trends=None):
+    print('Updating performance documents...')
+    perfdocs.update(session, fact_cube, system_trends)
 
 
-def to_service_facts(ridership_facts):
+def update_weekly_performance(session, fact_cube=None, batch_size=500):
     """
+    Replaces the current :class:`~.models.WeeklyPerformance` models with the weekly
+    ridership and weekday productivity of every route period in the fact cube.
 
-    Dictionary key hierarchy for aggregation.
+    Args:
+        session: SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. Loaded from the session if not passed.
+        batch_size (int): The maximum number of rows per insert.
+    """
+    if fact_cube is None:
+        fact_cube = cube.FactCube.load(session)
+    deactivate_previous_weekly_performance(session)
+    created_on = datetime.datetime.now(tz=pytz.utc)
+    weeklies = fact_cube.weekly_performance()
+    for weekly in weeklies:
+        weekly['created_on'] = created_on
+        weekly['is_current'] = True
+    loaders.insert_rows(session, models.WeeklyPerformance, weeklies, batch_size)
 
-    A ``service_facts`` dict is keyed to a service type string. That
-    is associated with a ``season_facts`` dict which has
-    keys for the different ISO 8601 timestamps for the first day of
-    a fact's season - regardless of the original day of week for the fact.
-    Each seasonal key is matched with a dict that keys day types in the
-    data with a single ridership number.
 
-    Example::
+def parse_worksheet(worksheet, layout_cache=None):
+    """
+    Parses everything the ETL and the data quality checks need from a worksheet
+    in one pass.
 
-        {
-            'BUS': {
-                '2015-01-02T00:00:00-00:00': {
-                    'weekday': 10100,
-                    'saturday': 2300,
-                    'sunday': 400
-                }
-            }
+    Args:
+        worksheet: An Excel worksheet.
+        layout_cache: An optional :class:`~.layout.LayoutCache`.
+
+    Returns:
+        dict: A worksheet model with ``name``, ``layout`` (see
+            :func:`discover_worksheet_layout`), ``cached_layout`` (boolean), ``routes``
+            (see :func:`get_route_info`), ``ridership`` (see
+            :func:`extract_worksheet_ridership`), and ``non_numeric_cells`` keys.
+    """
+    worksheet_layout, cached = get_worksheet_layout(worksheet, layout_cache)
+    route_header_row = worksheet_layout['route_header_row']
+    if route_header_row is None:
+        worksheet_routes = {
+            'numbers_available': False,
+            'names_available': False,
+            'types_available': False,
+            'routes': [],
         }
+    else:
+        worksheet_routes = get_worksheet_route_info(worksheet, route_header_row)
+    non_numeric_cells = list()
+    ridership_facts = extract_worksheet_ridership(worksheet,
+                                                  restore_periods(worksheet_layout),
+                                                  non_numeric_cells)
+    return {
+        'name': worksheet.name,
+        'layout': worksheet_layout,
+        'cached_layout': cached,
+        'routes': worksheet_routes,
+        'ridership': ridership_facts,
+        'non_numeric_cells': non_numeric_cells
+    }
+
+
+def parse_workbook(file_location, configuration):
+    """
+    Parses the configured worksheets of an Excel file, walking each worksheet once.
+
+    The optional ``layout_cache`` configuration setting enables the layout cache
+    (see :mod:`~.layout`), and ``low_memory`` loads only the configured worksheets,
+    one at a time (see :func:`open_workbook`).
 
     Args:
-        ridership_facts (list): A list of ridership models.
+        file_location (str): Location of the Excel file.
+        configuration (dict): ETL configuration settings.
+
+    Returns:
+        OrderedDict: Worksheet models (see :func:`parse_worksheet`) keyed to the configured
+            worksheet names. Worksheets missing from the file map to ``None``.
     """
-    service_facts = dict()
-    for fact in ridership_facts:
-        # we use the 'weekday' timestamp for the aggregated data
-        measurement_timestamp = utils.get_period_timestamp('weekday', fact.season, fact.calendar_year).isoformat()
-        if fact.service_type.upper() in service_facts:
-            season_facts = service_facts[fact.service_type.upper()]
-            if measurement_timestamp in season_facts:
-                # add ridership for day of week
-                by_day = season_facts[measurement_timestamp]
-                by_day[fact.day_of_week.lower()] = fact.ridership
-            else:
-                # initialize fact's timestamp down to ridership by day of week
-                by_day = {
-                    fact.day_of_week.lower(): fact.ridership
-                }
-                season_facts[measurement_timestamp] = by_day
-        # initialize from fact's service type down to ridership for day of week
-        else:
-            by_day = {
-                fact.day_of_week.lower(): fact.ridership
-            }
-            season_facts = OrderedDict([(measurement_timestamp, by_day)])
-            service_facts[fact.service_type.upper()] = season_facts
-    return service_facts
+    worksheet_names = configuration['daily_ridership_worksheets'] + \
+        configuration['hour_productivity_worksheets']
+    low_memory = configuration.get('low_memory', False)
+    layout_cache = None
+    if configuration.get('layout_cache'):
+        layout_cache = layout.LayoutCache(configuration['layout_cache'])
+    parsed_worksheets = OrderedDict()
+    with open_workbook(file_location, low_memory) as excel_book:
+        available_names = set(excel_book.sheet_names())
+        for worksheet_name in worksheet_names:
+            if worksheet_name not in available_names:
+                parsed_worksheets[worksheet_name] = None
+                continue
+            worksheet = excel_book.sheet_by_name(worksheet_name)
+            parsed_worksheets[worksheet_name] = parse_worksheet(worksheet, layout_cache)
+            if low_memory:
+                excel_book.unload_sheet(worksheet_name)
+    if layout_cache is not None:
+        # cache hits are saved too, as they change which layouts were used most recently
+        layout_cache.save()
+    return parsed_worksheets
+
+
+def extract_workbook(file_location, configuration, parsed_worksheets=None):
+    """
+    Extracts route info and ridership facts from the configured worksheets of an
+    Excel file. Route info is taken from the daily ridership worksheets.
 
+    Args:
+        file_location (str): Location of the Excel file.
+        configuration (dict): ETL configuration settings.
+        parsed_worksheets (dict): Optional worksheet models already parsed from the file,
+            for example during data quality validation (see :func:`parse_workbook`).
 
-def update_system_trends(session):
+    Returns:
+        dict: ``routes`` with a list of route info dicts, plus ridership fact lists
+            keyed to :data:`~.sources.DAILY_RIDERSHIP` and
+            :data:`~.sources.SERVICE_HOUR_RIDERSHIP`.
+    """
+    if parsed_worksheets is None:
+        parsed_worksheets = parse_workbook(file_location, configuration)
+    extraction = {
+        'routes': [],
+        sources.DAILY_RIDERSHIP: [],
+        sources.SERVICE_HOUR_RIDERSHIP: []
+    }
+    worksheet_metrics = [
+        (configuration['daily_ridership_worksheets'], sources.DAILY_RIDERSHIP),
+        (configuration['hour_productivity_worksheets'], sources.SERVICE_HOUR_RIDERSHIP)
+    ]
+    for worksheet_names, metric in worksheet_metrics:
+        for worksheet_name in worksheet_names:
+            parsed_worksheet = parsed_worksheets[worksheet_name]
+            if parsed_worksheet is None:
+                continue
+            if metric == sources.DAILY_RIDERSHIP and parsed_worksheet['routes']['routes']:
+                extraction['routes'].append(parsed_worksheet['routes'])
+            extraction[metric].extend(parsed_worksheet['ridership'])
+    return extraction
+
+
+def extract_file(file_location, configuration, parsed_worksheets=None):
     """
-    Updates :class:`~.models.SystemTrend` models based on existing system trend data
-    for service types.
+    Extracts an Excel workbook or a flat file source into route info and ridership facts.
 
     Args:
-        session: SQL Alchemy session.
+        file_location (str): Location of the data file.
+        configuration (dict): ETL configuration settings.
+        parsed_worksheets (dict): Optional worksheet models of an Excel file.
+
+    Returns:
+        dict: See :func:`extract_workbook`.
     """
-    ridership_facts = session.query(models.SystemRidership)\
-                             .filter_by(is_active=True)\
-                             .order_by(asc(models.SystemRidership.measurement_timestamp))\
-                             .all()
-    service_facts = to_service_facts(ridership_facts)
-    # aggregate the day of week data for a service type's season into one total
-    for service_type, timestamp_ridership_facts in service_facts.items():
-        service_trend = []
-        for timestamp, ridership_by_day in timestamp_ridership_facts.items():
-            total = 0
-            for day_of_week, ridership in ridership_by_day.items():
-                if day_of_week.lower() == 'weekday':
-                    total += (5 * ridership)
-                else:
-                    total += ridership
-            service_trend.append([timestamp, total])
-        # now, persist trend into models
-        update_timestamp = datetime.datetime.now(tz=pytz.utc)
-        try:
-            system_trend = session.query(models.SystemTrend)\
-                                  .filter_by(service_type=service_type)\
-                                  .one()
-            system_trend.trend = json.dumps(service_trend)
-            system_trend.updated_on = update_timestamp
-        except NoResultFound:
-            system_trend = models.SystemTrend(service_type=service_type,
-                                              trend=json.dumps(service_trend),
-                                              updated_on=update_timestamp)
-
-            session.add(system_trend)
-    session.commit()
-
-
-def update_high_ridership_routes(session, size=10):
-    session.query(models.Route).update({'is_high_ridership': False},
-                                       synchronize_session=False)
-    latest = get_latest_measurement_timestamp(session)
-    route_numbers = get_high_ridership_routes(session, latest, size)
-    session.query(models.Route)\
-           .filter(models.Route.route_number.in_(route_numbers))\
-           .update({'is_high_ridership': True},
-                   synchronize_session=False)
-    session.commit()
+    if sources.is_source_file(file_location):
+        extraction = sources.extract_source(file_location)
+        extraction['routes'] = [extraction['routes']]
+        return extraction
+    return extract_workbook(file_location, configuration, parsed_worksheets)
 
 
-def update_perfdocs(session):
-    print('Updating performance documents...')
-    perfdocs.update(session)
-
-
-def update_weekly_performance(session):
-    # aggregator structure
-    #
-    # {timestamp: {
-    #       route-id-label: {
-    #         'ridership': integer,
-    #         'productivity': integer,
-    #         'season': string,
-    #         'year': integer
-    #       },
-    #       route-id-label: {
-    #         'ridership': integer,
-    #         'productivity': integer,
-    #         'season': string,
-    #         'year': integer
-    #       }
-    #   }
-    # }
-    aggregator = {}
-    deactivate_previous_weekly_performance(session)
-    routes = session.query(models.Route).all()
-    for route in routes:
-        route_label = str(route.id)
-        dailies = session.query(models.DailyRidership)\
-                         .filter_by(route_id=route.id, is_current=True)
-        for d in dailies:
-            count = d.ridership * 5 if d.day_of_week == 'weekday' else d.ridership
-            period_ts = utils.get_period_timestamp('weekday', d.season, d.calendar_year).isoformat()
-            if period_ts in aggregator:
-                period_performance = aggregator[period_ts]
-                if route_label in period_performance:
-                    route_performance = period_performance[route_label]
-                    route_performance['ridership'] += int(count)
-                else:
-                    period_performance[route_label] = {
-                        'ridership': int(count),
-                        'productivity': None,
-                        'season': d.season,
-                        'year': d.calendar_year
-                    }
-            else:
-                period_performance = dict()
-                period_performance[route_label] = {
-                    'ridership': int(count),
-                    'productivity': None,
-                    'season': d.season,
-                    'year': d.calendar_year
-                }
-                aggregator[period_ts] = period_performance
-
-        # with daily riderships done, we now get weekday productivity
-        productivities = session.query(models.ServiceHourRidership)\
-                                .filter_by(route_id=route.id, is_current=True, day_of_week='weekday')
-        for p in productivities:
-            period_ts = utils.get_period_timestamp('weekday', p.season, p.calendar_year).isoformat()
-            if period_ts in aggregator:
-                period_performance = aggregator[period_ts]
-                if route_label in period_performance:
-                    route_performance = period_performance[route_label]
-                    route_performance['productivity'] = int(p.ridership)
-    # with aggregator complete, we now save weekly performance models
-    for timestamp, period_performance in aggregator.items():
-        for route_label, route_performance in period_performance.items():
-            created_on = datetime.datetime.now(tz=pytz.utc)
-            measurement_timestamp = utils.get_period_timestamp('weekday',
-                                                               route_performance['season'],
-                                                               route_performance['year'])
-            weekly = models.WeeklyPerformance(created_on=created_on,
-                                              calendar_year=route_performance['year'],
-                                              is_current=True,
-                                              measurement_timestamp=measurement_timestamp,
-                                              productivity=route_performance['productivity'],
-                                              ridership=route_performance['ridership'],
-                                              route_id=int(route_label),
-                                              season=route_performance['season'])
-            session.add(weekly)
-    session.commit()
-
-
-def run_excel_etl(data_source_file, session, configuration):
+def load_extraction(extraction, session, load_strategy=None):
     """
-    Consumes an Excel file with CapMetro data and updates database tables
-    with the file's data.
+    Loads extracted route info and ridership facts and saves an
+    :class:`~.models.ETLReport` for each load.
 
     Args:
-        data_source_file (str): Location of the Excel file to be analyzed.
+        extraction (dict): See :func:`extract_workbook`.
         session: SQLAlchemy session.
-        configuration (dict): ETL configuration settings.
+        load_strategy (str): The ridership fact load strategy, see :func:`get_ridership_loader`.
     """
-    file_location = os.path.abspath(data_source_file)
-    daily_worksheets = configuration['daily_ridership_worksheets']
-    hourly_worksheets = configuration['hour_productivity_worksheets']
+    load_ridership_facts = get_ridership_loader(load_strategy)
     print('Updating route info...')
-    route_info_report = update_route_info(file_location,
-                                          session,
-                                          daily_worksheets)
+    route_info_report = load_route_info(extraction['routes'], session)
     route_info_report.etl_type = 'route-info'
     session.add(route_info_report)
     print('Updating daily ridership...')
-    daily_ridership_report = update_ridership(file_location,
-                                              daily_worksheets,
-                                              models.DailyRidership,
-                                              session)
+    daily_ridership_report = load_ridership_facts(extraction[sources.DAILY_RIDERSHIP],
+                                                  models.DailyRidership,
+                                                  session)
     daily_ridership_report.etl_type = 'daily-ridership'
     session.add(daily_ridership_report)
     print('Updating hourly ridership...')
-    hourly_ridership_report = update_ridership(file_location,
-                                               hourly_worksheets,
-                                               models.ServiceHourRidership,
-                                               session)
+    hourly_ridership_report = load_ridership_facts(extraction[sources.SERVICE_HOUR_RIDERSHIP],
+                                                   models.ServiceHourRidership,
+                                                   session)
     hourly_ridership_report.etl_type = 'hourly-ridership'
     session.add(hourly_ridership_report)
-    session.commit()
-    print('Updating system ridership...')
-    update_system_ridership(session)
-    print('Updating system trends...')
-    update_system_trends(session)
-    print('Updating weekly performance...')
-    update_weekly_performance(session)
-    print('Updating high ridership routes...')
-    update_high_ridership_routes(session)
-    update_perfdocs(session)
+    session.flush()
+    # the derived stages read facts as records, so nothing loaded so far is needed
+    session.expunge_all()
+
+
+@contextlib.contextmanager
+def stage_transaction(session):
+    """
+    Runs an ETL stage in one transaction, committed when the stage completes and
+    rolled back if it raises. The stage functions only flush their changes, so the
+    ETL runs decide where transactions end.
+
+    Args:
+        session: SQLAlchemy session.
+
+    Raises:
+        ValueError: If the session is already in a transaction, which the stage
+            would otherwise be nested in and not commit.
+    """
+    if session.in_transaction():
+        raise ValueError('The session is already in a transaction; commit or roll it back '
+                         'before running an ETL stage.')
+    with session.begin():
+        yield session
+
+
+def analyze_database(session, configuration):
+    """
+    Refreshes the query planner statistics after a load on SQLite databases with the
+    bulk load profile (see :mod:`~.engines`).
+
+    Args:
+        session: SQLAlchemy session.
+        configuration (dict): ETL configuration settings.
+    """
+    if configuration.get('sqlite_bulk_load') and session.get_bind().dialect.name == 'sqlite':
+        session.execute(text('ANALYZE'))
+
+
+def run_etl_stages(extraction, session, configuration):
+    """
+    Loads an extraction and rebuilds the derived tables and performance documents.
+    The load is one transaction.
+
+    Args:
+        extraction (dict): See :func:`extract_workbook`.
+        session: SQLAlchemy session.
+        configuration (dict): ETL configuration settings.
+    """
+    with profiling.stage('load'), stage_transaction(session):
+        load_extraction(extraction, session, configuration.get('load_strategy'))
+    with profiling.stage('analyze'), stage_transaction(session):
+        analyze_database(session, configuration)
+    run_derived_etl(session)
+
+
+def run_excel_etl(data_source_file, session, configuration, parsed_worksheets=None):
+    """
+    Consumes an Excel file with CapMetro data and updates database tables
+    with the file's data.
+
+    Args:
+        data_source_file (str): Location of the Excel file to be analyzed.
+        session: SQLAlchemy session.
+        configuration (dict): ETL configuration settings.
+        parsed_worksheets (dict): Optional worksheet models already parsed from the file
+            by :func:`~.quality.validate_workbook`, so the file is not parsed again.
+    """
+    file_location = os.path.abspath(data_source_file)
+    with profiling.stage('extract'):
+        extraction = extract_workbook(file_location, configuration, parsed_worksheets)
+    run_etl_stages(extraction, session, configuration)
+    session.close()
+
+
+def run_source_etl(data_source_file, session, configuration=None):
+    """
+    Consumes a long-format CSV or Parquet file (see :mod:`~.sources`) and updates
+    database tables with the file's data.
+
+    Args:
+        data_source_file (str): Location of the flat file to be loaded.
+        session: SQLAlchemy session.
+        configuration (dict): Optional ETL configuration settings.
+    """
+    configuration = configuration or dict()
+    file_location = os.path.abspath(data_source_file)
+    with profiling.stage('extract'):
+        extraction = sources.extract_source(file_location)
+    extraction['routes'] = [extraction['routes']]
+    run_etl_stages(extraction, session, configuration)
+    session.close()
+
+
+def find_batch_files(batch_source):
+    """
+    Lists the data files of a batch.
+
+    Args:
+        batch_source (str): A directory or a glob pattern. Only the matched ``.xls``,
+            CSV, and Parquet files are included.
+
+    Returns:
+        list: Sorted absolute file locations.
+    """
+    if os.path.isdir(batch_source):
+        candidates = [os.path.join(batch_source, name) for name in os.listdir(batch_source)]
+    else:
+        candidates = glob.glob(batch_source)
+    candidates = [c for c in candidates
+                  if os.path.splitext(c)[1].lower() in BATCH_EXTENSIONS]
+    return sorted(os.path.abspath(c) for c in candidates if os.path.isfile(c))
+
+
+def get_period_coverage(extraction):
+    """
+    Determines the span of periods covered by an extraction's ridership facts.
+
+    Args:
+        extraction (dict): See :func:`extract_workbook`.
+
+    Returns:
+        tuple: The latest and the earliest measurement timestamps, or ``(None, None)``
+            if the extraction has no ridership facts.
+    """
+    timestamps = [fact['timestamp']
+                  for metric in sources.RIDERSHIP_MODELS
+                  for fact in extraction[metric]]
+    if not timestamps:
+        return None, None
+    return max(timestamps), min(timestamps)
+
+
+def merge_extractions(extractions):
+    """
+    Resolves a batch of extractions into one. The extractions must be in
+    chronological order; for each route and each ridership period the value
+    from the last extraction wins.
+
+    Args:
+        extractions (list): Extraction dicts ordered oldest to newest.
+
+    Returns:
+        dict: A single extraction, see :func:`extract_workbook`.
+    """
+    merged = {'routes': []}
+    for metric in sources.RIDERSHIP_MODELS:
+        latest_facts = OrderedDict()
+        for extraction in extractions:
+            for fact in extraction[metric]:
+                key = (fact['route_number'], fact['season'], fact['year'], fact['day_of_week'])
+                latest_facts[key] = fact
+        merged[metric] = list(latest_facts.values())
+    for extraction in extractions:
+        merged['routes'].extend(extraction['routes'])
+    return merged
+
+
+def run_batch_etl(file_locations, session, configuration, parsed_workbooks=None):
+    """
+    Consumes several data files in one ETL run. The files are ordered by their
+    period coverage so newer releases supersede older ones, superseded values are
+    resolved in memory, and the final facts are loaded once before the derived
+    tables and performance documents are rebuilt a single time.
+
+    Args:
+        file_locations (list): Locations of Excel, CSV, or Parquet files.
+        session: SQLAlchemy session.
+        configuration (dict): ETL configuration settings.
+        parsed_workbooks (dict): Optional worksheet models (see :func:`parse_workbook`)
+            keyed to the Excel file locations they were parsed from.
+    """
+    parsed_workbooks = parsed_workbooks or dict()
+    covered_extractions = list()
+    for file_location in file_locations:
+        print('Extracting {0}...'.format(file_location))
+        with profiling.stage('extract'):
+            extraction = extract_file(os.path.abspath(file_location),
+                                      configuration,
+                                      parsed_workbooks.get(file_location))
+        latest, earliest = get_period_coverage(extraction)
+        # files without ridership periods only contribute route info, so they go first
+        coverage = (latest is not None, latest, earliest, file_location)
+        covered_extractions.append((coverage, extraction))
+    covered_extractions.sort(key=lambda c: c[0])
+    merged = merge_extractions([c[1] for c in covered_extractions])
+    run_etl_stages(merged, session, configuration)
     session.close()
 
+
+def run_derived_etl(session, fused=True):
+    """
+    Rebuilds the tables derived from route ridership facts (system ridership,
+    system trends, weekly performance, high ridership routes) in one transaction
+    and the performance documents in another (see :func:`stage_transaction`). The
+    current facts are read once into a :class:`~.cube.FactCube` that the route
+    level stages reduce, and system trends are read from the maintained system
+    ridership rollups.
+
+    Args:
+        session: SQLAlchemy session.
+        fused (bool): If ``True``, the performance documents are built from the
+            in-memory cube and system trends instead of reading the derived tables back.
+    """
+    with profiling.stage('derived'), stage_transaction(session):
+        fact_cube = cube.FactCube.load(session)
+        print('Updating system ridership...')
+        update_system_ridership(session, fact_cube)
+        print('Updating system trends...')
+        system_trends = update_system_trends(session)
+        print('Updating weekly performance...')
+        update_weekly_performance(session, fact_cube)
+        print('Updating high ridership routes...')
+        update_high_ridership_routes(session, fact_cube=fact_cube)
+    with profiling.stage('perfdocs'), stage_transaction(session):
+        if fused:
+            update_perfdocs(session, fact_cube, system_trends)
+        else:
+            update_perfdocs(session)
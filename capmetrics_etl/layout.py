@@ -0,0 +1,95 @@
+"""
+Workbook layout fingerprints and a persisted cache of discovered header layouts.
+
+CapMetro releases its workbooks from a template that rarely changes between
+quarters. A layout fingerprint summarizes the parts of a worksheet that header
+discovery depends on (sheet name, dimensions, and the text of the header rows).
+When a worksheet's fingerprint is found in the cache, the period columns and
+route header row discovered for an earlier workbook are reused.
+"""
+import hashlib
+import json
+import os
+
+# the rows searched for period headers, plus the row below them that can hold day of
+# week labels; header discovery (see :func:`~.etl.scan_worksheet_headers`) reads them all
+HEADER_SEARCH_ROWS = 10
+HEADER_ROWS = HEADER_SEARCH_ROWS + 1
+
+
+def get_worksheet_fingerprint(worksheet, header_rows=HEADER_ROWS):
+    """
+    Computes a fingerprint of a worksheet's layout from its name, its dimensions,
+    and the text of its header rows.
+
+    Args:
+        worksheet: An Excel worksheet.
+        header_rows (int): The number of leading rows holding header text.
+
+    Returns:
+        str: A SHA-256 hex digest.
+    """
+    header_text = list()
+    for row_index in range(min(header_rows, worksheet.nrows)):
+        header_text.append([str(value) for value in worksheet.row_values(row_index)])
+    layout = [worksheet.name, worksheet.nrows, worksheet.ncols, header_text]
+    serialized = json.dumps(layout).encode('utf-8')
+    return hashlib.sha256(serialized).hexdigest()
+
+
+class LayoutCache:
+    """
+    A JSON file mapping worksheet fingerprints to the layouts discovered for them.
+
+    A worksheet layout is a dict with ``periods`` (period info dicts without timestamps,
+    keyed to column) and ``route_header_row`` keys. Only the ``size`` most recently
+    used fingerprints are kept; the least recently used one is evicted first.
+
+    Attributes:
+        location (str): The cache file location.
+        size (int): The maximum number of cached fingerprints.
+    """
+
+    def __init__(self, location, size=64):
+        self.location = location
+        self.size = size
+        self.layouts = dict()
+        if os.path.exists(location):
+            try:
+                with open(location) as cache_file:
+                    self.layouts = json.load(cache_file)
+            except ValueError:
+                # a corrupt cache is rebuilt by the next full scan
+                self.layouts = dict()
+
+    def get(self, fingerprint):
+        """
+        Looks up a worksheet fingerprint, marking it as the most recently used.
+
+        Returns:
+            dict: The cached worksheet layout, or ``None`` on a cache miss.
+        """
+        worksheet_layout = self.layouts.pop(fingerprint, None)
+        if worksheet_layout is not None:
+            self.layouts[fingerprint] = worksheet_layout
+        return worksheet_layout
+
+    def put(self, fingerprint, worksheet_layout):
+        """
+        Stores the layout discovered for a worksheet fingerprint. Call :meth:`save`
+        to persist the cache.
+
+        Args:
+            fingerprint (str): A worksheet fingerprint.
+            worksheet_layout (dict): The discovered worksheet layout.
+        """
+        self.layouts.pop(fingerprint, None)
+        self.layouts[fingerprint] = worksheet_layout
+        while len(self.layouts) > self.size:
+            del self.layouts[next(iter(self.layouts))]
+
+    def save(self):
+        temporary_location = '{0}.tmp'.format(self.location)
+        with open(temporary_location, 'w') as cache_file:
+            json.dump(self.layouts, cache_file)
+        os.replace(temporary_location, self.location)
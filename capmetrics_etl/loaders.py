@@ -0,0 +1,218 @@
+"""
+Bulk row loaders for the fact and derived tables.
+
+On PostgreSQL, rows are streamed into a table with ``COPY ... FROM STDIN`` from an
+in-memory buffer in the text format, which is much faster than ``INSERT``
+statements. The ``COPY`` runs on the session's connection, so it is part of the
+session's transaction. Other databases receive batched ``executemany`` inserts.
+
+Rows keyed to a unique column are upserted with :func:`upsert_rows`, which uses
+``INSERT ... ON CONFLICT`` on PostgreSQL and SQLite.
+
+All loaders take column value dicts keyed to column names, like
+:meth:`~sqlalchemy.orm.Session.bulk_insert_mappings`. Values are converted with the
+columns' bind processing, so label columns (see :class:`~.models.LabelCode`) accept
+labels.
+"""
+import datetime
+import io
+from itertools import islice
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from . import counters
+
+# dialects with INSERT ... ON CONFLICT support
+UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert
+}
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+# the text format's null marker
+COPY_NULL = '\\N'
+
+
+def encode_copy_value(value):
+    """
+    Encodes a value for the ``COPY`` text format.
+
+    Args:
+        value: A bind processed column value.
+
+    Returns:
+        str: The encoded value.
+    """
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value).translate(COPY_ESCAPES)
+
+
+def get_bind_processors(table, column_names, dialect):
+    processors = list()
+    for column_name in column_names:
+        processors.append(table.c[column_name].type.bind_processor(dialect))
+    return processors
+
+
+def write_copy_buffer(rows, column_names, processors):
+    """
+    Writes column value dicts to an in-memory ``COPY`` text format buffer.
+
+    Returns:
+        io.StringIO: The buffer, rewound.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        values = list()
+        for column_name, processor in zip(column_names, processors):
+            value = row.get(column_name)
+            if processor is not None:
+                value = processor(value)
+            values.append(encode_copy_value(value))
+        buffer.write('\t'.join(values))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(connection, table, rows, column_names):
+    """
+    Streams rows into a table with ``COPY ... FROM STDIN`` on a PostgreSQL connection.
+
+    Args:
+        connection: A SQLAlchemy connection; the ``COPY`` joins its transaction.
+        table: The SQLAlchemy table.
+        rows (list): Column value dicts.
+        column_names (list): The copied columns.
+    """
+    processors = get_bind_processors(table, column_names, connection.dialect)
+    buffer = write_copy_buffer(rows, column_names, processors)
+    statement = 'COPY {0} ({1}) FROM STDIN'.format(
+        table.name, ', '.join(connection.dialect.identifier_preparer.quote(name) for name in column_names))
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(statement, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def supports_copy(connection):
+    """
+    Returns:
+        bool: ``True`` if the connection's database and driver accept ``COPY FROM STDIN``.
+    """
+    return connection.dialect.name == 'postgresql' and \
+        connection.dialect.driver in ('psycopg2', 'psycopg')
+
+
+def get_batches(mappings, batch_size):
+    mappings = iter(mappings)
+    batch = list(islice(mappings, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(mappings, batch_size))
+
+
+def insert_rows(session, model, mappings, batch_size=500):
+    """
+    Loads rows ``batch_size`` at a time with ``COPY`` on PostgreSQL and ``executemany``
+    inserts elsewhere, in the session's transaction. Only one batch of mappings is held
+    in memory when ``mappings`` is a generator. The row counts of counted tables are
+    adjusted (see :mod:`~.counters`).
+
+    Args:
+        session: A SQLAlchemy session.
+        model: The SQLAlchemy model *class* or table of the inserted rows.
+        mappings: An iterable of column value dicts. Every dict has the same keys.
+        batch_size (int): The maximum number of rows per ``COPY`` or insert.
+
+    Returns:
+        int: The number of inserted rows.
+    """
+    table = getattr(model, '__table__', model)
+    connection = session.connection()
+    use_copy = supports_copy(connection)
+    inserted = 0
+    for batch in get_batches(mappings, batch_size):
+        if use_copy:
+            column_names = [column.name for column in table.columns if column.name in batch[0]]
+            copy_rows(connection, table, batch, column_names)
+        else:
+            connection.execute(insert(table), batch)
+        inserted += len(batch)
+    if table.name in counters.COUNTED_TABLES:
+        counters.add_row_count(connection, table, inserted)
+    return inserted
+
+
+def merge_batch(connection, table, batch, index_elements, update_columns):
+    """
+    Upserts a batch on databases without ``INSERT ... ON CONFLICT``: one ``SELECT`` finds
+    the existing keys, then the existing rows are updated and the others inserted.
+    """
+    key_columns = [table.c[name] for name in index_elements]
+    keys = [tuple(row[name] for name in index_elements) for row in batch]
+    existing = set(tuple(row) for row in connection.execute(
+        select(*key_columns).where(tuple_(*key_columns).in_(keys))))
+    updated = [row for row, key in zip(batch, keys) if key in existing]
+    inserted = [row for row, key in zip(batch, keys) if key not in existing]
+    if updated and update_columns:
+        statement = update(table)\
+            .where(*[column == bindparam('key_{0}'.format(column.name)) for column in key_columns])\
+            .values({name: bindparam(name) for name in update_columns})
+        parameters = [dict({'key_{0}'.format(name): row[name] for name in index_elements},
+                           **{name: row[name] for name in update_columns})
+                      for row in updated]
+        connection.execute(statement, parameters)
+    if inserted:
+        connection.execute(insert(table), inserted)
+
+
+def upsert_rows(session, model, mappings, index_elements, update_columns=None, batch_size=500):
+    """
+    Inserts rows, or updates the rows that already exist, one statement per batch on
+    PostgreSQL and SQLite (``INSERT ... ON CONFLICT DO UPDATE``). Other databases
+    select the existing keys of each batch first. Runs in the session's transaction.
+
+    Args:
+        session: A SQLAlchemy session.
+        model: The SQLAlchemy model *class* or table of the rows.
+        mappings: An iterable of column value dicts. Every dict has the same keys.
+        index_elements (list): The names of the unique columns identifying a row.
+        update_columns (list): The columns overwritten on existing rows. Defaults to
+            every other column of the mappings. When empty, existing rows are left alone.
+        batch_size (int): The maximum number of rows per statement.
+
+    Returns:
+        int: The number of inserted or updated rows.
+    """
+    table = getattr(model, '__table__', model)
+    connection = session.connection()
+    dialect_insert = UPSERT_INSERTS.get(connection.dialect.name)
+    upserted = 0
+    for batch in get_batches(mappings, batch_size):
+        if update_columns is None:
+            update_columns = [name for name in batch[0] if name not in index_elements]
+        if dialect_insert is None:
+            merge_batch(connection, table, batch, index_elements, update_columns)
+        else:
+            statement = dialect_insert(table)
+            if update_columns:
+                statement = statement.on_conflict_do_update(
+                    index_elements=index_elements,
+                    set_={name: statement.excluded[name] for name in update_columns})
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+            connection.execute(statement, batch)
+        upserted += len(batch)
+    return upserted
@@ -0,0 +1,206 @@
+"""
+In-place migrations of databases created by earlier versions of **capmetrics-etl**.
+
+Earlier versions stored ``day_of_week`` and ``season`` as free strings. They are now
+stored as the small integer codes of :class:`~.models.LabelCode` columns. A legacy
+label column is detected from the reflected column type and converted:
+
+* On PostgreSQL, the column type is altered in place with a ``USING`` expression.
+* On other databases (SQLite cannot alter column types), the table is rebuilt. It is
+  renamed, recreated from the models, copied over, and the legacy copy is dropped.
+
+Unknown labels become ``NULL``.
+
+Earlier versions also lacked the unique indexes that upserts (see
+:func:`~.loaders.upsert_rows`) conflict on. :func:`migrate_unique_indexes` removes
+duplicate rows, keeping the newest, and replaces plain indexes with unique ones.
+Plain indexes added to existing tables, such as the system ridership rollup index, are
+created by :func:`migrate_indexes`.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import sqltypes
+from . import models
+
+
+def get_label_columns():
+    """
+    Returns:
+        dict: Table names mapped to the :class:`~.models.LabelCode` columns of the table.
+    """
+    label_columns = dict()
+    for table in models.Base.metadata.sorted_tables:
+        columns = [column for column in table.columns if isinstance(column.type, models.LabelCode)]
+        if columns:
+            label_columns[table.name] = columns
+    return label_columns
+
+
+def get_code_expression(column_name, vocabulary):
+    cases = ' '.join("WHEN '{0}' THEN {1}".format(label, code) for code, label in enumerate(vocabulary))
+    return 'CASE lower({0}) {1} END'.format(column_name, cases)
+
+
+def find_legacy_label_columns(engine):
+    """
+    Finds label columns that are still stored as strings.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        dict: Table names mapped to lists of legacy :class:`~.models.LabelCode` columns.
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    legacy_columns = dict()
+    for table_name, columns in get_label_columns().items():
+        if table_name not in table_names:
+            continue
+        reflected_types = {column['name']: column['type'] for column in inspector.get_columns(table_name)}
+        legacy = [column for column in columns
+                  if isinstance(reflected_types.get(column.name), sqltypes.String)]
+        if legacy:
+            legacy_columns[table_name] = legacy
+    return legacy_columns
+
+
+def rebuild_table(connection, table, legacy_columns):
+    inspector = inspect(connection)
+    legacy_name = '{0}_legacy'.format(table.name)
+    legacy_column_names = [column['name'] for column in inspector.get_columns(table.name)]
+    # index names are database-wide in SQLite, so they must go before the table is recreated
+    for index in inspector.get_indexes(table.name):
+        connection.execute(text('DROP INDEX {0}'.format(index['name'])))
+    connection.execute(text('ALTER TABLE {0} RENAME TO {1}'.format(table.name, legacy_name)))
+    table.create(connection)
+    legacy_codes = {column.name: get_code_expression(column.name, column.type.vocabulary)
+                    for column in legacy_columns}
+    copied = [column.name for column in table.columns if column.name in legacy_column_names]
+    selected = [legacy_codes.get(name, name) for name in copied]
+    connection.execute(text('INSERT INTO {0} ({1}) SELECT {2} FROM {3}'.format(
+        table.name, ', '.join(copied), ', '.join(selected), legacy_name)))
+    connection.execute(text('DROP TABLE {0}'.format(legacy_name)))
+
+
+def migrate_label_columns(engine):
+    """
+    Converts legacy string ``day_of_week`` and ``season`` columns to integer codes.
+    Databases without legacy columns are left untouched.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        list: The names of the migrated tables.
+    """
+    legacy_columns = find_legacy_label_columns(engine)
+    if not legacy_columns:
+        return []
+    tables = models.Base.metadata.tables
+    with engine.begin() as connection:
+        for table_name, columns in legacy_columns.items():
+            if engine.dialect.name == 'postgresql':
+                for column in columns:
+                    connection.execute(text('ALTER TABLE {0} ALTER COLUMN {1} TYPE SMALLINT USING {2}'.format(
+                        table_name, column.name, get_code_expression(column.name, column.type.vocabulary))))
+            else:
+                rebuild_table(connection, tables[table_name], columns)
+    return sorted(legacy_columns)
+
+
+def find_missing_unique_indexes(engine):
+    """
+    Finds the unique single-column indexes of the models that an existing table lacks.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        list: SQLAlchemy ``Index`` objects.
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    missing = list()
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        reflected = inspector.get_indexes(table.name)
+        unique_columns = [tuple(index['column_names']) for index in reflected if index['unique']]
+        unique_columns.extend(tuple(constraint['column_names'])
+                              for constraint in inspector.get_unique_constraints(table.name))
+        for index in table.indexes:
+            if index.unique and tuple(column.name for column in index.columns) not in unique_columns:
+                missing.append(index)
+    return missing
+
+
+def migrate_unique_indexes(engine):
+    """
+    Creates missing unique indexes. Rows sharing a unique key are removed first,
+    except for the one with the highest id, and a plain index with the unique index's
+    name is dropped.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        list: The names of the created indexes.
+    """
+    missing = find_missing_unique_indexes(engine)
+    if not missing:
+        return []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for index in missing:
+            table = index.table
+            index_names = [reflected['name'] for reflected in inspector.get_indexes(table.name)]
+            if index.name in index_names:
+                connection.execute(text('DROP INDEX {0}'.format(index.name)))
+            key = ', '.join(column.name for column in index.columns)
+            # the subquery is wrapped in a derived table for MySQL's sake
+            connection.execute(text('DELETE FROM {0} WHERE id NOT IN (SELECT id FROM '
+                                    '(SELECT max(id) AS id FROM {0} GROUP BY {1}) AS newest)'.format(table.name, key)))
+            index.create(connection)
+    return sorted(index.name for index in missing)
+
+
+def find_missing_indexes(engine):
+    """
+    Finds the plain (not unique) indexes of the models that an existing table lacks.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        list: SQLAlchemy ``Index`` objects.
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    missing = list()
+    for table in models.Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        index_names = [index['name'] for index in inspector.get_indexes(table.name)]
+        missing.extend(index for index in table.indexes
+                       if not index.unique and index.name not in index_names)
+    return missing
+
+
+def migrate_indexes(engine):
+    """
+    Creates the missing plain indexes of existing tables with ``CREATE INDEX IF NOT EXISTS``.
+
+    Args:
+        engine: A SQLAlchemy engine.
+
+    Returns:
+        list: The names of the created indexes.
+    """
+    missing = find_missing_indexes(engine)
+    if not missing:
+        return []
+    with engine.begin() as connection:
+        for index in missing:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+    return sorted(index.name for index in missing)
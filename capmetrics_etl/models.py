@@ -3,14 +3,65 @@ The **capmetrics-etl** models represent data that allows for
 consistent comparisons of ridership and other performance data across
 time, routes, and service types.
 """
-from sqlalchemy import Boolean, Column, Integer, Float, DateTime, ForeignKey, String
+from sqlalchemy import Boolean, Column, Integer, Float, DateTime, ForeignKey, Index, SmallInteger, String, \
+    UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
+from . import utils
 
 
 Base = declarative_base()
 
 
+class LabelCode(TypeDecorator):
+    """
+    Stores a label from a fixed vocabulary as its small integer position in the
+    vocabulary. Labels are bound case-insensitively and loaded as lower case strings,
+    so models keep working with ``'weekday'`` or ``'spring'`` values. Integer codes
+    are bound as-is.
+
+    Args:
+        vocabulary (tuple): The known labels, such as :data:`~.utils.SEASONS`.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, vocabulary):
+        super().__init__()
+        self.vocabulary = tuple(vocabulary)
+        self.codes = {label: code for code, label in enumerate(self.vocabulary)}
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return self.codes[value.lower()]
+        except KeyError:
+            raise ValueError('Unknown label {0!r}; expected one of {1}'.format(value, self.vocabulary))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.vocabulary[int(value)]
+
+
+class DayOfWeek(LabelCode):
+    """A :class:`LabelCode` for :data:`~.utils.DAYS_OF_WEEK`."""
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(utils.DAYS_OF_WEEK)
+
+
+class Season(LabelCode):
+    """A :class:`LabelCode` for :data:`~.utils.SEASONS`."""
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(utils.SEASONS)
+
+
 class Route(Base):
     """
     A geographically semi-consistent designation for transit service.
@@ -32,8 +83,8 @@ class DailyRidership(Base):
     id = Column(Integer, primary_key=True)
     created_on = Column(DateTime(timezone=True))
     is_current = Column(Boolean)
-    day_of_week = Column(String)
-    season = Column(String)
+    day_of_week = Column(DayOfWeek())
+    season = Column(Season())
     calendar_year = Column(Integer)
     ridership = Column(Float)
     route_id = Column(Integer, ForeignKey('route.id'), index=True)
@@ -55,7 +106,7 @@ class WeeklyPerformance(Base):
     ridership = Column(Float)
     route_id = Column(Integer, ForeignKey('route.id'), index=True)
     route = relationship("Route", backref='weekly_performances')
-    season = Column(String)
+    season = Column(Season())
 
 
 class ServiceHourRidership(Base):
@@ -67,48 +118,96 @@ class ServiceHourRidership(Base):
     id = Column(Integer, primary_key=True)
     calendar_year = Column(Integer)
     created_on = Column(DateTime(timezone=True))
-    day_of_week = Column(String)
+    day_of_week = Column(DayOfWeek())
     is_current = Column(Boolean)
     measurement_timestamp = Column(DateTime(timezone=True))
     ridership = Column(Float)
     route_id = Column(Integer, ForeignKey('route.id'), index=True)
     route = relationship("Route", backref='service_hour_ridership')
-    season = Column(String)
+    season = Column(Season())
 
 
 class SystemRidership(Base):
     """
     Estimated **system-wide** ridership for a (1) type of day (weekday, Saturday, Sunday)
     by (2) season and (3) service type.
+
+    The active models are a rollup of the current route ridership. A rollup cell
+    gets a new active model only when its ridership changes.
     """
     __tablename__ = 'system_ridership'
+    __table_args__ = (
+        Index('ix_system_ridership_rollup', 'service_type', 'calendar_year', 'season', 'day_of_week'),
+    )
     id = Column(Integer, primary_key=True)
     calendar_year = Column(Integer)
     created_on = Column(DateTime(timezone=True))
-    day_of_week = Column(String)
-    is_active = Column(Boolean)
+    day_of_week = Column(DayOfWeek())
+    is_active = Column(Boolean, index=True)
     ridership = Column(Float)
-    season = Column(String)
+    season = Column(Season())
     measurement_timestamp = Column(DateTime(timezone=True))
     service_type = Column(String)
 
 
+class WeeklySystemRidership(Base):
+    """
+    Estimated **system-wide** weekly ridership (five weekdays, a Saturday, and a Sunday)
+    for a season and service type. The rows are a rollup of the active
+    :class:`SystemRidership` models that is updated in place, and they are
+    the points of the service type's :class:`SystemTrend`.
+
+    Attributes:
+        id: An integer primary key.
+        service_type: An upper case service type.
+        season: The season name.
+        calendar_year: The calendar year.
+        measurement_timestamp: The season's weekday period timestamp.
+        ridership: The weekly ridership total.
+        updated_on: A timezone-aware datetime.
+    """
+    __tablename__ = 'weekly_system_ridership'
+    __table_args__ = (
+        UniqueConstraint('service_type', 'calendar_year', 'season'),
+        Index('ix_weekly_system_ridership_trend', 'service_type', 'measurement_timestamp'),
+    )
+    id = Column(Integer, primary_key=True)
+    service_type = Column(String)
+    season = Column(Season())
+    calendar_year = Column(Integer)
+    measurement_timestamp = Column(DateTime(timezone=True))
+    ridership = Column(Float)
+    updated_on = Column(DateTime(timezone=True))
+
+
 class SystemTrend(Base):
     """
-    Aggregates ``SystemRidership`` facts to conveniently provide a performance
-    trend for a service type across season-based measurements.
+    Provides a performance trend for a service type across season-based
+    measurements. The trend points are the service type's
+    :class:`WeeklySystemRidership` rows.
 
     Attributes:
         id: An integer primary key.
         service_type: A string column with names for service types.
-        trend: A JSON string with longitudinal ridership data.
-        updated_on: A timezone-aware datetime.
+        points: The service type's :class:`WeeklySystemRidership` models in chronological order.
+        updated_on: A timezone-aware datetime of the last change to the trend's points.
     """
     __tablename__ = 'system_trend'
     id = Column(Integer, primary_key=True)
-    service_type = Column(String)
-    trend = Column(String)
+    service_type = Column(String, unique=True, index=True)
     updated_on = Column(DateTime(timezone=True))
+    points = relationship('WeeklySystemRidership',
+                          primaryjoin='SystemTrend.service_type == foreign(WeeklySystemRidership.service_type)',
+                          order_by='WeeklySystemRidership.measurement_timestamp',
+                          viewonly=True)
+
+    @property
+    def trend(self):
+        """
+        list: ``[weekday period ISO 8601 timestamp, weekly ridership]`` pairs.
+        """
+        return [[utils.get_period_isoformat('weekday', point.season, point.calendar_year), point.ridership]
+                for point in self.points]
 
 
 class ETLReport(Base):
@@ -122,11 +221,47 @@ class ETLReport(Base):
     total_models = Column(Integer)
 
 
+class TableCount(Base):
+    """
+    The row count of a table, maintained in the transactions that insert or delete
+    its rows (see :mod:`~.counters`).
+
+    Attributes:
+        table_name: The counted table's name, the primary key.
+        row_count: An integer column with the table's number of rows.
+    """
+    __tablename__ = 'table_count'
+    table_name = Column(String, primary_key=True)
+    row_count = Column(Integer)
+
+
 class PerformanceDocument(Base):
     """JSON API documents with performance metrics for system trends
     and individual routes."""
     __tablename__ = 'performance_document'
     id = Column(Integer, primary_key=True)
     document = Column(String)
-    name = Column(String, index=True)
+    name = Column(String, unique=True, index=True)
     updated_on = Column(DateTime(timezone=True))
+
+
+class QualityCheck(Base):
+    """
+    Caches a data quality verdict for a data file and worksheet configuration.
+
+    Attributes:
+        id: An integer primary key.
+        file_hash: The SHA-256 hex digest of the data file's content.
+        configuration_hash: The SHA-256 hex digest of the checked worksheet names.
+        passed: A boolean verdict.
+        report: A JSON string with the quality report.
+        created_on: A timezone-aware datetime.
+    """
+    __tablename__ = 'quality_check'
+    __table_args__ = (UniqueConstraint('file_hash', 'configuration_hash'),)
+    id = Column(Integer, primary_key=True)
+    file_hash = Column(String, index=True)
+    configuration_hash = Column(String)
+    passed = Column(Boolean)
+    report = Column(String)
+    created_on = Column(DateTime(timezone=True))
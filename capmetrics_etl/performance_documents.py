@@ -1,16 +1,20 @@
 from collections import OrderedDict
 import datetime
 import json
+import numpy as np
 from sqlalchemy import asc, desc
-from sqlalchemy.orm.exc import NoResultFound
 import pytz
+from . import cube
+from . import loaders
 from . import models
+from . import profiling
+from . import records
 from . import utils
 
 
 class RouteCompendiumEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, models.DailyRidership):
+        if isinstance(obj, (models.DailyRidership, records.FactRecord)):
             return {
                 'id': str(obj.id),
                 'createdOn': obj.created_on.isoformat(),
@@ -67,12 +71,27 @@ def transform_ridership_collection(riderships, type_name, route_id, included):
     return resource_identifiers
 
 
-def build_route_document(session, route):
+def build_route_document(session, route, daily_riderships=None, service_hour_riderships=None):
+    """
+    Builds a route's JSON API document. The route's current riderships are
+    queried unless they are passed.
+
+    Args:
+        session: An SQLAlchemy session.
+        route: A :class:`~.models.Route` or :class:`~.records.RouteRecord`.
+        daily_riderships: The route's current daily ridership facts.
+        service_hour_riderships: The route's current service hour ridership facts.
+
+    Returns:
+        str: The JSON document.
+    """
     included = []
-    daily_riderships = session.query(models.DailyRidership).filter_by(route_id=route.id, is_current=True)
-    service_hour_riderships = session.query(models.ServiceHourRidership)\
-                                                  .filter_by(route_id=route.id,
-                                                             is_current=True)
+    if daily_riderships is None:
+        daily_riderships = records.read_fact_records(session, models.DailyRidership,
+                                                     models.DailyRidership.route_id == route.id)
+    if service_hour_riderships is None:
+        service_hour_riderships = records.read_fact_records(session, models.ServiceHourRidership,
+                                                            models.ServiceHourRidership.route_id == route.id)
     daily_ridership_identifiers = transform_ridership_collection(daily_riderships,
                                                                  'daily-riderships',
                                                                  route.id,
@@ -121,39 +140,60 @@ def build_system_trends_document(system_trends):
     return json.dumps({'data': primary_data})
 
 
-def update_route_documents(session):
-    routes = session.query(models.Route).all()
-    for route in routes:
-        name = 'route-{0}'.format(route.route_number)
-        update_timestamp = datetime.datetime.now(tz=pytz.utc)
-        document = build_route_document(session, route)
-        try:
-            performance_document = session.query(models.PerformanceDocument)\
-                                      .filter_by(name=name).one()
-            performance_document.document = document
-        except NoResultFound:
-            route_doc = models.PerformanceDocument(name=name,
-                                                   document=document,
-                                                   updated_on=update_timestamp)
-            session.add(route_doc)
-    session.commit()
-
-
-def update_system_trends_document(session):
-    system_trends = session.query(models.SystemTrend).all()
-    document = build_system_trends_document(system_trends)
+def store_documents(session, documents):
+    """
+    Creates or updates performance documents with one upsert per batch (see
+    :func:`~.loaders.upsert_rows`).
+
+    Args:
+        session: An SQLAlchemy session.
+        documents: An iterable of ``(name, JSON document)`` pairs.
+    """
     update_timestamp = datetime.datetime.now(tz=pytz.utc)
-    try:
-        system_trends_doc = session.query(models.PerformanceDocument) \
-            .filter_by(name='system-trends').one()
-        system_trends_doc.document = document
-        system_trends_doc.updated_on = update_timestamp
-    except NoResultFound:
-        system_trends_doc = models.PerformanceDocument(name='system-trends',
-                                                       document=document,
-                                                       updated_on=update_timestamp)
-        session.add(system_trends_doc)
-    session.commit()
+    rows = ({'name': name, 'document': document, 'updated_on': update_timestamp}
+            for name, document in documents)
+    loaders.upsert_rows(session, models.PerformanceDocument, rows, ['name'])
+
+
+def update_route_documents(session, fact_cube=None):
+    """
+    Updates the JSON API document of every route.
+
+    Args:
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. When passed, the documents are
+            built from the cube instead of reading fact records.
+    """
+    if fact_cube is None:
+        daily_riderships = records.group_by_route(records.read_fact_records(session, models.DailyRidership))
+        service_hour_riderships = records.group_by_route(
+            records.read_fact_records(session, models.ServiceHourRidership))
+        routes = [(route, daily_riderships.get(route.id, []), service_hour_riderships.get(route.id, []))
+                  for route in records.read_route_records(session)]
+    else:
+        routes = [(route,
+                   fact_cube.route_facts(index, cube.DAILY),
+                   fact_cube.route_facts(index, cube.SERVICE_HOUR))
+                  for index, route in enumerate(fact_cube.route_records())]
+    documents = (('route-{0}'.format(route.route_number),
+                  build_route_document(session, route, daily_riderships, service_hour_riderships))
+                 for route, daily_riderships, service_hour_riderships in routes)
+    store_documents(session, documents)
+
+
+def update_system_trends_document(session, system_trends=None):
+    """
+    Updates the system trends document.
+
+    Args:
+        session: An SQLAlchemy session.
+        system_trends (list): The system trends as returned by
+            :func:`~.etl.update_system_trends`. Queried if not passed.
+    """
+    if system_trends is None:
+        system_trends = records.read_system_trend_records(session)
+    document = build_system_trends_document(system_trends)
+    store_documents(session, [('system-trends', document)])
 
 
 def sort_compendium_riderships(compendiums):
@@ -162,26 +202,73 @@ def sort_compendium_riderships(compendiums):
 
 
 def get_weekly_ridership(day_of_week, value):
-    if day_of_week.lower() == 'weekday':
+    if day_of_week == 'weekday':
         return int(5 * value)
     return int(value)
 
 
-def update_productivity_document(session):
+def get_productivity_rows(session):
+    """
+    Returns:
+        list: ``(measurement_timestamp, route_number, ridership, productivity)`` tuples of the
+        current weekly performances, latest first, then by productivity and ridership.
+    """
+    return session.query(models.WeeklyPerformance.measurement_timestamp,
+                         models.Route.route_number,
+                         models.WeeklyPerformance.ridership,
+                         models.WeeklyPerformance.productivity)\
+                  .join(models.Route, models.WeeklyPerformance.route_id == models.Route.id)\
+                  .filter(models.WeeklyPerformance.is_current.is_(True))\
+                  .order_by(desc(models.WeeklyPerformance.measurement_timestamp))\
+                  .order_by(asc(models.WeeklyPerformance.productivity))\
+                  .order_by(asc(models.WeeklyPerformance.ridership))\
+                  .all()
+
+
+def get_cube_productivity_rows(fact_cube):
+    """
+    Cube counterpart of :func:`get_productivity_rows` for the weekly performances that
+    :func:`~.etl.update_weekly_performance` derives from the same cube. Like the stored
+    weekly performances, the rows are timestamped with their period's timestamp.
+    """
+    weekday = utils.DAYS_OF_WEEK.index('weekday')
+    ridership, has_ridership = fact_cube.weekly_ridership()
+    productivity = fact_cube.values[:, :, weekday, cube.SERVICE_HOUR]
+    rows = list()
+    for route, period in zip(*np.nonzero(has_ridership & ~np.isnan(productivity))):
+        rows.append((fact_cube.period_timestamp(period),
+                     int(fact_cube.route_numbers[route]),
+                     float(ridership[route, period]),
+                     # weekly figures are whole numbers stored in float columns
+                     float(int(productivity[route, period]))))
+    rows.sort(key=lambda row: (row[3], row[2]))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return rows
+
+
+def update_productivity_document(session, fact_cube=None):
+    """
+    Updates the productivity document with the weekly ridership and productivity
+    of routes per period.
+
+    Args:
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. When passed, the weekly
+            performances are reduced from the cube instead of being queried.
+    """
     productivity = OrderedDict()
-    weeklies = session.query(models.WeeklyPerformance)\
-                      .filter_by(is_current=True)\
-                      .order_by(desc(models.WeeklyPerformance.measurement_timestamp))\
-                      .order_by(asc(models.WeeklyPerformance.productivity))\
-                      .order_by(asc(models.WeeklyPerformance.ridership))
-    for w in weeklies:
+    if fact_cube is None:
+        weeklies = get_productivity_rows(session)
+    else:
+        weeklies = get_cube_productivity_rows(fact_cube)
+    for measurement_timestamp, route_number, ridership, route_productivity in weeklies:
         # exclude weekly without productivity data
-        if w.productivity:
-            ts = w.measurement_timestamp.isoformat()
+        if route_productivity:
+            ts = measurement_timestamp.isoformat()
             route_performance = {
-                'routeNumber': w.route.route_number,
-                'ridership': w.ridership,
-                'productivity': w.productivity
+                'routeNumber': route_number,
+                'ridership': ridership,
+                'productivity': route_productivity
             }
             if ts in productivity:
                 productivity[ts].append(route_performance)
@@ -192,26 +279,15 @@ def update_productivity_document(session):
         productivity_series.append({'date': timestamp, 'performance': route_performances})
 
     document = json.dumps(productivity_series)
-    update_timestamp = datetime.datetime.now(tz=pytz.utc)
-    try:
-        performance_doc = session.query(models.PerformanceDocument) \
-            .filter_by(name='productivity').one()
-        performance_doc.document = document
-        performance_doc.updated_on = update_timestamp
-    except NoResultFound:
-        performance_doc = models.PerformanceDocument(name='productivity',
-                                                     document=document,
-                                                     updated_on=update_timestamp)
-        session.add(performance_doc)
-    session.commit()
-
-
-def update_route_sparklines(session):
+    store_documents(session, [('productivity', document)])
+
+
+def get_route_sparklines(session):
     """
 
-    Updates the JSON document with spark line data.
+    Queries the current daily ridership of each route for spark line data.
 
-    The spark line JSON document is an array of route compendium dictionaries.
+    The spark line data is an array of route compendium dictionaries.
 
     =============  =================================
     Key            Value
@@ -226,28 +302,25 @@ def update_route_sparklines(session):
 
     Args:
         session: An SQLAlchemy session.
+
+    Returns:
+        list: Route compendium dictionaries.
     """
-    routes = session.query(models.Route).all()
+    routes = records.read_route_records(session)
+    daily_riderships = records.group_by_route(records.read_fact_records(session, models.DailyRidership))
     primary_data = []
     for route in routes:
-        aggregator = {}
-        active_ridership = session.query(models.DailyRidership).filter_by(route_id=route.id, is_current=True)
-        for ridership in active_ridership:
-            # UTC timezone datetime
-            period_timestamp = utils.get_period_timestamp('weekday', ridership.season, ridership.calendar_year)
-            pt_iso = period_timestamp.isoformat()
-            if pt_iso in aggregator:
-                new_count = get_weekly_ridership(ridership.day_of_week, ridership.ridership)
-                old_count = aggregator[pt_iso]['ridership_count']
-                aggregator[pt_iso]['ridership_count'] = old_count + new_count
-            else:
-                ridership_count = get_weekly_ridership(ridership.day_of_week, ridership.ridership)
-                aggregator[pt_iso] = {
-                    'ridership_count': ridership_count,
-                    'pt': period_timestamp
-                }
-        for pt_iso, value in aggregator.items():
-            spark_point = {'date': value['pt'], 'ridership': value['ridership_count']}
+        aggregator = OrderedDict()
+        active_ridership = daily_riderships.get(route.id, [])
+        # the weekday timestamps of the periods in one batch; tolist() gives naive UTC datetimes
+        period_timestamps = utils.get_period_timestamps(np.zeros(len(active_ridership), dtype=np.intp),
+                                                        [ridership.season for ridership in active_ridership],
+                                                        [ridership.calendar_year for ridership in active_ridership])
+        for ridership, period_timestamp in zip(active_ridership, period_timestamps.tolist()):
+            count = get_weekly_ridership(ridership.day_of_week, ridership.ridership)
+            aggregator[period_timestamp] = aggregator.get(period_timestamp, 0) + count
+        for period_timestamp, ridership_count in aggregator.items():
+            spark_point = {'date': period_timestamp.replace(tzinfo=pytz.utc), 'ridership': ridership_count}
             compendium = next((c for c in primary_data if c['routeNumber'] == str(route.route_number)), None)
             if compendium:
                 compendium['data'].append(spark_point)
@@ -260,34 +333,72 @@ def update_route_sparklines(session):
                     'data': [spark_point]
                 }
                 primary_data.append(compendium)
+    return primary_data
+
+
+def get_cube_sparklines(fact_cube):
+    """
+    Cube counterpart of :func:`get_route_sparklines`.
+
+    Args:
+        fact_cube (~.cube.FactCube): The current facts.
+
+    Returns:
+        list: Route compendium dictionaries.
+    """
+    ridership, has_ridership = fact_cube.weekly_ridership()
+    primary_data = []
+    for route, route_number in enumerate(fact_cube.route_numbers.tolist()):
+        periods = np.flatnonzero(has_ridership[route])
+        if not len(periods):
+            continue
+        primary_data.append({
+            'routeNumber': str(route_number),
+            'routeName': fact_cube.route_names[route],
+            'selector': 'ridership-sparkline-{0}'.format(route_number),
+            'data': [{'date': fact_cube.period_timestamp(period),
+                      'ridership': int(ridership[route, period])}
+                     for period in periods.tolist()]
+        })
+    return primary_data
+
+
+def update_route_sparklines(session, fact_cube=None):
+    """
+    Updates the JSON document with spark line data.
+
+    Args:
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. Queried if not passed.
+    """
+    if fact_cube is None:
+        primary_data = get_route_sparklines(session)
+    else:
+        primary_data = get_cube_sparklines(fact_cube)
     for compendium in primary_data:
         compendium['data'].sort(key=lambda r: r['date'])
     primary_data.sort(key=lambda c: c['data'][-1]['ridership'], reverse=True)
     document = json.dumps(primary_data, cls=SparklineCompendiumEncoder)
-    update_timestamp = datetime.datetime.now(tz=pytz.utc)
-    try:
-        sparklines_doc = session.query(models.PerformanceDocument) \
-                                .filter_by(name='ridership-sparklines').one()
-        sparklines_doc.document = document
-        sparklines_doc.updated_on = update_timestamp
-    except NoResultFound:
-        sparklines_doc = models.PerformanceDocument(name='ridership-sparklines',
-                                                    document=document,
-                                                    updated_on=update_timestamp)
-        session.add(sparklines_doc)
-    session.commit()
-
-
-def update_top_routes(session):
-    high_ridership_routes = session.query(models.Route) \
-        .filter_by(is_high_ridership=True) \
-        .all()
+    store_documents(session, [('ridership-sparklines', document)])
+
+
+def get_top_routes(session):
+    """
+    Queries the current daily ridership of the high ridership routes.
+
+    Returns:
+        list: Route compendium dictionaries.
+    """
+    high_ridership_routes = records.read_route_records(session, models.Route.is_high_ridership.is_(True))
+    # order_by puts 'weekday' at end to help with sort by weekday ridership
+    high_ridership = records.read_fact_records(
+        session, models.DailyRidership,
+        models.DailyRidership.route_id.in_([route.id for route in high_ridership_routes]),
+        order_by=desc(models.DailyRidership.measurement_timestamp))
+    daily_riderships = records.group_by_route(high_ridership)
     top_routes = []
     for route in high_ridership_routes:
-        # order_by puts 'weekday' at end to help with sort by weekday ridership
-        active_ridership = session.query(models.DailyRidership)\
-            .filter_by(route_id=route.id, is_current=True) \
-            .order_by(desc(models.DailyRidership.measurement_timestamp))
+        active_ridership = daily_riderships.get(route.id, [])
         for ridership in active_ridership:
             compendium = next((c for c in top_routes if c['routeNumber'] == str(route.route_number)), None)
             if compendium:
@@ -301,24 +412,68 @@ def update_top_routes(session):
                     'riderships': [ridership]
                 }
                 top_routes.append(compendium)
+    return top_routes
+
+
+def get_cube_top_routes(fact_cube):
+    """
+    Cube counterpart of :func:`get_top_routes`.
+
+    Args:
+        fact_cube (~.cube.FactCube): The current facts.
+
+    Returns:
+        list: Route compendium dictionaries.
+    """
+    top_routes = []
+    for route in np.flatnonzero(fact_cube.is_high_ridership).tolist():
+        riderships = fact_cube.route_facts(route, cube.DAILY)
+        if not riderships:
+            continue
+        route_number = str(fact_cube.route_numbers[route])
+        top_routes.append({
+            'routeNumber': route_number,
+            'routeName': fact_cube.route_names[route],
+            'selector': 'top-route-viz-{0}'.format(route_number),
+            'riderships': riderships
+        })
+    return top_routes
+
+
+def update_top_routes(session, fact_cube=None):
+    """
+    Updates the document with the daily ridership of the high ridership routes.
+
+    Args:
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The current facts. Queried if not passed.
+    """
+    if fact_cube is None:
+        top_routes = get_top_routes(session)
+    else:
+        top_routes = get_cube_top_routes(fact_cube)
     sort_compendium_riderships(top_routes)
     document = json.dumps(top_routes, cls=RouteCompendiumEncoder)
-    update_timestamp = datetime.datetime.now(tz=pytz.utc)
-    try:
-        top_routes_doc = session.query(models.PerformanceDocument) \
-            .filter_by(name='top-routes').one()
-        top_routes_doc.document = document
-        top_routes_doc.updated_on = update_timestamp
-    except NoResultFound:
-        top_routes_doc = models.PerformanceDocument(name='top-routes',
-                                                    document=document,
-                                                    updated_on=update_timestamp)
-        session.add(top_routes_doc)
-    session.commit()
-
-def update(session):
-    update_system_trends_document(session)
-    update_route_documents(session)
-    update_top_routes(session)
-    update_route_sparklines(session)
-    update_productivity_document(session)
+    store_documents(session, [('top-routes', document)])
+
+
+def update(session, fact_cube=None, system_trends=None):
+    """
+    Updates every performance document. Documents are built from the database
+    unless the fused pipeline passes its in-memory results.
+
+    Args:
+        session: An SQLAlchemy session.
+        fact_cube (~.cube.FactCube): The fact cube reduced by the derived ETL stages.
+        system_trends (list): The system trends returned by :func:`~.etl.update_system_trends`.
+    """
+    with profiling.stage('perfdocs.system-trends'):
+        update_system_trends_document(session, system_trends)
+    with profiling.stage('perfdocs.route-documents'):
+        update_route_documents(session, fact_cube)
+    with profiling.stage('perfdocs.top-routes'):
+        update_top_routes(session, fact_cube)
+    with profiling.stage('perfdocs.route-sparklines'):
+        update_route_sparklines(session, fact_cube)
+    with profiling.stage('perfdocs.productivity'):
+        update_productivity_document(session, fact_cube)
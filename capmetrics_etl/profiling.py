@@ -0,0 +1,255 @@
+"""
+Offline profiling of ETL and performance document runs.
+
+The ETL marks its stages with :func:`stage`, which does nothing unless a run is
+wrapped in :func:`profile`. A profiled stage gets its own :mod:`cProfile` profile,
+its wall time, and the peak memory traced by :mod:`tracemalloc` while it ran.
+
+Stages can be nested, as the performance document builders are within the
+``perfdocs`` stage. A nested stage is profiled separately: the outer stage's
+profile leaves it out, while the outer stage's wall time and peak memory include it.
+A stage that runs more than once accumulates into one profile. As :mod:`cProfile` is
+paused during a nested stage, calls the outer stage makes afterwards are recorded
+without their callers.
+
+When the run completes, :meth:`Profiler.write` saves, for each stage, a ``.pstats``
+file (see :class:`pstats.Stats`) and a ``.collapsed`` file of semicolon-separated
+stacks for flame graph tools, plus a ``summary.txt`` table of the stages sorted by
+cumulative time.
+"""
+from collections import OrderedDict
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+# the profiler of the current run, if any; any object with a stage(name) context manager
+# method can observe the stages, as the query budget tests do
+ACTIVE_PROFILER = None
+# call paths contributing less time (seconds) are left out of collapsed stacks
+COLLAPSED_MINIMUM_TIME = 1e-6
+COLLAPSED_MAXIMUM_DEPTH = 64
+
+
+class StageProfile:
+    """
+    Attributes:
+        name (str): The stage name.
+        profile (cProfile.Profile): The stage's profile.
+        calls (int): The number of times the stage ran.
+        wall_time (float): Seconds spent in the stage.
+        peak_memory (int): The most memory, in bytes, traced while the stage ran.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.wall_time = 0.0
+        self.peak_memory = 0
+
+    def get_stats(self):
+        return pstats.Stats(self.profile, stream=io.StringIO())
+
+    @property
+    def cumulative_time(self):
+        """
+        float: The profiled seconds, excluding nested stages.
+        """
+        return self.get_stats().total_tt
+
+
+class Profiler:
+    """
+    Collects the stage profiles of a run.
+
+    Attributes:
+        stages (OrderedDict): :class:`StageProfile` instances keyed to stage names, in
+            the order the stages first ran.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.running = list()
+
+    def observe_peak(self):
+        if self.running:
+            peak = tracemalloc.get_traced_memory()[1]
+            for stage_profile in self.running:
+                stage_profile.peak_memory = max(stage_profile.peak_memory, peak)
+            tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Profiles the code run in the context as the ``name`` stage.
+        """
+        stage_profile = self.stages.get(name)
+        if stage_profile is None:
+            stage_profile = self.stages[name] = StageProfile(name)
+        self.observe_peak()
+        if self.running:
+            self.running[-1].profile.disable()
+        self.running.append(stage_profile)
+        started = time.perf_counter()
+        stage_profile.profile.enable()
+        try:
+            yield stage_profile
+        finally:
+            stage_profile.profile.disable()
+            stage_profile.wall_time += time.perf_counter() - started
+            stage_profile.calls += 1
+            self.observe_peak()
+            self.running.pop()
+            if self.running:
+                self.running[-1].profile.enable()
+
+    def get_summary(self):
+        """
+        Returns:
+            str: A table of the stages sorted by cumulative time.
+        """
+        lines = ['{0:<32} {1:>6} {2:>12} {3:>14} {4:>14}'.format(
+            'stage', 'calls', 'wall (s)', 'cumulative (s)', 'peak (MiB)')]
+        stage_profiles = sorted(self.stages.values(), key=lambda s: s.cumulative_time, reverse=True)
+        for stage_profile in stage_profiles:
+            lines.append('{0:<32} {1:>6} {2:>12.3f} {3:>14.3f} {4:>14.2f}'.format(
+                stage_profile.name, stage_profile.calls, stage_profile.wall_time,
+                stage_profile.cumulative_time, stage_profile.peak_memory / (1 << 20)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory, top=20):
+        """
+        Writes the ``.pstats`` and ``.collapsed`` files of every stage and ``summary.txt``,
+        which also lists each stage's ``top`` functions by cumulative time.
+
+        Args:
+            directory (str): The output directory, created if missing.
+            top (int): The number of functions listed per stage.
+
+        Returns:
+            list: The written file locations.
+        """
+        os.makedirs(directory, exist_ok=True)
+        written = list()
+        details = list()
+        for index, stage_profile in enumerate(self.stages.values(), start=1):
+            file_name = '{0:02d}-{1}'.format(index, stage_profile.name.replace(os.sep, '-'))
+            stats = stage_profile.get_stats()
+            stats_location = os.path.join(directory, file_name + '.pstats')
+            stats.dump_stats(stats_location)
+            collapsed_location = os.path.join(directory, file_name + '.collapsed')
+            with open(collapsed_location, 'w') as collapsed_file:
+                collapsed_file.writelines(
+                    '{0} {1}\n'.format(stack, microseconds)
+                    for stack, microseconds in get_collapsed_stacks(stats).items())
+            written.extend([stats_location, collapsed_location])
+            stream = io.StringIO()
+            pstats.Stats(stage_profile.profile, stream=stream).sort_stats('cumulative').print_stats(top)
+            details.append('== {0} ==\n{1}'.format(stage_profile.name, stream.getvalue()))
+        summary_location = os.path.join(directory, 'summary.txt')
+        with open(summary_location, 'w') as summary_file:
+            summary_file.write(self.get_summary())
+            summary_file.write('\n')
+            summary_file.write('\n'.join(details))
+        written.append(summary_location)
+        return written
+
+
+def get_function_label(function):
+    file_name, line_number, function_name = function
+    if file_name == '~':
+        # built-in functions
+        label = function_name
+    else:
+        label = '{0}:{1}({2})'.format(os.path.basename(file_name), line_number, function_name)
+    return label.replace(';', ',').replace(' ', '_')
+
+
+def get_collapsed_stacks(stats):
+    """
+    Rebuilds call stacks from the caller and callee edges of a profile. A function's
+    time is split between its callers in proportion to the time each call edge took,
+    since a profile does not record whole stacks.
+
+    Args:
+        stats (pstats.Stats): A profile's statistics.
+
+    Returns:
+        OrderedDict: The self time in microseconds of each semicolon-separated stack.
+    """
+    callees = dict()
+    roots = list()
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            callees.setdefault(caller, list()).append((function, edge_cumulative))
+    stacks = OrderedDict()
+
+    def walk(function, path, share):
+        total_self = stats.stats[function][2]
+        total_cumulative = stats.stats[function][3]
+        path = path + [get_function_label(function)]
+        self_time = total_self * share
+        if self_time >= COLLAPSED_MINIMUM_TIME:
+            stack = ';'.join(path)
+            stacks[stack] = stacks.get(stack, 0) + int(round(self_time * 1e6))
+        if len(path) >= COLLAPSED_MAXIMUM_DEPTH or not total_cumulative:
+            return
+        for callee, edge_cumulative in callees.get(function, []):
+            callee_cumulative = stats.stats[callee][3]
+            if callee_cumulative and get_function_label(callee) not in path:
+                callee_share = share * edge_cumulative / callee_cumulative
+                if callee_cumulative * callee_share >= COLLAPSED_MINIMUM_TIME:
+                    walk(callee, path, callee_share)
+
+    for root in sorted(roots, key=get_function_label):
+        walk(root, [], 1.0)
+    return OrderedDict((stack, microseconds) for stack, microseconds in stacks.items() if microseconds)
+
+
+def stage(name):
+    """
+    Marks an ETL stage. Profiles the stage if a run is being profiled, otherwise
+    does nothing.
+
+    Args:
+        name (str): The stage name.
+
+    Returns:
+        A context manager.
+    """
+    if ACTIVE_PROFILER is None:
+        return contextlib.nullcontext()
+    return ACTIVE_PROFILER.stage(name)
+
+
+@contextlib.contextmanager
+def profile(directory=None):
+    """
+    Profiles the stages run in the context, with :mod:`tracemalloc` tracing memory.
+
+    Args:
+        directory (str): If set, the profile files are written there when the context exits.
+
+    Yields:
+        Profiler: The run's profiler.
+    """
+    global ACTIVE_PROFILER
+    profiler = Profiler()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    ACTIVE_PROFILER = profiler
+    try:
+        yield profiler
+    finally:
+        ACTIVE_PROFILER = None
+        if not was_tracing:
+            tracemalloc.stop()
+        if directory is not None:
+            profiler.write(directory)
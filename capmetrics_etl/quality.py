@@ -1,9 +1,14 @@
 """
 Data quality assurance functions.
 """
+from collections import OrderedDict
+import datetime
+import hashlib
+import json
+import pytz
 import xlrd
 from xlrd.biffh import XLRDError
-from capmetrics_etl import etl
+from capmetrics_etl import etl, models
 
 
 def check_worksheet_completeness(file_location, worksheet_names):
@@ -83,18 +88,15 @@ def has_ridership_data_column(worksheet, floor=10):
     Returns:
         bool: ``True`` if worksheet has ridership data. ``False`` otherwise.
     """
-    try:
-        for column_index in range(floor):
-            try:
-                for row_index in range(floor):
-                    cell = worksheet.cell(row_index, column_index)
-                    season, year = etl.get_season_and_year(cell.value)
-                    if season and year:
-                        return True
-            except IndexError:
+    row_count = min(floor, worksheet.nrows)
+    column_count = min(floor, worksheet.ncols)
+    for column_index in range(column_count):
+        for row_index in range(row_count):
+            if column_index >= worksheet.row_len(row_index):
                 continue
-    except IndexError:
-        pass
+            season, year = etl.get_season_and_year(worksheet.cell_value(row_index, column_index))
+            if season and year:
+                return True
     return False
 
 
@@ -128,6 +130,11 @@ def check_quality(file_location, worksheet_names):
 
     3. Ridership columns present - Check for at least one ridership data column in all 6 ridership data worksheets.
 
+    The checks share a single pass over the worksheets; see :func:`validate_workbook`.
+    As before, a worksheet has ridership data columns if it has a season and year header,
+    with or without a day of week label under it; worksheets without parsed period columns
+    are searched for one with :func:`check_for_ridership_columns`.
+
     Args:
         file_location (str): The data file location.
         worksheet_names (list): A list of string names with the worksheets that will be
@@ -136,13 +143,154 @@ def check_quality(file_location, worksheet_names):
     Returns:
         bool: ``True`` if the worksheets pass the data quality check. ``False`` otherwise.
     """
-    if not check_worksheet_completeness(file_location, worksheet_names)[0]:
+    configuration = {
+        'daily_ridership_worksheets': list(worksheet_names),
+        'hour_productivity_worksheets': []
+    }
+    report = validate_workbook(file_location, configuration)[0]
+    if report['missing_worksheets']:
         print('Incomplete worksheets')
         return False
-    if not check_route_presence(file_location, worksheet_names):
+    if any(not w['route_rows'] for w in report['worksheets'].values()):
         print('Missing routes')
         return False
-    if not check_for_ridership_columns(file_location, worksheet_names):
+    without_periods = [name for name, w in report['worksheets'].items() if not w['period_columns']]
+    if without_periods and not check_for_ridership_columns(file_location, without_periods):
         print('Missing ridership')
         return False
     return True
+
+
+def validate_workbook(file_location, configuration):
+    """
+    Runs the data quality 'sanity check' in a single pass over the configured worksheets.
+    Each worksheet is parsed once with :func:`~.etl.parse_workbook`, and the parsed
+    worksheet models are returned so the ETL can reuse them instead of reading the
+    file again. A workbook passes when no worksheet is missing and every worksheet
+    has route rows and ridership period columns.
+
+    The quality report is a dict like::
+
+        {
+            'passed': True,
+            'failures': [],
+            'missing_worksheets': [],
+            'worksheets': {
+                'Ridership by Route Weekday': {
+                    'route_rows': 88,
+                    'period_columns': 11,
+                    'non_numeric_cells': [[12, 3]]
+                }
+            }
+        }
+
+    Non-numeric cells are route row cells in period columns that hold something other
+    than a number or a blank. They are reported but do not fail the check.
+
+    Args:
+        file_location (str): The data file location.
+        configuration (dict): ETL configuration settings.
+
+    Returns:
+        tuple: The quality report dict and the parsed worksheet models.
+    """
+    parsed_worksheets = etl.parse_workbook(file_location, configuration)
+    report = {
+        'passed': True,
+        'failures': [],
+        'missing_worksheets': [],
+        'worksheets': OrderedDict()
+    }
+    for worksheet_name, parsed_worksheet in parsed_worksheets.items():
+        if parsed_worksheet is None:
+            report['missing_worksheets'].append(worksheet_name)
+            report['failures'].append('Missing worksheet: {0}'.format(worksheet_name))
+            continue
+        route_rows = len(parsed_worksheet['routes']['routes'])
+        period_columns = len(parsed_worksheet['layout']['periods'])
+        report['worksheets'][worksheet_name] = {
+            'route_rows': route_rows,
+            'period_columns': period_columns,
+            'non_numeric_cells': parsed_worksheet['non_numeric_cells']
+        }
+        if not route_rows:
+            report['failures'].append('Missing routes: {0}'.format(worksheet_name))
+        if not period_columns:
+            report['failures'].append('Missing ridership: {0}'.format(worksheet_name))
+    report['passed'] = not report['failures']
+    return report, parsed_worksheets
+
+
+def hash_file(file_location, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 digest of a file without reading it into memory at once.
+
+    Args:
+        file_location (str): The file location.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: A hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_location, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_worksheet_configuration(configuration):
+    """
+    Computes the SHA-256 digest of the worksheet names a quality check covers.
+
+    Args:
+        configuration (dict): ETL configuration settings.
+
+    Returns:
+        str: A hex digest.
+    """
+    worksheets = [configuration['daily_ridership_worksheets'],
+                  configuration['hour_productivity_worksheets']]
+    return hashlib.sha256(json.dumps(worksheets).encode('utf-8')).hexdigest()
+
+
+def validate_workbook_cached(file_location, configuration, session):
+    """
+    Runs :func:`validate_workbook` unless a verdict for the same file content and
+    worksheet configuration is stored in a :class:`~.models.QualityCheck`. New
+    verdicts are stored.
+
+    A cached verdict saves the check but not the parse: the worksheet models are not
+    cached, so a file that passed is parsed by the ETL instead, once either way, and
+    only a file retried after failing the check is not parsed again. Either way the
+    session's transaction is ended, so the ETL stages can begin their own.
+
+    Args:
+        file_location (str): The data file location.
+        configuration (dict): ETL configuration settings.
+        session: SQLAlchemy session.
+
+    Returns:
+        tuple: The quality report dict and the parsed worksheet models. The parsed
+            worksheet models are ``None`` when the verdict came from the cache.
+    """
+    file_hash = hash_file(file_location)
+    configuration_hash = hash_worksheet_configuration(configuration)
+    quality_check = session.query(models.QualityCheck)\
+                           .filter_by(file_hash=file_hash,
+                                      configuration_hash=configuration_hash)\
+                           .first()
+    if quality_check is not None:
+        report = json.loads(quality_check.report)
+        # end the read so the ETL stages that follow can begin their own transactions
+        session.commit()
+        return report, None
+    report, parsed_worksheets = validate_workbook(file_location, configuration)
+    quality_check = models.QualityCheck(file_hash=file_hash,
+                                        configuration_hash=configuration_hash,
+                                        passed=report['passed'],
+                                        report=json.dumps(report),
+                                        created_on=datetime.datetime.now(tz=pytz.utc))
+    session.add(quality_check)
+    session.commit()
+    return report, parsed_worksheets
@@ -0,0 +1,148 @@
+"""
+Lightweight read-only records for the transform and performance document paths.
+
+Building documents only reads a handful of columns per fact, so these functions
+select explicit column lists with Core ``select()`` statements and return plain
+records instead of ORM instances. No identity map entries, attribute
+instrumentation, or lazy relationships are involved.
+"""
+from collections import namedtuple, OrderedDict
+from sqlalchemy import asc, select
+from . import models
+from . import utils
+
+RouteRecord = namedtuple('RouteRecord', ['id', 'route_number', 'route_name',
+                                         'service_type', 'is_high_ridership'])
+
+SystemTrendRecord = namedtuple('SystemTrendRecord', ['id', 'service_type', 'trend', 'updated_on'])
+
+
+class FactRecord:
+    """
+    A read-only current ridership fact with the attributes of a ridership model.
+
+    It is a plain object rather than a tuple so that JSON encoders such as
+    :class:`~.performance_documents.RouteCompendiumEncoder` can recognize it.
+    """
+    __slots__ = ('id', 'created_on', 'is_current', 'day_of_week', 'season',
+                 'calendar_year', 'ridership', 'route_id', 'measurement_timestamp')
+
+    def __init__(self, id, created_on, day_of_week, season, calendar_year,
+                 ridership, route_id, measurement_timestamp):
+        self.id = id
+        self.created_on = created_on
+        self.is_current = True
+        self.day_of_week = day_of_week
+        self.season = season
+        self.calendar_year = calendar_year
+        self.ridership = ridership
+        self.route_id = route_id
+        self.measurement_timestamp = measurement_timestamp
+
+
+def select_fact_records(ridership_model):
+    """
+    Builds a select of the current facts of a ridership model with the columns of
+    :class:`FactRecord`, in :class:`FactRecord` argument order.
+    """
+    return select(ridership_model.id,
+                  ridership_model.created_on,
+                  ridership_model.day_of_week,
+                  ridership_model.season,
+                  ridership_model.calendar_year,
+                  ridership_model.ridership,
+                  ridership_model.route_id,
+                  ridership_model.measurement_timestamp)\
+        .where(ridership_model.is_current.is_(True))
+
+
+def read_fact_records(session, ridership_model, *criteria, order_by=None):
+    """
+    Reads current ridership facts as records.
+
+    Args:
+        session: An SQLAlchemy session.
+        ridership_model: A ridership model, such as :class:`~.models.DailyRidership`.
+        criteria: Additional ``WHERE`` criteria.
+        order_by: An ordering. Facts are in id order by default.
+
+    Returns:
+        list: :class:`FactRecord` objects.
+    """
+    statement = select_fact_records(ridership_model).where(*criteria)
+    statement = statement.order_by(asc(ridership_model.id) if order_by is None else order_by)
+    return [FactRecord(*row) for row in session.execute(statement)]
+
+
+def read_route_records(session, *criteria):
+    """
+    Reads routes as records in id order.
+
+    Args:
+        session: An SQLAlchemy session.
+        criteria: Additional ``WHERE`` criteria.
+
+    Returns:
+        list: :class:`RouteRecord` tuples.
+    """
+    statement = select(models.Route.id,
+                       models.Route.route_number,
+                       models.Route.route_name,
+                       models.Route.service_type,
+                       models.Route.is_high_ridership)\
+        .where(*criteria)\
+        .order_by(models.Route.id)
+    return [RouteRecord(*row) for row in session.execute(statement)]
+
+
+def group_by_route(fact_records):
+    """
+    Returns:
+        OrderedDict: Route ids mapped to lists of their fact records, in the records' order.
+    """
+    facts_by_route = OrderedDict()
+    for fact_record in fact_records:
+        facts_by_route.setdefault(fact_record.route_id, []).append(fact_record)
+    return facts_by_route
+
+
+def read_service_trends(session):
+    """
+    Reads the trend points (:class:`~.models.WeeklySystemRidership` rows) as weekly
+    totals per service type.
+
+    Args:
+        session: An SQLAlchemy session.
+
+    Returns:
+        OrderedDict: Service types mapped to ``[period ISO 8601 timestamp, total]`` lists
+        in chronological order.
+    """
+    statement = select(models.WeeklySystemRidership.service_type,
+                       models.WeeklySystemRidership.season,
+                       models.WeeklySystemRidership.calendar_year,
+                       models.WeeklySystemRidership.ridership)\
+        .order_by(asc(models.WeeklySystemRidership.service_type),
+                  asc(models.WeeklySystemRidership.measurement_timestamp))
+    service_trends = OrderedDict()
+    for service_type, season, calendar_year, ridership in session.execute(statement):
+        # we use the 'weekday' timestamp for the aggregated data
+        timestamp = utils.get_period_isoformat('weekday', season, calendar_year)
+        service_trends.setdefault(service_type, []).append([timestamp, ridership])
+    return service_trends
+
+
+def read_system_trend_records(session):
+    """
+    Reads the system trends with their trend points.
+
+    Returns:
+        list: :class:`SystemTrendRecord` tuples in id order.
+    """
+    service_trends = read_service_trends(session)
+    statement = select(models.SystemTrend.id,
+                       models.SystemTrend.service_type,
+                       models.SystemTrend.updated_on)\
+        .order_by(models.SystemTrend.id)
+    return [SystemTrendRecord(trend_id, service_type, service_trends.get(service_type, []), updated_on)
+            for trend_id, service_type, updated_on in session.execute(statement)]
@@ -0,0 +1,246 @@
+"""
+A long-running ETL service that watches an inbox directory for jobs.
+
+Starting a ``capmetrics`` command for every job costs interpreter startup, imports,
+engine creation, table checks, and a new database connection. The service pays
+those once: it keeps a pooled engine (see :func:`~.engines.create_service_engine`),
+creates and migrates the tables at startup, and then polls its inbox, running the
+jobs it finds one at a time in file modification order.
+
+A job is a file dropped into the inbox:
+
+* An Excel (``.xls``), CSV, or Parquet data file runs the ETL for that file. Excel files are
+  checked for data quality first (see :func:`~.quality.validate_workbook_cached`).
+* A file with the :data:`PERFDOCS_EXTENSION` extension, whatever its content,
+  refreshes the performance documents.
+
+Files may still be being written or copied when a poll sees them, so a job only
+runs once its size and modification time are unchanged between two polls. A data
+file whose content was already loaded successfully is not loaded again.
+
+Finished and skipped jobs are moved to the inbox's ``processed`` directory, and jobs
+that failed or did not pass the quality checks to its ``failed`` directory. Each
+job is archived with a JSON run report (see :meth:`ETLService.process_job`), which
+includes the latency from the file drop to the refreshed performance documents.
+Job progress is logged to the ``capmetrics_etl.service`` logger.
+"""
+import datetime
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import pytz
+from sqlalchemy.orm import configure_mappers, sessionmaker
+from . import engines
+from . import etl
+from . import quality
+from . import sources
+
+PERFDOCS_EXTENSION = '.perfdocs'
+JOB_EXTENSIONS = etl.BATCH_EXTENSIONS + (PERFDOCS_EXTENSION,)
+PROCESSED_DIRECTORY = 'processed'
+FAILED_DIRECTORY = 'failed'
+REPORT_EXTENSION = '.json'
+
+logger = logging.getLogger(__name__)
+
+
+class ETLService:
+    """
+    Runs the ETL jobs dropped into an inbox directory with one engine and session factory.
+
+    Attributes:
+        configuration (dict): ETL configuration settings.
+        inbox (str): The watched directory.
+        engine: The pooled SQLAlchemy engine.
+        Session: A session factory bound to the engine.
+        observed (dict): The last seen size and modification time of each pending job.
+        loaded_hashes (set): The content digests of the data files loaded successfully.
+    """
+
+    def __init__(self, configuration, inbox):
+        self.configuration = configuration
+        self.inbox = os.path.abspath(inbox)
+        self.engine = engines.create_service_engine(configuration)
+        # warm up: the table check, migrations, and mapper configuration happen once
+        etl.create_tables(self.engine)
+        configure_mappers()
+        self.Session = sessionmaker(bind=self.engine)
+        for directory in (PROCESSED_DIRECTORY, FAILED_DIRECTORY):
+            os.makedirs(os.path.join(self.inbox, directory), exist_ok=True)
+        self.observed = dict()
+        self.loaded_hashes = self.read_loaded_hashes()
+
+    def read_loaded_hashes(self):
+        """
+        Returns:
+            set: The content digests recorded by the run reports of processed data files.
+        """
+        loaded_hashes = set()
+        pattern = os.path.join(self.inbox, PROCESSED_DIRECTORY, '*' + REPORT_EXTENSION)
+        for report_location in glob.glob(pattern):
+            with open(report_location) as report_file:
+                report = json.load(report_file)
+            if report.get('status') == 'processed' and report.get('file_hash'):
+                loaded_hashes.add(report['file_hash'])
+        return loaded_hashes
+
+    def find_jobs(self):
+        """
+        Returns:
+            list: The job file locations in the inbox, oldest first.
+        """
+        jobs = list()
+        for name in os.listdir(self.inbox):
+            location = os.path.join(self.inbox, name)
+            if os.path.isfile(location) and os.path.splitext(name)[1].lower() in JOB_EXTENSIONS:
+                jobs.append(location)
+        return sorted(jobs, key=lambda job: (os.path.getmtime(job), job))
+
+    def find_ready_jobs(self):
+        """
+        Finds the jobs whose size and modification time did not change since the last
+        call. Jobs seen for the first time, or still changing, wait for the next call.
+
+        Returns:
+            list: The ready job file locations, oldest first.
+        """
+        ready = list()
+        observed = dict()
+        for job in self.find_jobs():
+            status = os.stat(job)
+            observed[job] = (status.st_size, status.st_mtime_ns)
+            if self.observed.get(job) == observed[job]:
+                ready.append(job)
+        self.observed = {job: state for job, state in observed.items() if job not in ready}
+        return ready
+
+    def run_job(self, job):
+        """
+        Runs a job.
+
+        Args:
+            job (str): The job file location.
+
+        Returns:
+            list: Quality check failures. The ETL did not run if there are any.
+        """
+        session = self.Session()
+        try:
+            if job.lower().endswith(PERFDOCS_EXTENSION):
+                with etl.stage_transaction(session):
+                    etl.update_perfdocs(session)
+                return []
+            if sources.is_source_file(job):
+                etl.run_source_etl(job, session, self.configuration)
+                return []
+            quality_report, parsed_worksheets = \
+                quality.validate_workbook_cached(job, self.configuration, session)
+            if not quality_report['passed']:
+                return quality_report['failures']
+            etl.run_excel_etl(job, session, self.configuration, parsed_worksheets)
+            return []
+        finally:
+            session.close()
+
+    def archive_job(self, job, directory, report):
+        """
+        Moves a job and its run report out of the inbox. The archived names start with
+        the job's start time, so re-dropped files do not overwrite earlier ones.
+
+        Returns:
+            str: The archived job location.
+        """
+        stamp = report['started_on'].replace(':', '').replace('-', '')[:22]
+        name = '{0}-{1}'.format(stamp, os.path.basename(job))
+        destination = os.path.join(self.inbox, directory, name)
+        shutil.move(job, destination)
+        with open(destination + REPORT_EXTENSION, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        return destination
+
+    def process_job(self, job):
+        """
+        Runs a job, unless it is a data file that was already loaded, and archives it
+        with a run report. The report has the job's ``file``, ``file_hash``, ``status``
+        (``processed``, ``skipped`` or ``failed``), ``failures``, the ``dropped_on``,
+        ``started_on`` and ``finished_on`` times, the run's ``duration_seconds``, and the
+        ``latency_seconds`` from the file drop (its last modification) to the end of the run.
+
+        Args:
+            job (str): The job file location.
+
+        Returns:
+            dict: The run report.
+        """
+        dropped_on = os.path.getmtime(job)
+        started_on = time.time()
+        file_hash = None
+        failures = list()
+        if job.lower().endswith(PERFDOCS_EXTENSION):
+            status = 'processed'
+        else:
+            file_hash = quality.hash_file(job)
+            status = 'skipped' if file_hash in self.loaded_hashes else 'processed'
+        if status == 'processed':
+            logger.info('Running %s...', job)
+            try:
+                failures = self.run_job(job)
+            except Exception as error:
+                logger.exception('%s raised an exception.', job)
+                failures = ['{0}: {1}'.format(type(error).__name__, error)]
+            if failures:
+                status = 'failed'
+            elif file_hash is not None:
+                self.loaded_hashes.add(file_hash)
+        finished_on = time.time()
+        report = {
+            'file': os.path.basename(job),
+            'file_hash': file_hash,
+            'status': status,
+            'failures': failures,
+            'dropped_on': get_isoformat(dropped_on),
+            'started_on': get_isoformat(started_on),
+            'finished_on': get_isoformat(finished_on),
+            'duration_seconds': round(finished_on - started_on, 3),
+            'latency_seconds': round(finished_on - dropped_on, 3)
+        }
+        for failure in failures:
+            logger.warning('%s: %s', job, failure)
+        logger.info('%s %s in %.3fs, %.3fs after it was dropped.',
+                    job, status, report['duration_seconds'], report['latency_seconds'])
+        self.archive_job(job, FAILED_DIRECTORY if failures else PROCESSED_DIRECTORY, report)
+        return report
+
+    def poll(self):
+        """
+        Runs the ready jobs in the inbox.
+
+        Returns:
+            list: The run reports.
+        """
+        return [self.process_job(job) for job in self.find_ready_jobs()]
+
+    def serve(self, interval=5.0, once=False):
+        """
+        Polls the inbox every ``interval`` seconds until interrupted.
+
+        Args:
+            interval (float): Seconds between polls, which is also how long a file must
+                stay unchanged before its job runs.
+            once (bool): If ``True``, returns once the inbox has no pending jobs.
+        """
+        try:
+            while True:
+                self.poll()
+                if once and not self.observed:
+                    break
+                time.sleep(interval)
+        finally:
+            self.engine.dispose()
+
+
+def get_isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=pytz.utc).isoformat()
@@ -0,0 +1,181 @@
+"""
+Source adapters for flat file (CSV and Parquet) ridership exports.
+
+Flat files hold a *long-format* table with one fact per row and these columns::
+
+    route_number, route_name, service_type, season, year, day_of_week, metric, value
+
+The ``metric`` column is either ``daily_ridership`` or ``service_hour_ridership``.
+Adapters are selected by file extension and turn the rows into the same route info
+and ridership fact structures that the Excel extraction produces, so flat files
+are loaded through the same bulk load path.
+"""
+import csv
+import os
+from . import models
+from . import utils
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:  # pragma: no cover - optional dependency
+    parquet = None
+
+FACT_COLUMNS = (
+    'route_number',
+    'route_name',
+    'service_type',
+    'season',
+    'year',
+    'day_of_week',
+    'metric',
+    'value'
+)
+
+DAILY_RIDERSHIP = 'daily_ridership'
+SERVICE_HOUR_RIDERSHIP = 'service_hour_ridership'
+
+RIDERSHIP_MODELS = {
+    DAILY_RIDERSHIP: models.DailyRidership,
+    SERVICE_HOUR_RIDERSHIP: models.ServiceHourRidership
+}
+
+
+def read_csv_rows(file_location):
+    """
+    Reads the rows of a long-format CSV file.
+
+    Args:
+        file_location (str): The location of the CSV file.
+
+    Returns:
+        A generator of row dicts keyed to the CSV header.
+    """
+    with open(file_location, newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield row
+
+
+def read_parquet_rows(file_location, batch_size=65536):
+    """
+    Reads the rows of a long-format Parquet file in record batches.
+
+    Args:
+        file_location (str): The location of the Parquet file.
+        batch_size (int): The number of rows materialized at a time.
+
+    Returns:
+        A generator of row dicts keyed to the Parquet column names.
+    """
+    if parquet is None:
+        raise ImportError('Parquet sources require the pyarrow package.')
+    parquet_file = parquet.ParquetFile(file_location)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(FACT_COLUMNS)):
+        for row in batch.to_pylist():
+            yield row
+
+
+SOURCE_READERS = {
+    '.csv': read_csv_rows,
+    '.parquet': read_parquet_rows
+}
+
+
+def is_source_file(file_location):
+    """
+    Determines if a file is handled by a flat file source adapter.
+
+    Args:
+        file_location (str): The data file location.
+
+    Returns:
+        bool: ``True`` if the file extension has a source reader. ``False`` otherwise.
+    """
+    extension = os.path.splitext(file_location)[1].lower()
+    return extension in SOURCE_READERS
+
+
+def get_source_reader(file_location):
+    """
+    Selects the row reader for a flat file by its extension.
+
+    Args:
+        file_location (str): The data file location.
+
+    Returns:
+        A row reader function such as :func:`read_csv_rows`.
+
+    Raises:
+        ValueError: If no reader handles the file extension.
+    """
+    extension = os.path.splitext(file_location)[1].lower()
+    try:
+        return SOURCE_READERS[extension]
+    except KeyError:
+        raise ValueError('Unsupported source file type: {0}'.format(file_location))
+
+
+def parse_value(value):
+    """
+    Converts a row's ``value`` field to a float.
+
+    Returns:
+        A float, or ``None`` if the field is empty or not numeric.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_source(file_location):
+    """
+    Reads a flat file in one pass and splits its rows into route info and
+    ridership facts per metric.
+
+    The route info dict has the same shape as :func:`~.etl.get_route_info` output.
+    Ridership facts are dicts with ``route_number``, ``day_of_week``, ``season``,
+    ``year``, ``timestamp``, and ``ridership`` keys, as consumed by
+    :func:`~.etl.load_ridership`. Rows without a numeric value are skipped.
+
+    Args:
+        file_location (str): The data file location.
+
+    Returns:
+        dict: ``routes`` with route info and a ridership fact list keyed to each metric.
+    """
+    reader = get_source_reader(file_location)
+    routes = dict()
+    extraction = {metric: [] for metric in RIDERSHIP_MODELS}
+    for row in reader(file_location):
+        route_number = str(int(float(row['route_number'])))
+        route_name = row.get('route_name') or route_number
+        service_type = row.get('service_type') or ''
+        routes[route_number] = {
+            'route_number': route_number,
+            'route_name': str(route_name).upper(),
+            'service_type': str(service_type).upper()
+        }
+        metric = str(row['metric']).lower()
+        value = parse_value(row['value'])
+        if metric not in extraction or value is None:
+            continue
+        day_of_week = str(row['day_of_week']).lower()
+        season = str(row['season']).lower()
+        year = int(row['year'])
+        extraction[metric].append({
+            'route_number': int(route_number),
+            'day_of_week': day_of_week,
+            'season': season,
+            'year': year,
+            'timestamp': utils.get_period_timestamp(day_of_week, season, year),
+            'ridership': value
+        })
+    extraction['routes'] = {
+        'numbers_available': True,
+        'names_available': True,
+        'types_available': True,
+        'routes': list(routes.values())
+    }
+    return extraction
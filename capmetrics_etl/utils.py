@@ -1,8 +1,12 @@
 import datetime
+import numpy as np
 import pytz
 
 TIMEZONE_NAME = 'America/Chicago'
 APP_TIMEZONE = pytz.timezone(TIMEZONE_NAME)
+# calendar orderings; unknown values fall back to the first entry, like get_period_timestamp
+SEASONS = ('winter', 'spring', 'summer', 'fall')
+DAYS_OF_WEEK = ('weekday', 'saturday', 'sunday')
 
 
 def calibrate_day_of_week(timestamp, day_of_week):
@@ -57,6 +61,14 @@ def get_period_timestamp(day_of_week, season, calendar_year):
     Returns:
         A Python datetime object that represents that 'season'. It's timezone is UTC.
     """
+    return get_period_calendar(calendar_year).timestamp(day_of_week, season, calendar_year)
+
+
+def compute_period_timestamp(day_of_week, season, calendar_year):
+    """
+    Computes the timestamp that :func:`get_period_timestamp` looks up in the
+    period calendar.
+    """
     month = 1
     if season == 'spring':
         month = 4
@@ -71,3 +83,138 @@ def get_period_timestamp(day_of_week, season, calendar_year):
     # returns a UTC (not 'America/Chicago') timezone datetime - the return data will
     # be persisted, and that's the expected practice
     return calibrate_day_of_week(timestamp, day_of_week.lower())
+
+
+def get_period_isoformat(day_of_week, season, calendar_year):
+    """
+    Returns:
+        str: The ISO 8601 string of :func:`get_period_timestamp`'s timestamp.
+    """
+    return get_period_calendar(calendar_year).isoformat(day_of_week, season, calendar_year)
+
+
+def encode_labels(labels, vocabulary):
+    """
+    Maps an array of labels to their positions in a vocabulary. Labels are matched
+    case-insensitively and unknown labels map to ``0``.
+
+    Args:
+        labels: An array-like of strings, or of integer codes that are returned as-is.
+        vocabulary (tuple): The known labels.
+
+    Returns:
+        A NumPy integer array.
+    """
+    labels = np.asarray(labels)
+    if labels.dtype.kind in 'iu':
+        return labels.astype(np.intp)
+    unique_labels, inverse = np.unique(labels, return_inverse=True)
+    lookup = {label: code for code, label in enumerate(vocabulary)}
+    unique_codes = np.array([lookup.get(str(label).lower(), 0) for label in unique_labels],
+                            dtype=np.intp)
+    return unique_codes[inverse.reshape(labels.shape)]
+
+
+class PeriodCalendar:
+    """
+    A precomputed table of period timestamps, as returned by :func:`get_period_timestamp`,
+    for every season and day of week over a range of calendar years.
+
+    Attributes:
+        first_year (int): The first calendar year covered.
+        last_year (int): The last calendar year covered.
+        timestamps (list): UTC datetimes in ``(year, season, day of week)`` order.
+        isoformats (list): ISO 8601 strings of the timestamps.
+        timestamps64: A NumPy ``datetime64[s]`` array of the (UTC) timestamps.
+    """
+
+    def __init__(self, first_year, last_year):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.timestamps = list()
+        for year in range(first_year, last_year + 1):
+            for season in SEASONS:
+                for day_of_week in DAYS_OF_WEEK:
+                    self.timestamps.append(compute_period_timestamp(day_of_week, season, year))
+        self.isoformats = [timestamp.isoformat() for timestamp in self.timestamps]
+        self.timestamps64 = np.array([timestamp.replace(tzinfo=None) for timestamp in self.timestamps],
+                                     dtype='datetime64[s]')
+
+    def covers(self, first_year, last_year=None):
+        last_year = first_year if last_year is None else last_year
+        return self.first_year <= first_year and last_year <= self.last_year
+
+    def index(self, day_of_week, season, calendar_year):
+        season_code = SEASONS.index(season) if season in SEASONS else 0
+        day_of_week = day_of_week.lower()
+        day_code = DAYS_OF_WEEK.index(day_of_week) if day_of_week in DAYS_OF_WEEK else 0
+        return ((calendar_year - self.first_year) * len(SEASONS) + season_code) * len(DAYS_OF_WEEK) + day_code
+
+    def timestamp(self, day_of_week, season, calendar_year):
+        return self.timestamps[self.index(day_of_week, season, calendar_year)]
+
+    def isoformat(self, day_of_week, season, calendar_year):
+        return self.isoformats[self.index(day_of_week, season, calendar_year)]
+
+    def indices(self, days_of_week, seasons, calendar_years):
+        """
+        Vectorized :meth:`index` over arrays of days of week, seasons, and calendar years.
+        Days of week and seasons may be labels or integer codes (positions in
+        :data:`DAYS_OF_WEEK` and :data:`SEASONS`).
+        """
+        day_codes = encode_labels(days_of_week, DAYS_OF_WEEK)
+        season_codes = encode_labels(seasons, SEASONS)
+        years = np.asarray(calendar_years, dtype=np.intp)
+        return ((years - self.first_year) * len(SEASONS) + season_codes) * len(DAYS_OF_WEEK) + day_codes
+
+    def batch_timestamps(self, days_of_week, seasons, calendar_years):
+        """
+        Returns:
+            A NumPy ``datetime64[s]`` array of UTC period timestamps.
+        """
+        return self.timestamps64[self.indices(days_of_week, seasons, calendar_years)]
+
+
+_period_calendar = None
+
+
+def get_period_calendar(first_year, last_year=None):
+    """
+    Returns the process-wide :class:`PeriodCalendar`, rebuilding it when the requested
+    years fall outside its range. The calendar only grows, so a process builds it a
+    handful of times at most.
+
+    Args:
+        first_year (int): The first calendar year needed.
+        last_year (int): The last calendar year needed. Defaults to ``first_year``.
+
+    Returns:
+        PeriodCalendar
+    """
+    global _period_calendar
+    last_year = first_year if last_year is None else last_year
+    if _period_calendar is None:
+        _period_calendar = PeriodCalendar(first_year, last_year)
+    elif not _period_calendar.covers(first_year, last_year):
+        _period_calendar = PeriodCalendar(min(first_year, _period_calendar.first_year),
+                                          max(last_year, _period_calendar.last_year))
+    return _period_calendar
+
+
+def get_period_timestamps(days_of_week, seasons, calendar_years):
+    """
+    Batch version of :func:`get_period_timestamp` for arrays of periods.
+
+    Args:
+        days_of_week: An array-like of day of week labels or codes.
+        seasons: An array-like of season labels or codes.
+        calendar_years: An array-like of calendar years.
+
+    Returns:
+        A NumPy ``datetime64[s]`` array of UTC period timestamps.
+    """
+    years = np.asarray(calendar_years, dtype=np.intp)
+    if years.size == 0:
+        return np.array([], dtype='datetime64[s]')
+    calendar = get_period_calendar(int(years.min()), int(years.max()))
+    return calendar.batch_timestamps(days_of_week, seasons, years)
@@ -20,10 +20,14 @@ setup(
     entry_points={
         'console_scripts': [
             'capmetrics=capmetrics_etl.cli:etl',
-            'capmetrics-tables=capmetrics_etl.cli:tables'
+            'capmetrics-tables=capmetrics_etl.cli:tables',
+            'capmetrics-serve-etl=capmetrics_etl.cli:serve_etl'
         ],
     },
-    install_requires=['click', 'python-dateutil', 'pytz', 'sqlalchemy', 'xlrd'],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
+    install_requires=['click', 'numpy', 'python-dateutil', 'pytz', 'sqlalchemy', 'xlrd'],
     keywords="python etl transit",
     license="MIT",
     long_description=get_readme(),
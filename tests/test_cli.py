@@ -1,11 +1,62 @@
 import configparser
 import os
 import re
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 from click.testing import CliRunner
 from capmetrics_etl import cli
 
 
+# cold import budget of capmetrics_etl.cli in microseconds; the lazy imports keep it near 50 ms
+IMPORT_TIME_BUDGET = 250000
+HEAVY_MODULES = ('sqlalchemy', 'xlrd', 'numpy', 'pytz', 'dateutil', 'capmetrics_etl.etl')
+PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, *options):
+    return subprocess.run([sys.executable] + list(options) + ['-c', code], cwd=PACKAGE_PATH,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+def get_import_times(importtime_output):
+    """
+    Returns:
+        dict: The cumulative import time in microseconds of each module in ``-X importtime`` output.
+    """
+    import_times = dict()
+    for line in importtime_output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            cumulative, module_name = line.split('|')[1:3]
+            if cumulative.strip().isdigit():
+                import_times[module_name.strip()] = int(cumulative)
+    return import_times
+
+
+class ImportTimeTests(unittest.TestCase):
+
+    def test_cold_import_budget(self):
+        # the fastest of three runs, so a busy machine does not fail the test
+        cumulative = min(get_import_times(run_python('import capmetrics_etl.cli', '-X', 'importtime').stderr)
+                         ['capmetrics_etl.cli'] for _ in range(3))
+        self.assertLess(cumulative, IMPORT_TIME_BUDGET)
+
+    def test_no_heavy_imports(self):
+        import_times = get_import_times(run_python('import capmetrics_etl.cli', '-X', 'importtime').stderr)
+        self.assertFalse([name for name in import_times if name in HEAVY_MODULES])
+
+    def test_test_flags_stay_light(self):
+        code = ('import sys\n'
+                'from capmetrics_etl import cli\n'
+                'cli.etl(["data.xls", "capmetrics.ini", "--test"], standalone_mode=False)\n'
+                'cli.tables(["capmetrics.ini", "--test"], standalone_mode=False)\n'
+                'print(",".join(name for name in {0!r} if name in sys.modules))').format(HEAVY_MODULES)
+        result = run_python(code)
+        self.assertEqual(result.stdout.splitlines()[-1], '')
+
+
 class ParseConfigurationTests(unittest.TestCase):
 
     def setUp(self):
@@ -44,6 +95,19 @@ class ETLCommandTests(unittest.TestCase):
         self.assertTrue(message_regex.match(str(result.output.strip())), msg=result)
 
 
+    def test_perfdocs_without_data_file(self):
+        click_runner = CliRunner()
+        arguments = [self.test_config, '--perfdocs']
+        result = click_runner.invoke(cli.etl, arguments)
+        self.assertIsNone(result.exception, msg=result.output)
+        self.assertTrue(result.output.strip().endswith('Capmetrics performance document update completed.'))
+
+    def test_missing_config(self):
+        click_runner = CliRunner()
+        result = click_runner.invoke(cli.etl, [self.test_config])
+        self.assertEqual(result.exit_code, 2)
+
+
 class TablesCommandTests(unittest.TestCase):
 
     def setUp(self):
@@ -61,3 +125,26 @@ class TablesCommandTests(unittest.TestCase):
         arguments = [self.test_config]
         result = click_runner.invoke(cli.tables, arguments)
         self.assertEqual('Capmetrics database tables created.', result.output.strip())
+
+
+class ServeETLCommandTests(unittest.TestCase):
+
+    def test_serve_etl_command_line_test_flag(self):
+        click_runner = CliRunner()
+        tests_path = os.path.dirname(__file__)
+        arguments = [tests_path, os.path.join(tests_path, 'capmetrics_single.ini'), '--test']
+        result = click_runner.invoke(cli.serve_etl, arguments)
+        self.assertEqual('Capmetrics ETL service test.', str(result.output).strip())
+
+    def test_watch_once(self):
+        inbox = tempfile.mkdtemp()
+        try:
+            click_runner = CliRunner()
+            arguments = [inbox, os.path.join(os.path.dirname(__file__), 'capmetrics_single.ini'),
+                         '--once', '--interval', '0']
+            result = click_runner.invoke(cli.serve_etl, arguments)
+            self.assertIsNone(result.exception, msg=result.output)
+            self.assertTrue(result.output.strip().endswith('Capmetrics ETL service stopped.'))
+            self.assertEqual(sorted(os.listdir(inbox)), ['failed', 'processed'])
+        finally:
+            shutil.rmtree(inbox)
@@ -0,0 +1,70 @@
+from datetime import datetime
+import unittest
+import pytz
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import counters, etl, loaders, models, utils
+
+UTC_TIMEZONE = pytz.timezone('UTC')
+
+
+class RowCountTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        models.Base.metadata.create_all(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+        self.session.add_all([models.Route(route_number=number, route_name=str(number), service_type='LOCAL')
+                              for number in range(1, 6)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def get_facts(self, ridership):
+        timestamp = utils.get_period_timestamp('weekday', 'spring', 2015)
+        return [{'route_number': number, 'day_of_week': 'weekday', 'season': 'spring', 'year': 2015,
+                 'timestamp': timestamp, 'ridership': ridership} for number in range(1, 6)]
+
+    def test_seed_and_adjust(self):
+        self.assertEqual(counters.get_row_count(self.session, models.Route), 5)
+        self.session.add(models.Route(route_number=6, route_name='6', service_type='LOCAL'))
+        self.session.commit()
+        self.assertEqual(counters.get_row_count(self.session, models.Route), 6)
+        self.session.delete(self.session.query(models.Route).filter_by(route_number=6).one())
+        self.session.commit()
+        self.assertEqual(counters.get_row_count(self.session, models.Route), 5)
+        etl.store_routes(self.session, {'5': {'route_name': 'five', 'service_type': 'local'},
+                                        '7': {'route_name': 'seven', 'service_type': 'local'}})
+        self.assertEqual(counters.get_row_count(self.session, models.Route), 6)
+
+    def test_loaders_adjust_counts(self):
+        counters.get_row_count(self.session, models.DailyRidership)
+        created_on = UTC_TIMEZONE.localize(datetime.now())
+        loaders.insert_rows(self.session, models.DailyRidership,
+                            [{'route_id': 1, 'is_current': True, 'created_on': created_on}] * 3)
+        self.assertEqual(counters.get_row_count(self.session, models.DailyRidership), 3)
+        # rolled back with the rows
+        self.session.rollback()
+        self.assertEqual(counters.get_row_count(self.session, models.DailyRidership), 0)
+
+    def test_reports_without_counting(self):
+        etl.load_ridership(self.get_facts(10), models.DailyRidership, self.session)
+        etl.merge_ridership(self.get_facts(20), models.DailyRidership, self.session)
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        report = etl.load_ridership(self.get_facts(30), models.DailyRidership, self.session)
+        self.assertEqual(report.total_models, 15)
+        self.assertFalse([statement for statement in statements if 'count(' in statement.lower()])
+        report = etl.merge_ridership(self.get_facts(40), models.DailyRidership, self.session)
+        self.assertEqual(report.total_models, 20)
+
+    def test_catalog_estimate(self):
+        connection = self.session.connection()
+        self.assertIsNone(counters.get_catalog_estimate(connection, models.Route.__table__))
+        connection.execute(text('ANALYZE'))
+        self.assertEqual(counters.get_catalog_estimate(connection, models.Route.__table__), 5)
+        self.assertEqual(counters.get_row_count(self.session, models.Route, exact=False), 5)
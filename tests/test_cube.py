@@ -0,0 +1,124 @@
+from datetime import datetime
+import unittest
+import numpy as np
+import pytz
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import cube, etl, models, utils
+
+UTC_TIMEZONE = pytz.timezone('UTC')
+
+
+class FactCubeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+        created_on = UTC_TIMEZONE.localize(datetime.now())
+        self.session.add_all([
+            models.Route(id=1, route_number=1, route_name='ONE', service_type='LOCAL'),
+            models.Route(id=2, route_number=550, route_name='RAIL', service_type='RAIL'),
+            models.Route(id=3, route_number=3, route_name='THREE', service_type='LOCAL')
+        ])
+        for route_id, base in ((1, 1000), (2, 300), (3, 2000)):
+            for season, year in (('fall', 2014), ('spring', 2015)):
+                for day, ridership in (('weekday', base), ('saturday', base / 2), ('sunday', base / 4)):
+                    timestamp = utils.get_period_timestamp(day, season, year)
+                    self.session.add(models.DailyRidership(created_on=created_on, is_current=True,
+                                                           day_of_week=day, season=season,
+                                                           calendar_year=year, ridership=ridership,
+                                                           route_id=route_id,
+                                                           measurement_timestamp=timestamp))
+                self.session.add(models.ServiceHourRidership(created_on=created_on, is_current=True,
+                                                             day_of_week='weekday', season=season,
+                                                             calendar_year=year, ridership=base / 100,
+                                                             route_id=route_id,
+                                                             measurement_timestamp=timestamp))
+        # superseded fact that must not reach the cube
+        self.session.add(models.DailyRidership(created_on=created_on, is_current=False,
+                                               day_of_week='weekday', season='spring',
+                                               calendar_year=2015, ridership=1, route_id=1,
+                                               measurement_timestamp=timestamp))
+        self.session.commit()
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_load_with_two_selects(self):
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        fact_cube = cube.FactCube.load(self.session)
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(fact_cube.values.shape, (3, 2, 3, 2))
+        self.assertEqual(fact_cube.service_types, ['LOCAL', 'RAIL'])
+        self.assertEqual(fact_cube.period_seasons, ['fall', 'spring'])
+        self.assertEqual(fact_cube.period_years.tolist(), [2014, 2015])
+        self.assertEqual(int(fact_cube.present.sum()), 3 * 2 * 4)
+        self.assertEqual(fact_cube.values[0, 1, 0, cube.DAILY], 1000)
+
+    def test_last_fact_wins(self):
+        routes = [(1, 1, 'ONE', 'LOCAL', False)]
+        facts = [(cube.DAILY, 1, 1, 'weekday', 'spring', 2015, 10.0, None, None),
+                 (cube.DAILY, 2, 1, 'weekday', 'spring', 2015, 20.0, None, None)]
+        fact_cube = cube.FactCube(routes, facts)
+        self.assertEqual(fact_cube.values[0, 0, 0, cube.DAILY], 20.0)
+        self.assertEqual(fact_cube.fact_ids[0, 0, 0, cube.DAILY], 2)
+
+    def test_period_timestamps(self):
+        fact_cube = cube.FactCube.load(self.session)
+        for period, season in enumerate(fact_cube.period_seasons):
+            for day_of_week in utils.DAYS_OF_WEEK:
+                expected = utils.get_period_timestamp(day_of_week, season, int(fact_cube.period_years[period]))
+                self.assertEqual(fact_cube.period_timestamp(period, day_of_week), expected.replace(tzinfo=None))
+
+    def test_aware_period_timestamps(self):
+        routes = [(1, 1, 'ONE', 'LOCAL', False)]
+        timestamp = utils.get_period_timestamp('weekday', 'spring', 2015)
+        facts = [(cube.DAILY, 1, 1, 'weekday', 'spring', 2015, 10.0, None, timestamp)]
+        self.assertEqual(cube.FactCube(routes, facts).period_timestamp(0), timestamp)
+        facts = [(cube.DAILY, 1, 1, 'weekday', 'spring', 2015, 10.0, None, timestamp.replace(tzinfo=None))]
+        self.assertIsNone(cube.FactCube(routes, facts).period_timestamp(0).tzinfo)
+
+    def test_system_ridership(self):
+        fact_cube = cube.FactCube.load(self.session)
+        ridership, present = fact_cube.system_ridership()
+        self.assertEqual(ridership[0, 0].tolist(), [3000, 1500, 750])
+        self.assertEqual(ridership[1, 1].tolist(), [300, 150, 75])
+        self.assertTrue(present.all())
+
+    def test_weekly_performance(self):
+        performances = cube.FactCube.load(self.session).weekly_performance()
+        self.assertEqual(len(performances), 6)
+        route_3 = next(p for p in performances if p['route_id'] == 3 and p['season'] == 'spring')
+        self.assertEqual(route_3['ridership'], 11500)
+        self.assertEqual(route_3['productivity'], 20)
+        # SQLite returns naive UTC timestamps, and so does the cube
+        self.assertEqual(route_3['measurement_timestamp'],
+                         utils.get_period_timestamp('weekday', 'spring', 2015).replace(tzinfo=None))
+
+    def test_high_ridership_routes(self):
+        fact_cube = cube.FactCube.load(self.session)
+        self.assertEqual(fact_cube.latest_period(), 1)
+        self.assertEqual(fact_cube.high_ridership_routes(2), [3, 1])
+
+    def test_empty_cube(self):
+        fact_cube = cube.FactCube([], [])
+        self.assertEqual(fact_cube.high_ridership_routes(), [])
+        self.assertEqual(fact_cube.weekly_performance(), [])
+
+    def test_derived_stages_share_cube(self):
+        fact_cube = cube.FactCube.load(self.session)
+        etl.update_system_ridership(self.session, fact_cube)
+        etl.update_system_trends(self.session)
+        etl.update_weekly_performance(self.session, fact_cube)
+        etl.update_high_ridership_routes(self.session, 1, fact_cube=fact_cube)
+        self.assertEqual(self.session.query(models.SystemRidership).count(), 12)
+        self.assertEqual(self.session.query(models.SystemTrend).count(), 2)
+        self.assertEqual(self.session.query(models.WeeklyPerformance).count(), 6)
+        high = self.session.query(models.Route).filter_by(is_high_ridership=True).one()
+        self.assertEqual(high.route_number, 3)
+        self.assertEqual(fact_cube.is_high_ridership.tolist(), [False, False, True])
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import text
+from capmetrics_etl import engines
+
+
+class CreateConfiguredEngineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine_url = 'sqlite:///{0}'.format(os.path.join(self.directory, 'capmetrics.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_pragmas(self, engine):
+        with engine.connect() as connection:
+            pragmas = {name: connection.execute(text('PRAGMA {0}'.format(name))).scalar()
+                       for name in ('journal_mode', 'synchronous', 'cache_size', 'temp_store')}
+        engine.dispose()
+        return pragmas
+
+    def test_bulk_load_profile(self):
+        engine = engines.create_configured_engine({'engine_url': self.engine_url, 'sqlite_bulk_load': True})
+        self.assertEqual(self.get_pragmas(engine),
+                         {'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -65536, 'temp_store': 2})
+
+    def test_default_profile(self):
+        engine = engines.create_configured_engine({'engine_url': self.engine_url})
+        pragmas = self.get_pragmas(engine)
+        self.assertEqual(pragmas['journal_mode'], 'delete')
+        self.assertEqual(pragmas['synchronous'], 2)
+
+    def test_service_engine(self):
+        engine = engines.create_service_engine({'engine_url': self.engine_url, 'pool_size': 3})
+        self.assertEqual(engine.pool.size(), 3)
+        self.assertEqual(engine.pool._recycle, engines.DEFAULT_POOL_RECYCLE)
+        self.assertTrue(engine.pool._pre_ping)
+        engine.dispose()
+        memory_engine = engines.create_service_engine({'engine_url': 'sqlite:///:memory:'})
+        self.assertFalse(memory_engine.pool._pre_ping)
@@ -2,12 +2,15 @@ import configparser
 from datetime import datetime
 import json
 import os
+import shutil
+import tempfile
+import tracemalloc
 import unittest
 import pytz
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import xlrd
-from capmetrics_etl import cli, etl, models, utils
+from capmetrics_etl import cli, counters, etl, models, quality, utils
 
 APP_TIMEZONE = pytz.timezone('America/Chicago')
 UTC_TIMEZONE = pytz.timezone('UTC')
@@ -121,6 +124,39 @@ class GetPeriodTests(unittest.TestCase):
         self.assertEqual(periods['10']['timestamp'], timestamp_10)
 
 
+class ScanWorksheetHeadersTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+        self.test_excel_single = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
+
+    def test_scan(self):
+        excel_book = xlrd.open_workbook(filename=self.test_excel)
+        worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
+        header_scan = etl.scan_worksheet_headers(worksheet)
+        self.assertEqual(header_scan['periods'], etl.get_periods(worksheet))
+        self.assertEqual(len(header_scan['periods']), 11)
+        self.assertEqual(header_scan['route_header_row'], 4)
+        self.assertTrue(header_scan['names_available'])
+        self.assertTrue(header_scan['types_available'])
+
+    def test_scan_stops_at_last_column(self):
+        excel_book = xlrd.open_workbook(filename=self.test_excel_single)
+        worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
+        header_scan = etl.scan_worksheet_headers(worksheet)
+        self.assertEqual(worksheet.ncols, 14)
+        self.assertEqual(header_scan['columns_scanned'], 14)
+        self.assertEqual(len(header_scan['periods']), 11)
+        self.assertFalse(etl.find_period(worksheet, {}, 20))
+
+    def test_day_of_week_below_last_row(self):
+        excel_book = xlrd.open_workbook(filename=self.test_excel_single)
+        worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
+        self.assertIsNone(etl.extract_day_of_week(worksheet.nrows - 1, 3, worksheet))
+        self.assertIsNone(etl.extract_day_of_week(3, worksheet.ncols, worksheet))
+
+
 class ExtractDayOfWeekTests(unittest.TestCase):
 
     def setUp(self):
@@ -208,9 +244,6 @@ class GetLatestMeasurementTimestampTests(unittest.TestCase):
     def setUp(self):
         tests_path = os.path.dirname(__file__)
         self.test_excel = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
-        excel_book = xlrd.open_workbook(filename=self.test_excel)
-        self.worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
-        self.periods = etl.get_periods(self.worksheet)
         self.engine = create_engine('sqlite:///:memory:')
         Session = sessionmaker()
         Session.configure(bind=self.engine)
@@ -221,8 +254,8 @@ class GetLatestMeasurementTimestampTests(unittest.TestCase):
                               session,
                               ['Ridership by Route Weekday'])
 
-        etl.parse_worksheet_ridership(self.worksheet, self.periods, models.DailyRidership,
-                                      self.session)
+        etl.update_ridership(self.test_excel, ['Ridership by Route Weekday'], models.DailyRidership,
+                             self.session)
 
     def tearDown(self):
         models.Base.metadata.drop_all(self.engine)
@@ -288,81 +321,6 @@ class GetHighRidershipRoutesTests(unittest.TestCase):
         self.assertEqual(set(routes), expected_routes)
 
 
-class ParseWorksheetRidershipTests(unittest.TestCase):
-    """
-    Tests etl.parse_worksheet_ridership function.
-    """
-
-    def setUp(self):
-        tests_path = os.path.dirname(__file__)
-        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
-        excel_book = xlrd.open_workbook(filename=self.test_excel)
-        self.worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
-        self.periods = etl.get_periods(self.worksheet)
-        self.engine = create_engine('sqlite:///:memory:')
-        Session = sessionmaker()
-        Session.configure(bind=self.engine)
-        session = Session()
-        models.Base.metadata.create_all(self.engine)
-        self.session = session
-        etl.update_route_info(self.test_excel,
-                              session,
-                              ['Ridership by Route Weekday'])
-
-    def tearDown(self):
-        models.Base.metadata.drop_all(self.engine)
-
-    def test_parse(self):
-        etl.parse_worksheet_ridership(self.worksheet, self.periods, models.DailyRidership,
-                                      self.session)
-        instances = self.session.query(models.DailyRidership).all()
-        self.assertEqual(len(instances), 11)
-        ridership_values = list()
-        for daily_ridership in instances:
-            ridership_values.append(daily_ridership.ridership)
-        expected_set = {
-            14041.3609132795,
-            12794.7123015873,
-            14117.8574082171,
-            13633.8223760158,
-            12875.3658424908,
-            12459.0767904292,
-            7949.55721234328,
-            7000.32063492063,
-            6740.593831168831,
-            6227.303709,
-            6037.422349
-        }
-        difference = expected_set.difference(set(ridership_values))
-        self.assertEqual(len(list(difference)), 0)
-
-    def test_parse_etl_report(self):
-        report = models.ETLReport(creates=0, updates=0)
-        etl.parse_worksheet_ridership(self.worksheet, self.periods, models.DailyRidership,
-                                      self.session, report)
-        instances = self.session.query(models.DailyRidership).all()
-        self.assertEqual(len(instances), 11)
-        ridership_values = list()
-        for daily_ridership in instances:
-            ridership_values.append(daily_ridership.ridership)
-        expected_set = {
-            14041.3609132795,
-            12794.7123015873,
-            14117.8574082171,
-            13633.8223760158,
-            12875.3658424908,
-            12459.0767904292,
-            7949.55721234328,
-            7000.32063492063,
-            6740.593831168831,
-            6227.303709,
-            6037.422349
-        }
-        difference = expected_set.difference(set(ridership_values))
-        self.assertEqual(len(list(difference)), 0)
-        self.assertEqual(report.creates, 11)
-        self.assertEqual(report.updates, 0)
-
 class StoreRouteTests(unittest.TestCase):
     """
     Tests etl.store_route function.
@@ -527,6 +485,7 @@ class UpdateRouteInfoTests(unittest.TestCase):
         etl.update_route_info(self.test_excel_with_updates,
                               self.session,
                               self.daily_worksheets)
+        self.session.commit()
         route_1 = self.session.query(models.Route).filter_by(route_number=1).one()
         self.assertEqual(route_1.route_name, '1-NORTH LAMAR/SOUTH CONGRESS')
         self.assertEqual(route_1.service_type, 'LOCAL')
@@ -566,6 +525,7 @@ class UpdateRouteInfoTests(unittest.TestCase):
         report = etl.update_route_info(self.test_excel_with_updates,
                                        self.session,
                                        self.daily_worksheets)
+        self.session.commit()
         route_1 = self.session.query(models.Route).filter_by(route_number=1).one()
         self.assertEqual(route_1.route_name, '1-NORTH LAMAR/SOUTH CONGRESS')
         self.assertEqual(route_1.service_type, 'LOCAL')
@@ -598,150 +558,6 @@ class UpdateRouteInfoTests(unittest.TestCase):
         self.assertEqual(report.total_models, 88)
 
 
-class DeactivateCurrentPeriodTests(unittest.TestCase):
-
-    def setUp(self):
-        tests_path = os.path.dirname(__file__)
-        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
-        self.engine = create_engine('sqlite:///:memory:')
-        Session = sessionmaker()
-        Session.configure(bind=self.engine)
-        self.session = Session()
-        models.Base.metadata.create_all(self.engine)
-        route = models.Route(route_number=1, route_name='POPULAR ROUTE',
-                             service_type='LOCAL')
-        self.session.add(route)
-        self.session.commit()
-        self.timestamp = utils.get_period_timestamp('weekday', 'spring', 2015)
-        daily_ridership = models.DailyRidership(created_on=datetime.now(),
-                                                is_current=True,
-                                                day_of_week='weekday',
-                                                season='spring',
-                                                calendar_year=2015,
-                                                ridership=700,
-                                                route_id=route.id,
-                                                measurement_timestamp=self.timestamp)
-        self.session.add(daily_ridership)
-        self.session.commit()
-
-    def tearDown(self):
-        models.Base.metadata.drop_all(self.engine)
-
-    def test_deactivation(self):
-        ridership_model = models.DailyRidership
-        period = {
-            'year': 2015,
-            'season': 'spring',
-            'timestamp': self.timestamp,
-            'day_of_week': 'weekday'
-        }
-        etl.deactivate_current_period(1, period, ridership_model, self.session)
-        self.session.commit()
-        ridership = self.session.query(models.DailyRidership).one()
-        self.assertFalse(ridership.is_current)
-
-
-class HandleRidershipCellTests(unittest.TestCase):
-
-    def setUp(self):
-        tests_path = os.path.dirname(__file__)
-        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
-        self.engine = create_engine('sqlite:///:memory:')
-        Session = sessionmaker()
-        Session.configure(bind=self.engine)
-        self.session = Session()
-        models.Base.metadata.create_all(self.engine)
-        route = models.Route(route_number=1, route_name='POPULAR ROUTE',
-                             service_type='LOCAL')
-        self.session.add(route)
-        self.session.commit()
-        self.timestamp = utils.get_period_timestamp('saturday', 'fall', 2013)
-        daily_ridership = models.DailyRidership(created_on=datetime.now(),
-                                                is_current=True,
-                                                day_of_week='saturday',
-                                                season='fall',
-                                                calendar_year=2013,
-                                                measurement_timestamp=self.timestamp,
-                                                ridership=7000,
-                                                route_id=route.id)
-        hourly_ridership = models.ServiceHourRidership(created_on=datetime.now(),
-                                                       is_current=True,
-                                                       day_of_week='saturday',
-                                                       season='fall',
-                                                       measurement_timestamp=self.timestamp,
-                                                       calendar_year=2013,
-                                                       ridership=70.7,
-                                                       route_id=route.id)
-        self.session.add(daily_ridership)
-        self.session.add(hourly_ridership)
-        self.session.commit()
-
-    def tearDown(self):
-        models.Base.metadata.drop_all(self.engine)
-
-    def test_handle_new_daily_ridership(self):
-        excel_book = xlrd.open_workbook(filename=self.test_excel)
-        worksheet = excel_book.sheet_by_name('Ridership by Route Saturday')
-        ridership_cell = worksheet.cell(5, 8)
-        period = {
-            'year': 2013,
-            'season': 'fall',
-            'day_of_week': 'saturday',
-            'timestamp': self.timestamp
-        }
-        etl.handle_ridership_cell(1, period, ridership_cell,
-                                  models.DailyRidership, self.session)
-        self.session.commit()
-        ridership = self.session.query(models.DailyRidership)\
-                        .filter_by(is_current=True).one()
-        self.assertEqual(ridership.ridership, 10997.5717761557)
-        old_ridership = self.session.query(models.DailyRidership) \
-            .filter_by(is_current=False).one()
-        self.assertEqual(old_ridership.ridership, float(7000))
-
-    def test_handle_new_daily_ridership_with_report(self):
-        excel_book = xlrd.open_workbook(filename=self.test_excel)
-        worksheet = excel_book.sheet_by_name('Ridership by Route Saturday')
-        ridership_cell = worksheet.cell(5, 8)
-        period = {
-            'year': 2013,
-            'season': 'fall',
-            'timestamp': self.timestamp,
-            'day_of_week': 'saturday'
-        }
-        report = models.ETLReport(creates=0, updates=0)
-        etl.handle_ridership_cell(1, period, ridership_cell,
-                                  models.DailyRidership, self.session, report)
-        self.session.commit()
-        ridership = self.session.query(models.DailyRidership) \
-            .filter_by(is_current=True).one()
-        self.assertEqual(ridership.ridership, 10997.5717761557)
-        old_ridership = self.session.query(models.DailyRidership) \
-            .filter_by(is_current=False).one()
-        self.assertEqual(old_ridership.ridership, float(7000))
-        self.assertEqual(report.updates, 1)
-
-    def test_handle_new_hourly_ridership(self):
-        excel_book = xlrd.open_workbook(filename=self.test_excel)
-        worksheet = excel_book.sheet_by_name('Riders Hour Saturday')
-        ridership_cell = worksheet.cell(5, 8)
-        period = {
-            'year': 2013,
-            'season': 'fall',
-            'timestamp': self.timestamp,
-            'day_of_week': 'saturday'
-        }
-        etl.handle_ridership_cell(1, period, ridership_cell,
-                                  models.ServiceHourRidership, self.session)
-        self.session.commit()
-        ridership = self.session.query(models.ServiceHourRidership) \
-            .filter_by(is_current=True).one()
-        self.assertEqual(ridership.ridership, 39.8486808725975)
-        old_ridership = self.session.query(models.ServiceHourRidership) \
-            .filter_by(is_current=False).one()
-        self.assertEqual(old_ridership.ridership, float(70.7))
-
-
 class UpdateRidershipTests(unittest.TestCase):
 
     def setUp(self):
@@ -773,6 +589,151 @@ class UpdateRidershipTests(unittest.TestCase):
         self.assertEqual(report.total_models, 11)
 
 
+class RidershipFactsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+        self.session.add_all([models.Route(route_number=number, route_name=str(number), service_type='LOCAL')
+                              for number in range(1, 41)])
+        self.session.commit()
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def get_facts(self, offset):
+        facts = list()
+        for year in range(2010, 2016):
+            for season in ['winter', 'spring', 'summer', 'fall']:
+                for day in ['weekday', 'saturday', 'sunday']:
+                    timestamp = utils.get_period_timestamp(day, season, year)
+                    facts.extend({'route_number': number, 'day_of_week': day, 'season': season,
+                                  'year': year, 'timestamp': timestamp, 'ridership': number + offset}
+                                 for number in range(1, 41))
+        return facts
+
+
+class LoadRidershipMemoryTests(RidershipFactsTestCase):
+
+    def measure_load(self, facts):
+        tracemalloc.start()
+        try:
+            report = etl.load_ridership(facts, models.DailyRidership, self.session, batch_size=100)
+            return report, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_batched_load(self):
+        report = etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session, batch_size=7)
+        self.assertEqual(report.creates, 2880)
+        report = etl.load_ridership(self.get_facts(1), models.DailyRidership, self.session, batch_size=7)
+        self.assertEqual(report.updates, 2880)
+        self.assertEqual(self.session.query(models.DailyRidership).filter_by(is_current=True).count(), 2880)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 5760)
+
+    def test_peak_memory_independent_of_history(self):
+        _, first_peak = self.measure_load(self.get_facts(0))
+        for offset in range(1, 6):
+            etl.load_ridership(self.get_facts(offset), models.DailyRidership, self.session)
+        report, later_peak = self.measure_load(self.get_facts(6))
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 7 * 2880)
+        self.assertEqual(report.updates, 2880)
+        # the retired history is never read back
+        self.assertLess(later_peak, first_peak * 1.5)
+        self.assertEqual(len(self.session.identity_map), 0)
+
+
+class MergeRidershipTests(RidershipFactsTestCase):
+
+    def test_merge(self):
+        report = etl.merge_ridership(self.get_facts(0), models.DailyRidership, self.session, batch_size=100)
+        self.assertEqual((report.updates, report.creates, report.total_models), (0, 2880, 2880))
+        changed = self.get_facts(0)[:10] + [dict(fact, ridership=-1) for fact in self.get_facts(0)[10:15]]
+        report = etl.merge_ridership(changed, models.DailyRidership, self.session)
+        # unchanged facts stay current
+        self.assertEqual((report.updates, report.creates), (5, 5))
+        current = self.session.query(models.DailyRidership).filter_by(is_current=True)
+        self.assertEqual(current.count(), 2880)
+        self.assertEqual(current.filter_by(ridership=-1).count(), 5)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 2885)
+
+    def test_constant_statements(self):
+        statements = []
+        # the first load also seeds the row counter
+        etl.merge_ridership(self.get_facts(0), models.DailyRidership, self.session, batch_size=5000)
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        etl.merge_ridership(self.get_facts(1), models.DailyRidership, self.session, batch_size=5000)
+        large_load = len(statements)
+        del statements[:]
+        etl.merge_ridership(self.get_facts(2)[:50], models.DailyRidership, self.session, batch_size=5000)
+        self.assertEqual(len(statements), large_load)
+
+    def test_matches_replace_strategy(self):
+        etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session)
+        etl.load_ridership(self.get_facts(1)[:100], models.DailyRidership, self.session)
+        replaced = self.session.query(models.DailyRidership.route_id, models.DailyRidership.season,
+                                      models.DailyRidership.calendar_year, models.DailyRidership.day_of_week,
+                                      models.DailyRidership.ridership).filter_by(is_current=True)
+        replaced = sorted(tuple(row) for row in replaced)
+        self.session.query(models.DailyRidership).delete()
+        etl.merge_ridership(self.get_facts(0), models.DailyRidership, self.session)
+        etl.merge_ridership(self.get_facts(1)[:100], models.DailyRidership, self.session)
+        merged = self.session.query(models.DailyRidership.route_id, models.DailyRidership.season,
+                                    models.DailyRidership.calendar_year, models.DailyRidership.day_of_week,
+                                    models.DailyRidership.ridership).filter_by(is_current=True)
+        self.assertEqual(sorted(tuple(row) for row in merged), replaced)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            etl.get_ridership_loader('upsert')
+
+
+class StageTransactionTests(RidershipFactsTestCase):
+
+    def test_commit_at_stage_end(self):
+        with etl.stage_transaction(self.session):
+            etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session)
+            etl.load_ridership(self.get_facts(1), models.DailyRidership, self.session)
+        self.session.rollback()
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 5760)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(KeyError):
+            with etl.stage_transaction(self.session):
+                etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session)
+                etl.load_ridership([{'route_number': 999}], models.DailyRidership, self.session)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 0)
+        # commits work again outside of a stage
+        self.session.add(models.Route(route_number=999, route_name='999', service_type='LOCAL'))
+        self.session.commit()
+        self.session.rollback()
+        self.assertEqual(self.session.query(models.Route).filter_by(route_number=999).count(), 1)
+
+    def test_open_transaction(self):
+        self.session.query(models.DailyRidership).count()
+        with self.assertRaises(ValueError):
+            with etl.stage_transaction(self.session):
+                etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 0)
+        self.session.rollback()
+        with etl.stage_transaction(self.session):
+            with self.assertRaises(ValueError):
+                with etl.stage_transaction(self.session):
+                    pass
+
+    def test_analyze_database(self):
+        etl.load_ridership(self.get_facts(0), models.DailyRidership, self.session)
+        etl.analyze_database(self.session, {})
+        self.assertIsNone(counters.get_catalog_estimate(self.session.connection(), models.DailyRidership.__table__))
+        etl.analyze_database(self.session, {'sqlite_bulk_load': True})
+        self.assertEqual(counters.get_catalog_estimate(self.session.connection(), models.DailyRidership.__table__),
+                         2880)
+
+
 class RunExcelETLTests(unittest.TestCase):
 
     def setUp(self):
@@ -797,7 +758,8 @@ class RunExcelETLTests(unittest.TestCase):
         # This test takes a long time, as it perform the full etl task for a realistic file
         etl.run_excel_etl('./tests/data/test_cmta_data.xls', self.session, self.config)
         reports = self.session.query(models.ETLReport).all()
-        self.assertTrue(len(reports), 3)
+        self.assertEqual(sorted(report.etl_type for report in reports),
+                         ['daily-ridership', 'hourly-ridership', 'route-info'])
         high_ridership_routes = self.session.query(models.Route) \
             .filter_by(is_high_ridership=True) \
             .all()
@@ -806,6 +768,54 @@ class RunExcelETLTests(unittest.TestCase):
         expected_routes = {7, 1, 300, 801, 10, 3, 20, 803, 331, 37}
         self.assertEqual(returned_routes, expected_routes)
 
+    def test_rerun(self):
+        # transactions begin explicitly, as they do on PostgreSQL
+        temporary_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temporary_directory)
+        engine = create_engine('sqlite:///' + os.path.join(temporary_directory, 'rerun.db'))
+
+        @event.listens_for(engine, 'connect')
+        def disable_driver_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, 'begin')
+        def begin(connection):
+            connection.exec_driver_sql('BEGIN')
+
+        models.Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        for run in range(2):
+            session = Session()
+            quality_report, parsed_worksheets = quality.validate_workbook_cached(
+                './tests/data/test_cmta_data.xls', self.config, session)
+            self.assertTrue(quality_report['passed'])
+            # the second run gets the cached verdict
+            self.assertEqual(parsed_worksheets is None, run == 1)
+            etl.run_excel_etl('./tests/data/test_cmta_data.xls', session, self.config,
+                              parsed_worksheets)
+            session = Session()
+            reports = session.query(models.ETLReport).order_by(models.ETLReport.id).all()
+            self.assertEqual(len(reports), 3 * (run + 1))
+            self.assertEqual(session.query(models.DailyRidership).count(), 1772 * (run + 1))
+            self.assertEqual(session.query(models.DailyRidership).filter_by(is_current=True).count(),
+                             1772)
+            self.assertEqual(reports[-2].etl_type, 'daily-ridership')
+            self.assertEqual(reports[-2].updates, 1772 * run)
+            session.close()
+        engine.dispose()
+
+    def test_merge_strategy(self):
+        self.config['load_strategy'] = 'merge'
+        etl.run_excel_etl('./tests/data/test_cmta_data.xls', self.session, self.config)
+        etl.run_excel_etl('./tests/data/test_cmta_data.xls', self.session, self.config)
+        reports = self.session.query(models.ETLReport).filter_by(etl_type='daily-ridership')\
+                                                      .order_by(models.ETLReport.id).all()
+        self.assertEqual(reports[1].creates, 0)
+        self.assertEqual(reports[1].updates, 0)
+        high_ridership_routes = self.session.query(models.Route).filter_by(is_high_ridership=True).all()
+        returned_routes = set([route.route_number for route in high_ridership_routes])
+        self.assertEqual(returned_routes, {7, 1, 300, 801, 10, 3, 20, 803, 331, 37})
+
 
 
 class DeactivatePreviousSystemRidershipFacts(unittest.TestCase):
@@ -1034,14 +1044,114 @@ class UpdateSystemTrendsTests(unittest.TestCase):
             ["2015-03-30T05:00:00+00:00", 77000.0],
             ["2015-06-29T05:00:00+00:00", 84000.0]
         ])
-        self.assertEqual(len(json.loads(bus_trend.trend)), 3, msg=bus_trend.trend)
-        self.assertEqual(bus_trend.trend, expected_bus_json, msg=bus_trend.trend)
+        self.assertEqual(len(bus_trend.trend), 3, msg=bus_trend.trend)
+        self.assertEqual(json.dumps(bus_trend.trend), expected_bus_json, msg=bus_trend.trend)
         expected_rail_json = json.dumps([
             ["2014-12-29T06:00:00+00:00", 7890.0],
             ["2015-03-30T05:00:00+00:00", 6300.0],
             ["2015-09-28T05:00:00+00:00", 8640.0]
         ])
-        self.assertEqual(rail_trend.trend, expected_rail_json, msg=rail_trend.trend)
+        self.assertEqual(json.dumps(rail_trend.trend), expected_rail_json, msg=rail_trend.trend)
+
+    def test_weekly_rollup(self):
+        etl.update_system_trends(self.session)
+        weeklies = self.session.query(models.WeeklySystemRidership).all()
+        self.assertEqual(len(weeklies), 6)
+        bus_winter = self.session.query(models.WeeklySystemRidership)\
+                                 .filter_by(service_type='BUS', season='winter', calendar_year=2015)\
+                                 .one()
+        self.assertEqual(bus_winter.ridership, 70000)
+        # a changed system ridership total is updated in place
+        rail_sunday = self.session.query(models.SystemRidership).filter_by(id=19).one()
+        rail_sunday.ridership = 1400
+        self.session.commit()
+        etl.update_system_trends(self.session)
+        rail_fall = self.session.query(models.WeeklySystemRidership)\
+                                .filter_by(service_type='RAIL', season='fall')\
+                                .one()
+        self.assertEqual(rail_fall.ridership, 8740)
+        self.assertEqual(self.session.query(models.WeeklySystemRidership).count(), 6)
+
+    def test_weekly_rollup_removes_stale_totals(self):
+        etl.update_system_trends(self.session)
+        self.session.query(models.SystemRidership).filter_by(service_type='rail').update({'is_active': False})
+        self.session.commit()
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        etl.update_weekly_system_ridership(self.session)
+        self.assertEqual(len([statement for statement in statements if statement.startswith('DELETE')]), 1)
+        remaining = self.session.query(models.WeeklySystemRidership.service_type).distinct().all()
+        self.assertEqual(remaining, [('BUS',)])
+
+    def test_trend_point_updates(self):
+        etl.update_system_trends(self.session)
+        bus_trend = self.session.query(models.SystemTrend).filter_by(service_type='BUS').one()
+        bus_updated_on = bus_trend.updated_on
+        rail_sunday = self.session.query(models.SystemRidership).filter_by(id=19).one()
+        rail_sunday.ridership = 1400
+        self.session.commit()
+        records = etl.update_system_trends(self.session)
+        bus_trend = self.session.query(models.SystemTrend).filter_by(service_type='BUS').one()
+        # the bus points did not change, so neither did the bus trend
+        self.assertEqual(bus_trend.updated_on, bus_updated_on)
+        rail_record = next(record for record in records if record.service_type == 'RAIL')
+        self.assertEqual(rail_record.trend[2], ["2015-09-28T05:00:00+00:00", 8740.0])
+
+class UpdateSystemRidershipTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+        for number, service_type in ((1, 'LOCAL'), (2, 'LOCAL'), (550, 'RAIL')):
+            self.session.add(models.Route(id=number, route_number=number,
+                                          route_name='TEST ROUTE {0}'.format(number),
+                                          service_type=service_type))
+            for day in ['weekday', 'saturday', 'sunday']:
+                timestamp = utils.get_period_timestamp(day, 'spring', 2015)
+                self.session.add(models.DailyRidership(created_on=datetime.now(), is_current=True,
+                                                       day_of_week=day, season='spring',
+                                                       calendar_year=2015, ridership=100 * number,
+                                                       route_id=number, measurement_timestamp=timestamp))
+        self.session.commit()
+        etl.update_system_ridership(self.session)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_rollup(self):
+        actives = self.session.query(models.SystemRidership).filter_by(is_active=True).all()
+        self.assertEqual(len(actives), 6)
+        local_weekday = self.session.query(models.SystemRidership)\
+                                    .filter_by(service_type='LOCAL', day_of_week='weekday')\
+                                    .one()
+        self.assertEqual(local_weekday.ridership, 300)
+
+    def test_unchanged_cells_are_kept(self):
+        etl.update_system_ridership(self.session)
+        self.assertEqual(self.session.query(models.SystemRidership).count(), 6)
+
+    def test_changed_cell_is_replaced(self):
+        daily = self.session.query(models.DailyRidership).filter_by(route_id=1, day_of_week='sunday').one()
+        daily.ridership = 150
+        self.session.commit()
+        etl.update_system_ridership(self.session)
+        self.assertEqual(self.session.query(models.SystemRidership).count(), 7)
+        local_sunday = self.session.query(models.SystemRidership)\
+                                   .filter_by(service_type='LOCAL', day_of_week='sunday', is_active=True)\
+                                   .one()
+        self.assertEqual(local_sunday.ridership, 350)
+
+    def test_vanished_cell_is_deactivated(self):
+        daily = self.session.query(models.DailyRidership).filter_by(route_id=550, day_of_week='sunday').one()
+        daily.is_current = False
+        self.session.commit()
+        etl.update_system_ridership(self.session)
+        actives = self.session.query(models.SystemRidership).filter_by(is_active=True).all()
+        self.assertEqual(len(actives), 5)
 
 
 class UpdateHighRidershipRoutesTests(unittest.TestCase):
@@ -1196,3 +1306,73 @@ class UpdateWeeklyPerformanceTests(unittest.TestCase):
         for w in winters:
             self.assertEqual(w.measurement_timestamp.isoformat(), '2009-12-28T06:00:00')
 
+
+
+class MergeExtractionsTests(unittest.TestCase):
+
+    def test_later_extraction_wins(self):
+        spring = utils.get_period_timestamp('weekday', 'spring', 2015)
+        older = {
+            'routes': [{'routes': [{'route_number': '1', 'route_name': 'OLD', 'service_type': ''}]}],
+            'daily_ridership': [{'route_number': 1, 'season': 'spring', 'year': 2015,
+                                 'day_of_week': 'weekday', 'timestamp': spring, 'ridership': 100}],
+            'service_hour_ridership': []
+        }
+        newer = {
+            'routes': [{'routes': [{'route_number': '1', 'route_name': 'NEW', 'service_type': ''}]}],
+            'daily_ridership': [{'route_number': 1, 'season': 'spring', 'year': 2015,
+                                 'day_of_week': 'weekday', 'timestamp': spring, 'ridership': 200}],
+            'service_hour_ridership': []
+        }
+        merged = etl.merge_extractions([older, newer])
+        self.assertEqual(len(merged['daily_ridership']), 1)
+        self.assertEqual(merged['daily_ridership'][0]['ridership'], 200)
+        merged_routes = etl.merge_route_data(merged['routes'])
+        self.assertEqual(merged_routes['1']['route_name'], 'NEW')
+
+
+class RunBatchETLTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_csv = os.path.join(tests_path, 'data/test_cmta_data.csv')
+        self.batch_directory = tempfile.mkdtemp()
+        # a later release that revises one spring value and adds a fall period
+        newer_csv = os.path.join(self.batch_directory, 'a_newer.csv')
+        with open(self.test_csv) as source, open(newer_csv, 'w') as newer:
+            newer.write(source.readline())
+            newer.write('1,1-North Lamar/South Congress,Local,Spring,2015,Weekday,daily_ridership,1234\n')
+            newer.write('1,1-North Lamar/South Congress,Local,Fall,2015,Weekday,daily_ridership,1500\n')
+        shutil.copy(self.test_csv, os.path.join(self.batch_directory, 'b_older.csv'))
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+        shutil.rmtree(self.batch_directory)
+
+    def test_find_batch_files(self):
+        open(os.path.join(self.batch_directory, 'notes.txt'), 'w').close()
+        # xlrd cannot read .xlsx workbooks
+        open(os.path.join(self.batch_directory, 'c_release.xlsx'), 'w').close()
+        batch_files = etl.find_batch_files(self.batch_directory)
+        self.assertEqual([os.path.basename(f) for f in batch_files], ['a_newer.csv', 'b_older.csv'])
+        batch_files = etl.find_batch_files(os.path.join(self.batch_directory, '*'))
+        self.assertEqual([os.path.basename(f) for f in batch_files], ['a_newer.csv', 'b_older.csv'])
+        pattern = os.path.join(self.batch_directory, 'b_*.csv')
+        self.assertEqual(len(etl.find_batch_files(pattern)), 1)
+
+    def test_chronological_supersession(self):
+        batch_files = etl.find_batch_files(self.batch_directory)
+        etl.run_batch_etl(batch_files, self.session, {})
+        currents = self.session.query(models.DailyRidership).filter_by(is_current=True)
+        self.assertEqual(currents.count(), 19)
+        # nothing is retired when the batch resolves superseded values in memory
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 19)
+        spring = currents.filter_by(season='spring', day_of_week='weekday', route_id=1).one()
+        self.assertEqual(spring.ridership, 1234)
+        reports = self.session.query(models.ETLReport).filter_by(etl_type='daily-ridership').all()
+        self.assertEqual(len(reports), 1)
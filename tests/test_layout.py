@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xlrd
+from capmetrics_etl import etl, layout
+
+
+class LayoutFingerprintTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+        self.test_excel_single = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
+
+    def test_stable_fingerprint(self):
+        excel_book = xlrd.open_workbook(filename=self.test_excel)
+        worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
+        fingerprint = layout.get_worksheet_fingerprint(worksheet)
+        reopened_book = xlrd.open_workbook(filename=self.test_excel)
+        reopened_worksheet = reopened_book.sheet_by_name('Ridership by Route Weekday')
+        self.assertEqual(fingerprint, layout.get_worksheet_fingerprint(reopened_worksheet))
+
+    def test_changed_layout_fingerprint(self):
+        excel_book = xlrd.open_workbook(filename=self.test_excel)
+        single_book = xlrd.open_workbook(filename=self.test_excel_single)
+        worksheet = excel_book.sheet_by_name('Ridership by Route Weekday')
+        single_worksheet = single_book.sheet_by_name('Ridership by Route Weekday')
+        self.assertNotEqual(layout.get_worksheet_fingerprint(worksheet),
+                            layout.get_worksheet_fingerprint(single_worksheet))
+
+
+class FakeWorksheet:
+
+    def __init__(self, rows):
+        self.name = 'Ridership by Route Weekday'
+        self.rows = rows
+        self.nrows = len(rows)
+        self.ncols = max(len(row) for row in rows)
+
+    def row_values(self, row_index):
+        return self.rows[row_index]
+
+
+class HeaderRowsTests(unittest.TestCase):
+
+    def test_fingerprint_covers_scanned_rows(self):
+        rows = [['', 'Spring 2015'] for row_index in range(20)]
+        worksheet = FakeWorksheet(rows)
+        self.assertEqual(len(etl.get_header_values(worksheet)), layout.HEADER_ROWS)
+        changed_rows = [list(row) for row in rows]
+        changed_rows[layout.HEADER_ROWS - 1][1] = 'Weekday'
+        self.assertNotEqual(layout.get_worksheet_fingerprint(worksheet),
+                            layout.get_worksheet_fingerprint(FakeWorksheet(changed_rows)))
+
+
+class LayoutCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+        self.test_excel_single = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
+        self.cache_directory = tempfile.mkdtemp()
+        self.cache_location = os.path.join(self.cache_directory, 'layouts.json')
+        self.configuration = {
+            'daily_ridership_worksheets': ['Ridership by Route Weekday'],
+            'hour_productivity_worksheets': ['Riders per Hour Weekday'],
+            'layout_cache': self.cache_location
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_directory)
+
+    def test_persistence(self):
+        cache = layout.LayoutCache(self.cache_location)
+        self.assertIsNone(cache.get('abc'))
+        cache.put('abc', {'periods': {}, 'route_header_row': 4})
+        cache.save()
+        reloaded_cache = layout.LayoutCache(self.cache_location)
+        self.assertEqual(reloaded_cache.get('abc')['route_header_row'], 4)
+
+    def test_size_limit(self):
+        cache = layout.LayoutCache(self.cache_location, size=2)
+        for fingerprint in ['a', 'b', 'c']:
+            cache.put(fingerprint, {})
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), {})
+
+    def test_least_recently_used_evicted(self):
+        cache = layout.LayoutCache(self.cache_location, size=2)
+        cache.put('a', {})
+        cache.put('b', {})
+        self.assertEqual(cache.get('a'), {})
+        cache.put('c', {})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {})
+
+    def test_cached_extraction_matches_full_scan(self):
+        uncached = dict(self.configuration, layout_cache=None)
+        expected = etl.extract_workbook(self.test_excel, uncached)
+        first = etl.extract_workbook(self.test_excel, self.configuration)
+        self.assertTrue(os.path.exists(self.cache_location))
+        second = etl.extract_workbook(self.test_excel, self.configuration)
+        for extraction in [first, second]:
+            self.assertEqual(extraction['routes'], expected['routes'])
+            self.assertEqual(extraction['daily_ridership'], expected['daily_ridership'])
+            self.assertEqual(extraction['service_hour_ridership'], expected['service_hour_ridership'])
+
+    def test_cache_hit_skips_discovery(self):
+        etl.extract_workbook(self.test_excel, self.configuration)
+        original_discovery = etl.discover_worksheet_layout
+
+        def failing_discovery(worksheet):
+            raise AssertionError('header discovery ran on a cached layout')
+
+        etl.discover_worksheet_layout = failing_discovery
+        try:
+            etl.extract_workbook(self.test_excel, self.configuration)
+        finally:
+            etl.discover_worksheet_layout = original_discovery
+
+    def test_mismatch_refreshes_cache(self):
+        etl.extract_workbook(self.test_excel, self.configuration)
+        etl.extract_workbook(self.test_excel_single, self.configuration)
+        cache = layout.LayoutCache(self.cache_location)
+        self.assertEqual(len(cache.layouts), 4)
+        single_book = xlrd.open_workbook(filename=self.test_excel_single)
+        worksheet = single_book.sheet_by_name('Ridership by Route Weekday')
+        fingerprint = layout.get_worksheet_fingerprint(worksheet)
+        self.assertEqual(cache.get(fingerprint)['route_header_row'], 4)
+
+
+class LowMemoryExtractionTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+        self.configuration = {
+            'daily_ridership_worksheets': ['Ridership by Route Weekday', 'Ridership by Route Sunday'],
+            'hour_productivity_worksheets': ['Riders per Hour Weekday'],
+        }
+
+    def test_on_demand_workbook(self):
+        with etl.open_workbook(self.test_excel, low_memory=True) as excel_book:
+            self.assertFalse(excel_book.sheet_loaded('Definitions'))
+            excel_book.sheet_by_name('Ridership by Route Weekday')
+            self.assertTrue(excel_book.sheet_loaded('Ridership by Route Weekday'))
+            self.assertFalse(excel_book.sheet_loaded('Ridership by Route Saturday'))
+
+    def test_extraction_matches_default_mode(self):
+        expected = etl.extract_workbook(self.test_excel, self.configuration)
+        low_memory_configuration = dict(self.configuration, low_memory=True)
+        extraction = etl.extract_workbook(self.test_excel, low_memory_configuration)
+        self.assertEqual(extraction, expected)
@@ -0,0 +1,134 @@
+from datetime import datetime
+import os
+import unittest
+import pytz
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import loaders, models, utils
+
+UTC_TIMEZONE = pytz.timezone('UTC')
+# the COPY tests run against a local PostgreSQL database when one is configured
+POSTGRES_URL = os.environ.get('CAPMETRICS_POSTGRES_URL')
+
+
+def get_system_ridership_rows(count):
+    created_on = UTC_TIMEZONE.localize(datetime(2016, 3, 1))
+    for index in range(count):
+        yield {
+            'calendar_year': 2015,
+            'created_on': created_on,
+            'day_of_week': 'weekday',
+            'is_active': True,
+            'ridership': 100.5 + index,
+            'season': 'Spring',
+            'measurement_timestamp': utils.get_period_timestamp('weekday', 'spring', 2015),
+            'service_type': 'LOCAL' if index % 2 else ''
+        }
+
+
+class CopyBufferTests(unittest.TestCase):
+
+    def test_encode_copy_value(self):
+        self.assertEqual(loaders.encode_copy_value(None), '\\N')
+        self.assertEqual(loaders.encode_copy_value(True), 't')
+        self.assertEqual(loaders.encode_copy_value(12.5), '12.5')
+        self.assertEqual(loaders.encode_copy_value(''), '')
+        self.assertEqual(loaders.encode_copy_value('A\tB\\C\nD'), 'A\\tB\\\\C\\nD')
+        timestamp = UTC_TIMEZONE.localize(datetime(2015, 1, 2, 3, 4, 5))
+        self.assertEqual(loaders.encode_copy_value(timestamp), '2015-01-02T03:04:05+00:00')
+
+    def test_write_copy_buffer(self):
+        table = models.SystemRidership.__table__
+        column_names = ['day_of_week', 'season', 'is_active', 'ridership', 'service_type']
+        processors = loaders.get_bind_processors(table, column_names, postgresql.dialect())
+        rows = list(get_system_ridership_rows(2))
+        rows[0]['service_type'] = None
+        buffer = loaders.write_copy_buffer(rows, column_names, processors)
+        self.assertEqual(buffer.read(), '0\t1\tt\t100.5\t\\N\n0\t1\tt\t101.5\tLOCAL\n')
+
+
+class InsertRowsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(POSTGRES_URL or 'sqlite:///:memory:')
+        models.Base.metadata.create_all(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def check_insert(self):
+        inserted = loaders.insert_rows(self.session, models.SystemRidership,
+                                       get_system_ridership_rows(25), batch_size=10)
+        self.assertEqual(inserted, 25)
+        # still in the session's transaction
+        self.session.rollback()
+        self.assertEqual(self.session.query(models.SystemRidership).count(), 0)
+        loaders.insert_rows(self.session, models.SystemRidership, get_system_ridership_rows(25), batch_size=10)
+        self.session.commit()
+        self.assertEqual(self.session.query(models.SystemRidership).count(), 25)
+        first = self.session.query(models.SystemRidership).order_by(models.SystemRidership.id).first()
+        self.assertEqual((first.day_of_week, first.season, first.ridership, first.service_type),
+                         ('weekday', 'spring', 100.5, ''))
+        self.assertEqual(self.session.query(models.SystemRidership).filter_by(service_type='LOCAL').count(), 12)
+
+    def test_executemany_fallback(self):
+        if POSTGRES_URL:
+            self.skipTest('The fallback runs on SQLite.')
+        self.assertFalse(loaders.supports_copy(self.session.connection()))
+        self.check_insert()
+
+    def test_copy(self):
+        if not POSTGRES_URL:
+            self.skipTest('Set CAPMETRICS_POSTGRES_URL to test COPY against PostgreSQL.')
+        self.assertTrue(loaders.supports_copy(self.session.connection()))
+        self.check_insert()
+
+    def test_empty_rows(self):
+        self.assertEqual(loaders.insert_rows(self.session, models.SystemRidership, []), 0)
+
+
+class UpsertRowsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        models.Base.metadata.create_all(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+        self.session.add(models.PerformanceDocument(name='top-routes', document='[]'))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def get_documents(self):
+        documents = self.session.query(models.PerformanceDocument).order_by(models.PerformanceDocument.name)
+        return [(document.name, document.document) for document in documents]
+
+    def test_upsert(self):
+        statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        rows = [{'name': 'top-routes', 'document': '[1]'}, {'name': 'productivity', 'document': '[2]'}]
+        self.assertEqual(loaders.upsert_rows(self.session, models.PerformanceDocument, rows, ['name']), 2)
+        self.assertEqual(len(statements), 1)
+        self.session.commit()
+        self.assertEqual(self.get_documents(), [('productivity', '[2]'), ('top-routes', '[1]')])
+
+    def test_insert_missing_only(self):
+        rows = [{'name': 'top-routes', 'document': '[1]'}, {'name': 'productivity', 'document': '[2]'}]
+        loaders.upsert_rows(self.session, models.PerformanceDocument, rows, ['name'], update_columns=[])
+        self.session.commit()
+        self.assertEqual(self.get_documents(), [('productivity', '[2]'), ('top-routes', '[]')])
+
+    def test_merge_batch(self):
+        # the path of databases without INSERT ... ON CONFLICT
+        rows = [{'name': 'top-routes', 'document': '[1]'}, {'name': 'productivity', 'document': '[2]'}]
+        loaders.merge_batch(self.session.connection(), models.PerformanceDocument.__table__, rows,
+                            ['name'], ['document'])
+        self.session.commit()
+        self.assertEqual(self.get_documents(), [('productivity', '[2]'), ('top-routes', '[1]')])
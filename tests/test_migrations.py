@@ -0,0 +1,160 @@
+from datetime import datetime
+import unittest
+import pytz
+from sqlalchemy import create_engine, exc, inspect, MetaData, String, text
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import etl, migrations, models
+
+UTC_TIMEZONE = pytz.timezone('UTC')
+
+
+class MigrateLabelColumnsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        # the schema of earlier versions, with string labels
+        legacy_metadata = MetaData()
+        for table in models.Base.metadata.sorted_tables:
+            legacy_table = table.to_metadata(legacy_metadata)
+            for column in legacy_table.columns:
+                if isinstance(column.type, models.LabelCode):
+                    column.type = String()
+        legacy_metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO route (id, route_number, route_name, service_type) "
+                                    "VALUES (1, 1, 'ONE', 'LOCAL')"))
+            connection.execute(text("INSERT INTO daily_ridership (id, is_current, day_of_week, season, "
+                                    "calendar_year, ridership, route_id) "
+                                    "VALUES (1, 1, 'Weekday', 'spring', 2015, 100.0, 1), "
+                                    "(2, 1, 'sunday', 'fall', 2015, 50.0, 1)"))
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_find_legacy_columns(self):
+        legacy_columns = migrations.find_legacy_label_columns(self.engine)
+        self.assertEqual(sorted(column.name for column in legacy_columns['daily_ridership']),
+                         ['day_of_week', 'season'])
+        self.assertEqual([column.name for column in legacy_columns['weekly_performance']], ['season'])
+
+    def test_migration(self):
+        migrated = migrations.migrate_label_columns(self.engine)
+        self.assertIn('daily_ridership', migrated)
+        self.assertEqual(migrations.find_legacy_label_columns(self.engine), {})
+        with self.engine.connect() as connection:
+            codes = connection.execute(text('SELECT day_of_week, season FROM daily_ridership ORDER BY id')).all()
+        self.assertEqual([tuple(row) for row in codes], [(0, 1), (2, 3)])
+        index_names = [index['name'] for index in inspect(self.engine).get_indexes('daily_ridership')]
+        self.assertIn('ix_daily_ridership_route_id', index_names)
+        Session = sessionmaker(bind=self.engine)
+        session = Session()
+        dailies = session.query(models.DailyRidership).order_by(models.DailyRidership.id).all()
+        self.assertEqual([(d.day_of_week, d.season) for d in dailies], [('weekday', 'spring'), ('sunday', 'fall')])
+        self.assertEqual(session.query(models.DailyRidership).filter_by(season='fall').one().id, 2)
+        session.close()
+
+    def test_create_tables_migrates(self):
+        etl.create_tables(self.engine)
+        self.assertEqual(migrations.find_legacy_label_columns(self.engine), {})
+        self.assertEqual(migrations.migrate_label_columns(self.engine), [])
+
+
+class LabelCodeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        models.Base.metadata.create_all(self.engine)
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_transparent_mapping(self):
+        self.session.add(models.SystemRidership(created_on=UTC_TIMEZONE.localize(datetime.now()),
+                                                is_active=True, day_of_week='Saturday', season='WINTER',
+                                                calendar_year=2015, ridership=10, service_type='BUS'))
+        self.session.commit()
+        with self.engine.connect() as connection:
+            stored = connection.execute(text('SELECT day_of_week, season FROM system_ridership')).one()
+        self.assertEqual(tuple(stored), (1, 0))
+        system_ridership = self.session.query(models.SystemRidership).filter_by(day_of_week='saturday').one()
+        self.assertEqual(system_ridership.day_of_week, 'saturday')
+        self.assertEqual(system_ridership.season, 'winter')
+
+    def test_unknown_label(self):
+        self.session.add(models.SystemRidership(day_of_week='holiday', season='winter'))
+        with self.assertRaises(exc.StatementError):
+            self.session.commit()
+        self.session.rollback()
+
+
+class MigrateUniqueIndexesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        # the schema of earlier versions, without unique document names or trend service types
+        legacy_metadata = MetaData()
+        for table in models.Base.metadata.sorted_tables:
+            legacy_table = table.to_metadata(legacy_metadata)
+            for index in legacy_table.indexes:
+                if legacy_table.name in ('performance_document', 'system_trend'):
+                    index.unique = False
+        legacy_metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO performance_document (id, name, document) "
+                                    "VALUES (1, 'top-routes', 'old'), (2, 'top-routes', 'new'), "
+                                    "(3, 'productivity', '[]')"))
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_migration(self):
+        missing = migrations.find_missing_unique_indexes(self.engine)
+        self.assertEqual(sorted(index.name for index in missing),
+                         ['ix_performance_document_name', 'ix_system_trend_service_type'])
+        self.assertEqual(migrations.migrate_unique_indexes(self.engine),
+                         ['ix_performance_document_name', 'ix_system_trend_service_type'])
+        self.assertEqual(migrations.find_missing_unique_indexes(self.engine), [])
+        with self.engine.connect() as connection:
+            documents = connection.execute(text('SELECT name, document FROM performance_document ORDER BY id')).all()
+        self.assertEqual([tuple(row) for row in documents], [('top-routes', 'new'), ('productivity', '[]')])
+        with self.engine.begin() as connection:
+            with self.assertRaises(exc.IntegrityError):
+                connection.execute(text("INSERT INTO performance_document (name) VALUES ('productivity')"))
+
+    def test_create_tables_migrates(self):
+        etl.create_tables(self.engine)
+        self.assertEqual(migrations.find_missing_unique_indexes(self.engine), [])
+
+
+class MigrateIndexesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        # the schema of earlier versions, without the system ridership rollup indexes
+        legacy_metadata = MetaData()
+        for table in models.Base.metadata.sorted_tables:
+            legacy_table = table.to_metadata(legacy_metadata)
+            if legacy_table.name == 'system_ridership':
+                for index in list(legacy_table.indexes):
+                    legacy_table.indexes.remove(index)
+        legacy_metadata.create_all(self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_migration(self):
+        missing = migrations.find_missing_indexes(self.engine)
+        self.assertEqual(sorted(index.name for index in missing),
+                         ['ix_system_ridership_is_active', 'ix_system_ridership_rollup'])
+        self.assertEqual(migrations.migrate_indexes(self.engine),
+                         ['ix_system_ridership_is_active', 'ix_system_ridership_rollup'])
+        self.assertEqual(migrations.find_missing_indexes(self.engine), [])
+        self.assertEqual(migrations.migrate_indexes(self.engine), [])
+
+    def test_create_tables_migrates(self):
+        etl.create_tables(self.engine)
+        index_names = [index['name'] for index in inspect(self.engine).get_indexes('system_ridership')]
+        self.assertIn('ix_system_ridership_rollup', index_names)
+        self.assertIn('ix_system_ridership_is_active', index_names)
@@ -8,7 +8,7 @@ import re
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import xlrd
-from capmetrics_etl import cli, etl, models, utils
+from capmetrics_etl import cli, cube, etl, models, utils
 from capmetrics_etl import performance_documents as perfdocs
 
 UTC_TIMEZONE = pytz.timezone('UTC')
@@ -530,27 +530,25 @@ class UpdateSystemTrendsDocumentTests(unittest.TestCase):
         self.assertTrue('service-type' in attributes)
 
     def test_trend_field_format(self):
-        bus_trend_string = ''
-        rail_trend_string = ''
+        bus_trend = []
+        rail_trend = []
         for system_trend in self.document['data']:
             if system_trend['attributes']['service-type'] == 'RAIL':
-                rail_trend_string = system_trend['attributes']['trend']
+                rail_trend = system_trend['attributes']['trend']
             else:
-                bus_trend_string = system_trend['attributes']['trend']
-        bus_trend = json.loads(bus_trend_string)
-        rail_trend = json.loads(rail_trend_string)
+                bus_trend = system_trend['attributes']['trend']
         self.assertEqual(len(bus_trend), 3)
         self.assertEqual(len(rail_trend), 3)
         self.assertEqual(bus_trend[0][0], '2014-12-29T06:00:00+00:00')
         self.assertEqual(bus_trend[1][0], '2015-03-30T05:00:00+00:00')
         self.assertEqual(bus_trend[2][0], '2015-06-29T05:00:00+00:00')
-        self.assertEqual(bus_trend[0][1], 70000, msg=bus_trend_string)
+        self.assertEqual(bus_trend[0][1], 70000, msg=bus_trend)
         self.assertEqual(bus_trend[1][1], 77000)
         self.assertEqual(bus_trend[2][1], 84000)
         self.assertEqual(rail_trend[0][0], '2014-12-29T06:00:00+00:00')
         self.assertEqual(rail_trend[1][0], '2015-03-30T05:00:00+00:00')
         self.assertEqual(rail_trend[2][0], '2015-06-29T05:00:00+00:00')
-        self.assertEqual(rail_trend[0][1], 7890, msg=rail_trend_string)
+        self.assertEqual(rail_trend[0][1], 7890, msg=rail_trend)
         self.assertEqual(rail_trend[1][1], 6300)
         self.assertEqual(rail_trend[2][1], 8640)
 
@@ -626,3 +624,46 @@ class UpdateProductivityDocumentTests(unittest.TestCase):
         third = period_performance_data[2]['productivity']
         self.assertTrue(first < second)
         self.assertTrue(second < third)
+
+
+class FusedUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        config_parser = configparser.ConfigParser()
+        config_parser.optionxform = str
+        config_parser.read(os.path.join(tests_path, 'capmetrics.ini'))
+        self.config = cli.parse_capmetrics_configuration(config_parser)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def get_documents(self):
+        return {d.name: d.document for d in self.session.query(models.PerformanceDocument)}
+
+    def test_fused_documents_match_database_documents(self):
+        etl.run_excel_etl(self.test_excel, self.session, self.config)
+        fused_documents = self.get_documents()
+        perfdocs.update(self.session)
+        database_documents = self.get_documents()
+        self.assertEqual(set(fused_documents), set(database_documents))
+        for name, document in database_documents.items():
+            self.assertEqual(fused_documents[name], document, msg=name)
+
+    def test_fused_route_document(self):
+        etl.run_excel_etl(self.test_excel, self.session, self.config)
+        fact_cube = cube.FactCube.load(self.session)
+        route = fact_cube.route_records()[0]
+        document = json.loads(perfdocs.build_route_document(self.session, route,
+                                                            fact_cube.route_facts(0, cube.DAILY),
+                                                            fact_cube.route_facts(0, cube.SERVICE_HOUR)))
+        self.assertEqual(document['data']['id'], str(route.id))
+        self.assertEqual(document['data']['attributes']['route-number'], route.route_number)
+        route_model = self.session.query(models.Route).filter_by(id=route.id).one()
+        self.assertEqual(perfdocs.build_route_document(self.session, route_model), json.dumps(document))
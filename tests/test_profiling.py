@@ -0,0 +1,108 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from click.testing import CliRunner
+from capmetrics_etl import cli, profiling
+
+
+def build_list(size):
+    return [str(index) for index in range(size)]
+
+
+def flat_work():
+    return build_list(100000)
+
+
+def outer_work():
+    with profiling.stage('inner'):
+        inner = build_list(200000)
+    return build_list(1000), inner
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_inactive_stage(self):
+        self.assertIsNone(profiling.ACTIVE_PROFILER)
+        with profiling.stage('unprofiled') as stage_profile:
+            self.assertIsNone(stage_profile)
+
+    def test_nested_stages(self):
+        with profiling.profile() as profiler:
+            with profiling.stage('outer'):
+                outer_work()
+            with profiling.stage('outer'):
+                build_list(10)
+        self.assertIsNone(profiling.ACTIVE_PROFILER)
+        self.assertEqual(list(profiler.stages), ['outer', 'inner'])
+        outer, inner = profiler.stages['outer'], profiler.stages['inner']
+        self.assertEqual((outer.calls, inner.calls), (2, 1))
+        self.assertGreater(inner.peak_memory, 0)
+        # the outer stage's peak includes the inner stage, its profile does not
+        self.assertGreaterEqual(outer.peak_memory, inner.peak_memory)
+        self.assertGreaterEqual(outer.wall_time, inner.wall_time)
+        self.assertIn('outer_work', set(function[2] for function in outer.get_stats().stats))
+        self.assertNotIn('outer_work', set(function[2] for function in inner.get_stats().stats))
+        # build_list(200000) ran in the inner stage
+        self.assertGreater(inner.cumulative_time, outer.cumulative_time)
+
+    def test_write(self):
+        with profiling.profile(self.directory):
+            with profiling.stage('outer'):
+                outer_work()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['01-outer.collapsed', '01-outer.pstats', '02-inner.collapsed', '02-inner.pstats',
+                          'summary.txt'])
+        stats = pstats.Stats(os.path.join(self.directory, '02-inner.pstats'))
+        self.assertTrue(any(function[2] == 'build_list' for function in stats.stats))
+        with open(os.path.join(self.directory, '02-inner.collapsed')) as collapsed_file:
+            stacks = [line.rsplit(' ', 1) for line in collapsed_file.read().splitlines()]
+        self.assertTrue(stacks)
+        self.assertTrue(all(microseconds.isdigit() for _, microseconds in stacks))
+        self.assertTrue(any('build_list' in stack for stack, _ in stacks))
+        with open(os.path.join(self.directory, 'summary.txt')) as summary_file:
+            summary = summary_file.read().splitlines()
+        self.assertTrue(summary[0].startswith('stage'))
+        # sorted by cumulative time
+        self.assertTrue(summary[1].startswith('inner'))
+        self.assertTrue(summary[2].startswith('outer'))
+
+    def test_collapsed_stacks_follow_callers(self):
+        with profiling.profile() as profiler:
+            with profiling.stage('flat'):
+                flat_work()
+        stacks = profiling.get_collapsed_stacks(profiler.stages['flat'].get_stats())
+        list_stacks = [stack.split(';') for stack in stacks if stack.endswith('(<listcomp>)')]
+        self.assertTrue(list_stacks)
+        for stack in list_stacks:
+            self.assertEqual([frame.split('(')[-1] for frame in stack[-3:]],
+                             ['flat_work)', 'build_list)', '<listcomp>)'])
+
+
+class ProfileCommandTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.test_config = os.path.join(os.path.dirname(__file__), 'capmetrics_single.ini')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_profile_out(self):
+        profile_directory = os.path.join(self.directory, 'profile')
+        arguments = ['./tests/data/test_cmta_data_single.xls', self.test_config, '--profile-out', profile_directory]
+        result = CliRunner().invoke(cli.etl, arguments)
+        self.assertIsNone(result.exception, msg=result.output)
+        self.assertIn('Capmetrics profile written to', result.output)
+        written = os.listdir(profile_directory)
+        for stage_name in ('quality', 'extract', 'load', 'derived', 'perfdocs', 'perfdocs.route-documents'):
+            self.assertTrue([name for name in written if name.endswith('-{0}.pstats'.format(stage_name))],
+                            msg=stage_name)
+        self.assertIn('summary.txt', written)
@@ -1,6 +1,10 @@
+import json
 import os
 import unittest
-from capmetrics_etl import quality
+from unittest import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import etl, models, quality
 
 
 class TestQualityAssurance(unittest.TestCase):
@@ -30,3 +34,107 @@ class TestQualityAssurance(unittest.TestCase):
     def test_check_ridership_columns(self):
         self.assertTrue(quality.check_for_ridership_columns(self.test_excel,
                                                             self.worksheet_names))
+
+    def test_check_quality(self):
+        self.assertTrue(quality.check_quality(self.test_excel, self.worksheet_names))
+        self.assertFalse(quality.check_quality(self.test_excel, self.worksheet_names + ['Missing']))
+
+    def test_check_quality_without_day_labels(self):
+        # season and year headers are enough, as for check_for_ridership_columns
+        report, parsed_worksheets = quality.validate_workbook(self.test_excel, {
+            'daily_ridership_worksheets': self.worksheet_names,
+            'hour_productivity_worksheets': []
+        })
+        for worksheet_report in report['worksheets'].values():
+            worksheet_report['period_columns'] = 0
+        with mock.patch.object(quality, 'validate_workbook',
+                               return_value=(report, parsed_worksheets)):
+            self.assertTrue(quality.check_quality(self.test_excel, self.worksheet_names))
+
+
+class TestValidateWorkbook(unittest.TestCase):
+
+    def setUp(self):
+        self.configuration = {
+            'daily_ridership_worksheets': [
+                "Ridership by Route Weekday",
+                "Ridership by Route Saturday",
+                "Ridership by Route Sunday"
+            ],
+            'hour_productivity_worksheets': [
+                "Riders per Hour Weekday",
+                "Riders Hour Saturday",
+                "Riders per Hour Sunday"
+            ]
+        }
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data.xls')
+
+    def test_report(self):
+        report, parsed_worksheets = quality.validate_workbook(self.test_excel, self.configuration)
+        self.assertTrue(report['passed'], msg=report['failures'])
+        self.assertEqual(report['missing_worksheets'], [])
+        weekday_report = report['worksheets']['Ridership by Route Weekday']
+        self.assertEqual(weekday_report['route_rows'], 88)
+        self.assertEqual(weekday_report['period_columns'], 11)
+        self.assertEqual(len(parsed_worksheets), 6)
+
+    def test_missing_worksheet(self):
+        self.configuration['hour_productivity_worksheets'].append('Riders per Hour Holiday')
+        report, parsed_worksheets = quality.validate_workbook(self.test_excel, self.configuration)
+        self.assertFalse(report['passed'])
+        self.assertEqual(report['missing_worksheets'], ['Riders per Hour Holiday'])
+        self.assertIsNone(parsed_worksheets['Riders per Hour Holiday'])
+
+    def test_parsed_worksheets_feed_extraction(self):
+        parsed_worksheets = quality.validate_workbook(self.test_excel, self.configuration)[1]
+        shared = etl.extract_workbook(self.test_excel, self.configuration, parsed_worksheets)
+        self.assertEqual(shared, etl.extract_workbook(self.test_excel, self.configuration))
+
+
+class TestValidateWorkbookCached(unittest.TestCase):
+
+    def setUp(self):
+        self.configuration = {
+            'daily_ridership_worksheets': ["Ridership by Route Weekday"],
+            'hour_productivity_worksheets': ["Riders per Hour Weekday"]
+        }
+        tests_path = os.path.dirname(__file__)
+        self.test_excel = os.path.join(tests_path, 'data/test_cmta_data_single.xls')
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_hash_file(self):
+        self.assertEqual(quality.hash_file(self.test_excel),
+                         quality.hash_file(self.test_excel, chunk_size=64))
+
+    def test_cached_verdict(self):
+        report, parsed_worksheets = quality.validate_workbook_cached(self.test_excel,
+                                                                     self.configuration,
+                                                                     self.session)
+        self.assertTrue(report['passed'])
+        self.assertIsNotNone(parsed_worksheets)
+        self.assertEqual(self.session.query(models.QualityCheck).count(), 1)
+        cached_report, cached_worksheets = quality.validate_workbook_cached(self.test_excel,
+                                                                            self.configuration,
+                                                                            self.session)
+        self.assertIsNone(cached_worksheets)
+        self.assertFalse(self.session.in_transaction())
+        self.assertEqual(cached_report, json.loads(json.dumps(report)))
+        self.assertEqual(self.session.query(models.QualityCheck).count(), 1)
+
+    def test_configuration_is_part_of_key(self):
+        quality.validate_workbook_cached(self.test_excel, self.configuration, self.session)
+        self.configuration['hour_productivity_worksheets'] = ['Riders Hour Saturday']
+        report, parsed_worksheets = quality.validate_workbook_cached(self.test_excel,
+                                                                     self.configuration,
+                                                                     self.session)
+        self.assertFalse(report['passed'])
+        self.assertIsNotNone(parsed_worksheets)
+        self.assertEqual(self.session.query(models.QualityCheck).count(), 2)
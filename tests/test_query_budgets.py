@@ -0,0 +1,151 @@
+from collections import Counter
+import configparser
+import contextlib
+import os
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import cli, etl, models, profiling
+from capmetrics_etl import performance_documents as perfdocs
+
+# N+1 query patterns (a query per route, cell or lazy loaded relationship) pass the functional
+# tests but slow down as data grows, so each stage marked with profiling.stage() has a statement
+# budget. The most statements each stage of run_excel_etl may run, whatever the workbook size;
+# the loads grow with the number of 500 row batches only
+ETL_BUDGETS = {
+    'extract': 0,
+    'load': 32,
+    'analyze': 0,
+    'derived': 18,
+    'perfdocs': 0,
+    # the fused builders reuse the derived stages' results and only write their documents
+    'perfdocs.system-trends': 1,
+    'perfdocs.route-documents': 1,
+    'perfdocs.top-routes': 1,
+    'perfdocs.route-sparklines': 1,
+    'perfdocs.productivity': 1
+}
+# the builders reading the database, as ``capmetrics --perfdocs`` does
+PERFDOC_BUDGETS = {
+    'perfdocs.system-trends': 3,
+    'perfdocs.route-documents': 4,
+    'perfdocs.top-routes': 3,
+    'perfdocs.route-sparklines': 3,
+    'perfdocs.productivity': 2
+}
+
+
+class StatementCounter:
+    """
+    Counts the statements run on an engine by stage.
+
+    Attributes:
+        counts (Counter): Statement counts keyed to stage names. Statements run
+            outside the marked stages are counted under ``None``.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.counts = Counter()
+        self.statements = dict()
+        self.running = list()
+
+    def count(self, connection, cursor, statement, parameters, context, executemany):
+        stage_name = self.running[-1] if self.running else None
+        self.counts[stage_name] += 1
+        self.statements.setdefault(stage_name, list()).append(statement)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.running.append(name)
+        try:
+            yield
+        finally:
+            self.running.pop()
+
+    @contextlib.contextmanager
+    def observe(self):
+        event.listen(self.engine, 'before_cursor_execute', self.count)
+        profiling.ACTIVE_PROFILER = self
+        try:
+            yield self
+        finally:
+            profiling.ACTIVE_PROFILER = None
+            event.remove(self.engine, 'before_cursor_execute', self.count)
+
+
+class QueryBudgetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        models.Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def get_configuration(self, ini_name):
+        config_parser = configparser.ConfigParser()
+        # make parsing of config file names case-sensitive
+        config_parser.optionxform = str
+        config_parser.read(os.path.join(os.path.dirname(__file__), ini_name))
+        return cli.parse_capmetrics_configuration(config_parser)
+
+    def check_budgets(self, counter, budgets):
+        for stage_name, count in counter.counts.items():
+            self.assertIn(stage_name, budgets,
+                          msg='Statements ran outside the budgeted stages: {0}'.format(
+                              counter.statements[stage_name][:3]))
+            self.assertLessEqual(count, budgets[stage_name],
+                                 msg='The {0} stage ran {1} statements: {2}'.format(
+                                     stage_name, count, counter.statements[stage_name]))
+
+    def run_excel_etl(self, file_location, ini_name):
+        counter = StatementCounter(self.engine)
+        with counter.observe():
+            etl.run_excel_etl(file_location, self.Session(), self.get_configuration(ini_name))
+        return counter
+
+    def test_single_workbook(self):
+        counter = self.run_excel_etl('./tests/data/test_cmta_data_single.xls', 'capmetrics_single.ini')
+        self.check_budgets(counter, ETL_BUDGETS)
+
+    def test_full_workbook(self):
+        counter = self.run_excel_etl('./tests/data/test_cmta_data.xls', 'capmetrics.ini')
+        self.check_budgets(counter, ETL_BUDGETS)
+
+    def test_updated_workbook(self):
+        # the reload retires and replaces changed facts and rollups
+        etl.run_excel_etl('./tests/data/test_cmta_data.xls', self.Session(), self.get_configuration('capmetrics.ini'))
+        counter = self.run_excel_etl('./tests/data/test_cmta_updated_data.xls', 'capmetrics.ini')
+        self.check_budgets(counter, ETL_BUDGETS)
+
+    def test_derived_stages_do_not_scale(self):
+        single = self.run_excel_etl('./tests/data/test_cmta_data_single.xls', 'capmetrics_single.ini')
+        models.Base.metadata.drop_all(self.engine)
+        models.Base.metadata.create_all(self.engine)
+        full = self.run_excel_etl('./tests/data/test_cmta_data.xls', 'capmetrics.ini')
+        # the full workbook has three times the worksheets and many more periods
+        self.assertLessEqual(full.counts['derived'], single.counts['derived'] + 2)
+        for stage_name in PERFDOC_BUDGETS:
+            self.assertEqual(full.counts[stage_name], single.counts[stage_name])
+
+    def test_perfdoc_builders(self):
+        etl.run_excel_etl('./tests/data/test_cmta_data.xls', self.Session(), self.get_configuration('capmetrics.ini'))
+        session = self.Session()
+        counter = StatementCounter(self.engine)
+        with counter.observe():
+            perfdocs.update(session)
+        session.commit()
+        self.check_budgets(counter, PERFDOC_BUDGETS)
+        self.assertEqual(set(counter.counts), set(PERFDOC_BUDGETS))
+
+    def test_budget_violation_detected(self):
+        counter = StatementCounter(self.engine)
+        session = self.Session()
+        with counter.observe(), profiling.stage('perfdocs.top-routes'):
+            # a query per route, the pattern the budgets guard against
+            for route_number in range(1, 6):
+                session.query(models.Route).filter_by(route_number=route_number).first()
+        with self.assertRaises(AssertionError):
+            self.check_budgets(counter, PERFDOC_BUDGETS)
@@ -0,0 +1,77 @@
+from datetime import datetime
+import unittest
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import etl, models, records, utils
+from capmetrics_etl import performance_documents as perfdocs
+
+UTC_TIMEZONE = pytz.timezone('UTC')
+
+
+class RecordsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+        created_on = UTC_TIMEZONE.localize(datetime.now())
+        for number in range(1, 4):
+            self.session.add(models.Route(id=number, route_number=number,
+                                          route_name='TEST ROUTE {0}'.format(number),
+                                          service_type='LOCAL', is_high_ridership=number == 3))
+            for day in ['weekday', 'saturday', 'sunday']:
+                timestamp = utils.get_period_timestamp(day, 'spring', 2015)
+                self.session.add(models.DailyRidership(created_on=created_on, is_current=True,
+                                                       day_of_week=day, season='spring',
+                                                       calendar_year=2015, ridership=100 * number,
+                                                       route_id=number, measurement_timestamp=timestamp))
+        self.session.add(models.DailyRidership(created_on=created_on, is_current=False,
+                                               day_of_week='weekday', season='spring',
+                                               calendar_year=2015, ridership=1, route_id=1,
+                                               measurement_timestamp=timestamp))
+        self.session.commit()
+        self.session.expunge_all()
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_read_fact_records(self):
+        fact_records = records.read_fact_records(self.session, models.DailyRidership)
+        self.assertEqual(len(fact_records), 9)
+        self.assertEqual([fact.id for fact in fact_records], sorted(fact.id for fact in fact_records))
+        first = fact_records[0]
+        self.assertEqual((first.day_of_week, first.season, first.ridership), ('weekday', 'spring', 100))
+        self.assertTrue(first.is_current)
+        self.assertFalse(hasattr(first, '__dict__'))
+        route_facts = records.read_fact_records(self.session, models.DailyRidership,
+                                                models.DailyRidership.route_id == 2)
+        self.assertEqual(set(fact.route_id for fact in route_facts), {2})
+        # records never enter the identity map
+        self.assertEqual(len(self.session.identity_map), 0)
+
+    def test_group_by_route(self):
+        grouped = records.group_by_route(records.read_fact_records(self.session, models.DailyRidership))
+        self.assertEqual(list(grouped), [1, 2, 3])
+        self.assertEqual(len(grouped[3]), 3)
+
+    def test_read_route_records(self):
+        high = records.read_route_records(self.session, models.Route.is_high_ridership.is_(True))
+        self.assertEqual(high, [records.RouteRecord(3, 3, 'TEST ROUTE 3', 'LOCAL', True)])
+
+    def test_read_system_trend_records(self):
+        etl.update_system_ridership(self.session)
+        etl.update_system_trends(self.session)
+        trend_records = records.read_system_trend_records(self.session)
+        self.assertEqual(len(trend_records), 1)
+        self.assertEqual(trend_records[0].service_type, 'LOCAL')
+        self.assertEqual(trend_records[0].trend, [[utils.get_period_isoformat('weekday', 'spring', 2015), 4200.0]])
+
+    def test_documents_without_fact_instances(self):
+        perfdocs.update_route_documents(self.session)
+        perfdocs.update_route_sparklines(self.session)
+        perfdocs.update_top_routes(self.session)
+        loaded_models = set(type(instance) for instance in self.session.identity_map.values())
+        self.assertTrue(loaded_models <= {models.PerformanceDocument})
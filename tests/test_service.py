@@ -0,0 +1,96 @@
+import configparser
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from capmetrics_etl import cli, models, quality, service
+
+
+class ETLServiceTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        config_parser = configparser.ConfigParser()
+        # make parsing of config file names case-sensitive
+        config_parser.optionxform = str
+        config_parser.read(os.path.join(tests_path, 'capmetrics_single.ini'))
+        self.directory = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.directory, 'inbox')
+        os.mkdir(self.inbox)
+        self.config = cli.parse_capmetrics_configuration(config_parser)
+        self.config['engine_url'] = 'sqlite:///{0}'.format(os.path.join(self.directory, 'capmetrics.db'))
+        self.service = service.ETLService(self.config, self.inbox)
+
+    def tearDown(self):
+        self.service.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def drop(self, name, source=None):
+        location = os.path.join(self.inbox, name)
+        if source is None:
+            open(location, 'w').close()
+        else:
+            shutil.copy(source, location)
+        return location
+
+    def test_service_engine(self):
+        self.assertEqual(self.service.engine.pool.size(), 2)
+        self.assertTrue(self.service.engine.pool._pre_ping)
+        self.assertTrue(os.path.isdir(os.path.join(self.inbox, 'processed')))
+
+    def archived(self, directory):
+        return sorted(name.split('-', 1)[1] for name in os.listdir(os.path.join(self.inbox, directory)))
+
+    def test_jobs(self):
+        self.drop('refresh.perfdocs')
+        self.drop('ridership.xls', './tests/data/test_cmta_data_single.xls')
+        self.drop('notes.txt')
+        self.drop('ridership.xlsx')
+        self.assertEqual([os.path.basename(job) for job in self.service.find_jobs()],
+                         ['refresh.perfdocs', 'ridership.xls'])
+        # first seen
+        self.assertEqual(self.service.poll(), [])
+        reports = self.service.poll()
+        self.assertEqual([report['status'] for report in reports], ['processed', 'processed'])
+        self.assertTrue(all(report['latency_seconds'] >= report['duration_seconds'] for report in reports))
+        self.assertEqual(self.archived('processed'),
+                         ['refresh.perfdocs', 'refresh.perfdocs.json', 'ridership.xls', 'ridership.xls.json'])
+        self.assertEqual(sorted(os.listdir(self.inbox)), ['failed', 'notes.txt', 'processed', 'ridership.xlsx'])
+        session = self.service.Session()
+        self.assertTrue(session.query(models.Route).count() > 0)
+        self.assertTrue(session.query(models.PerformanceDocument).count() > 0)
+        session.close()
+
+    def test_changing_file_waits(self):
+        location = self.drop('ridership.csv')
+        self.assertEqual(self.service.poll(), [])
+        with open(location, 'a') as partial_file:
+            partial_file.write('route_number')
+        self.assertEqual(self.service.poll(), [])
+        self.assertIn('ridership.csv', os.listdir(self.inbox))
+        self.assertEqual(len(self.service.poll()), 1)
+
+    def test_unchanged_redrop_skipped(self):
+        self.drop('ridership.xls', './tests/data/test_cmta_data_single.xls')
+        self.service.serve(interval=0, once=True)
+        self.drop('ridership-again.xls', './tests/data/test_cmta_data_single.xls')
+        # a restarted service remembers the loaded files
+        restarted = service.ETLService(self.config, self.inbox)
+        restarted.poll()
+        reports = restarted.poll()
+        restarted.engine.dispose()
+        self.assertEqual(reports[0]['status'], 'skipped')
+        self.assertEqual(reports[0]['file_hash'], quality.hash_file('./tests/data/test_cmta_data_single.xls'))
+
+    def test_failed_job(self):
+        self.drop('broken.xls')
+        with self.assertLogs('capmetrics_etl.service') as logs:
+            self.service.serve(interval=0, once=True)
+        self.assertTrue(any('broken.xls failed' in line for line in logs.output))
+        self.assertEqual(self.archived('failed'), ['broken.xls', 'broken.xls.json'])
+        report_name = [name for name in os.listdir(os.path.join(self.inbox, 'failed')) if name.endswith('.json')][0]
+        with open(os.path.join(self.inbox, 'failed', report_name)) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['status'], 'failed')
+        self.assertTrue(report['failures'])
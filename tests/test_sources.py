@@ -0,0 +1,89 @@
+import os
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from capmetrics_etl import etl, models, sources, utils
+
+
+class SourceReaderTests(unittest.TestCase):
+
+    def test_csv_reader_selection(self):
+        self.assertEqual(sources.get_source_reader('history.csv'), sources.read_csv_rows)
+        self.assertEqual(sources.get_source_reader('HISTORY.CSV'), sources.read_csv_rows)
+        self.assertEqual(sources.get_source_reader('history.parquet'), sources.read_parquet_rows)
+
+    def test_unsupported_source(self):
+        self.assertFalse(sources.is_source_file('history.xls'))
+        with self.assertRaises(ValueError):
+            sources.get_source_reader('history.xls')
+
+    def test_parse_value(self):
+        self.assertEqual(sources.parse_value('10.5'), 10.5)
+        self.assertEqual(sources.parse_value(7), 7.0)
+        self.assertIsNone(sources.parse_value(''))
+        self.assertIsNone(sources.parse_value(None))
+        self.assertIsNone(sources.parse_value('n/a'))
+
+
+class ExtractSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_csv = os.path.join(tests_path, 'data/test_cmta_data.csv')
+
+    def test_route_info(self):
+        extraction = sources.extract_source(self.test_csv)
+        routes = extraction['routes']['routes']
+        self.assertEqual(len(routes), 3)
+        self.assertEqual(routes[0]['route_number'], '1')
+        self.assertEqual(routes[0]['route_name'], '1-NORTH LAMAR/SOUTH CONGRESS')
+        self.assertEqual(routes[0]['service_type'], 'LOCAL')
+
+    def test_ridership_facts(self):
+        extraction = sources.extract_source(self.test_csv)
+        self.assertEqual(len(extraction[sources.DAILY_RIDERSHIP]), 18)
+        self.assertEqual(len(extraction[sources.SERVICE_HOUR_RIDERSHIP]), 18)
+        fact = extraction[sources.DAILY_RIDERSHIP][0]
+        self.assertEqual(fact['route_number'], 1)
+        self.assertEqual(fact['day_of_week'], 'weekday')
+        self.assertEqual(fact['season'], 'spring')
+        self.assertEqual(fact['year'], 2015)
+        self.assertEqual(fact['ridership'], 1000.0)
+        self.assertEqual(fact['timestamp'], utils.get_period_timestamp('weekday', 'spring', 2015))
+
+
+class RunSourceETLTests(unittest.TestCase):
+
+    def setUp(self):
+        tests_path = os.path.dirname(__file__)
+        self.test_csv = os.path.join(tests_path, 'data/test_cmta_data.csv')
+        self.engine = create_engine('sqlite:///:memory:')
+        Session = sessionmaker()
+        Session.configure(bind=self.engine)
+        self.session = Session()
+        models.Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_load(self):
+        etl.run_source_etl(self.test_csv, self.session)
+        self.assertEqual(self.session.query(models.Route).count(), 3)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 18)
+        self.assertEqual(self.session.query(models.ServiceHourRidership).count(), 18)
+        self.assertEqual(self.session.query(models.WeeklyPerformance).count(), 6)
+        route = self.session.query(models.Route).filter_by(route_number=550).one()
+        self.assertEqual(route.service_type, 'METRORAIL')
+
+    def test_reload_retires_previous_facts(self):
+        etl.run_source_etl(self.test_csv, self.session)
+        etl.run_source_etl(self.test_csv, self.session)
+        self.assertEqual(self.session.query(models.DailyRidership).count(), 36)
+        currents = self.session.query(models.DailyRidership).filter_by(is_current=True).count()
+        self.assertEqual(currents, 18)
+        reports = self.session.query(models.ETLReport)\
+                              .filter_by(etl_type='daily-ridership')\
+                              .order_by(models.ETLReport.id).all()
+        self.assertEqual(reports[-1].creates, 18)
+        self.assertEqual(reports[-1].updates, 18)
+        self.assertEqual(reports[-1].total_models, 36)
@@ -1,5 +1,6 @@
 from datetime import datetime
 import unittest
+import numpy as np
 import pytz
 from capmetrics_etl import utils
 
@@ -148,3 +149,48 @@ class CalibrateDayOfWeekTests(unittest.TestCase):
         self.assertEqual(timestamp.month, 6)
         self.assertEqual(timestamp.day, 7)
         self.assertEqual(timestamp.year, 2015)
+
+
+class PeriodCalendarTests(unittest.TestCase):
+
+    def test_matches_computed_timestamps(self):
+        calendar = utils.PeriodCalendar(2009, 2016)
+        for year in range(2009, 2017):
+            for season in utils.SEASONS:
+                for day_of_week in utils.DAYS_OF_WEEK:
+                    expected = utils.compute_period_timestamp(day_of_week, season, year)
+                    self.assertEqual(calendar.timestamp(day_of_week, season, year), expected)
+                    self.assertEqual(calendar.isoformat(day_of_week, season, year), expected.isoformat())
+
+    def test_calendar_grows(self):
+        utils.get_period_timestamp('weekday', 'spring', 2012)
+        calendar = utils.get_period_calendar(1999, 2030)
+        self.assertTrue(calendar.covers(1999, 2030))
+        self.assertIs(utils.get_period_calendar(2012), calendar)
+
+    def test_case_insensitive_day_of_week(self):
+        self.assertEqual(utils.get_period_timestamp('Sunday', 'fall', 2015),
+                         utils.get_period_timestamp('sunday', 'fall', 2015))
+
+    def test_unknown_labels(self):
+        # unknown labels fall back to weekday and winter, as in compute_period_timestamp
+        self.assertEqual(utils.get_period_timestamp('holiday', 'autumn', 2015),
+                         utils.compute_period_timestamp('holiday', 'autumn', 2015))
+        self.assertEqual(utils.get_period_timestamp('holiday', 'autumn', 2015),
+                         utils.get_period_timestamp('weekday', 'winter', 2015))
+
+    def test_batch_timestamps(self):
+        days = ['weekday', 'Saturday', 'sunday']
+        seasons = ['spring', 'fall', 'winter']
+        years = [2012, 2015, 2010]
+        batch = utils.get_period_timestamps(days, seasons, years)
+        self.assertEqual(batch.dtype, np.dtype('datetime64[s]'))
+        for index in range(3):
+            expected = utils.compute_period_timestamp(days[index], seasons[index], years[index])
+            self.assertEqual(batch[index].item(), expected.replace(tzinfo=None))
+
+    def test_batch_timestamps_with_codes(self):
+        batch = utils.get_period_timestamps(np.array([0, 2]), np.array([1, 3]), np.array([2012, 2015]))
+        by_label = utils.get_period_timestamps(['weekday', 'sunday'], ['spring', 'fall'], [2012, 2015])
+        self.assertTrue((batch == by_label).all())
+        self.assertEqual(len(utils.get_period_timestamps([], [], [])), 0)